@@ -1,46 +1,169 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from datetime import datetime, timezone
+import asyncio
+import os
+import time
+from app import notificaciones
 from app.database import get_db
 from app.models import LoginRequest, Token, Usuario
 from app.utils.security import (
     verify_password, 
     create_access_token, 
     get_password_hash,
-    verify_token
+    verify_token,
+    revocar_token,
+    revocar_tokens_usuario,
+    registrar_token_revocado,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
 )
+from app.utils.cache import TTLCache
 
 router = APIRouter()
 security = HTTPBearer()
 
+# Cache de principales autenticados por id_usuario. USER_CACHE_TTL es la
+# antigüedad máxima tolerada: un cambio de permisos hecho por otro worker
+# tarda como mucho ese tiempo en verse. USER_CACHE_TTL=0 lo deshabilita.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAXSIZE = int(os.getenv("USER_CACHE_MAXSIZE", "1000"))
+
+cache_usuarios = TTLCache(maxsize=USER_CACHE_MAXSIZE, ttl=USER_CACHE_TTL, nombre="usuarios")
+
+def invalidar_usuario(id_usuario: int):
+    """Descarta el principal en cache (desactivación, cambio de asociaciones o de rol)"""
+    cache_usuarios.invalidate(id_usuario)
+
+def revocar_sesiones_usuario(id_usuario: int, revocado_en: float = None):
+    """Invalida de inmediato los tokens y el principal en cache de un usuario desactivado"""
+    revocar_tokens_usuario(id_usuario, revocado_en)
+    invalidar_usuario(id_usuario)
+
+# Las revocaciones se guardan en la base de datos y se avisan a todos los workers
+# (incluido el que las hizo) al hacer commit; cada uno las aplica en su memoria
+AVISO_TOKENS_REVOCADOS = "tokens_revocados"
+AVISO_USUARIOS_REVOCADOS = "usuarios_revocados"
+
+def _recibir_tokens_revocados(tokens):
+    for digest, exp in tokens:
+        registrar_token_revocado(bytes.fromhex(digest), exp)
+
+def _recibir_usuarios_revocados(usuarios):
+    for id_usuario, revocado_en in usuarios:
+        revocar_sesiones_usuario(id_usuario, revocado_en)
+
+_recargas = set()
+
+def _recargar_revocaciones():
+    # Los avisos perdidos mientras la escucha estaba caída se recuperan de la base de datos
+    tarea = asyncio.get_running_loop().create_task(cargar_tokens_revocados())
+    _recargas.add(tarea)
+    tarea.add_done_callback(_recargas.discard)
+
+notificaciones.suscribir(AVISO_TOKENS_REVOCADOS, _recibir_tokens_revocados)
+notificaciones.suscribir(AVISO_USUARIOS_REVOCADOS, _recibir_usuarios_revocados)
+notificaciones.al_reconectar(_recargar_revocaciones)
+
+async def cargar_tokens_revocados():
+    """Carga en memoria los tokens y usuarios revocados vigentes (al iniciar y al reconectar la escucha)"""
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM tokens_revocados WHERE expira <= NOW()")
+            await cur.execute("SELECT digest, expira FROM tokens_revocados")
+            for fila in await cur.fetchall():
+                registrar_token_revocado(bytes(fila['digest']), fila['expira'].timestamp())
+            # Una revocación más vieja que la vida de un token ya no afecta a ninguno
+            await cur.execute(
+                "SELECT id_usuario, sesiones_revocadas_en FROM usuarios "
+                "WHERE sesiones_revocadas_en > NOW() - make_interval(mins => %s)",
+                (ACCESS_TOKEN_EXPIRE_MINUTES,)
+            )
+            for fila in await cur.fetchall():
+                revocar_sesiones_usuario(fila['id_usuario'], fila['sesiones_revocadas_en'].timestamp())
+
+async def desactivar_usuario(cur, id_usuario: int) -> bool:
+    """
+    Desactiva un usuario y revoca todos sus tokens en todos los workers
+    (al hacer commit la transacción de `cur`). Devuelve False si no existe.
+    """
+    revocado_en = time.time()
+    await cur.execute(
+        "UPDATE usuarios SET activo = FALSE, sesiones_revocadas_en = to_timestamp(%s) "
+        "WHERE id_usuario = %s RETURNING id_usuario",
+        (revocado_en, id_usuario)
+    )
+    if await cur.fetchone() is None:
+        return False
+    await notificaciones.notificar_lista(cur, AVISO_USUARIOS_REVOCADOS, [[id_usuario, revocado_en]])
+    return True
+
 @router.post("/login", response_model=Token)
 async def login(login_data: LoginRequest):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM usuarios WHERE email = %s AND activo = TRUE", (login_data.email,))
-            usuario = cur.fetchone()
-            
-            if not usuario or not verify_password(login_data.password, usuario['password_hash']):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Credenciales incorrectas"
-                )
-            
-            access_token = create_access_token(data={"sub": usuario['email'], "id": usuario['id_usuario']})
-            return {"access_token": access_token, "token_type": "bearer"}
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT * FROM usuarios WHERE email = %s AND activo = TRUE", (login_data.email,))
+            usuario = await cur.fetchone()
+    
+    # La verificación bcrypt se hace fuera de la conexión para no retenerla del pool
+    if not usuario or not await verify_password(login_data.password, usuario['password_hash']):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Credenciales incorrectas"
+        )
+    
+    access_token = create_access_token(data={"sub": usuario['email'], "id": usuario['id_usuario']})
+    return {"access_token": access_token, "token_type": "bearer", "tipo_usuario": usuario['tipo_usuario']}
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     payload = verify_token(token)
     
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM usuarios WHERE id_usuario = %s AND activo = TRUE", (payload['id'],))
-            usuario = cur.fetchone()
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido o expirado",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    usuario = cache_usuarios.get(payload['id'])
+    if usuario is not None:
+        return usuario
+    
+    # Generación antes de consultar: si el usuario se invalida (p. ej. desactivación)
+    # mientras tanto, la fila leída no se guarda
+    generacion = cache_usuarios.generacion
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT id_usuario, tipo_usuario, asociaciones_permitidas, activo FROM usuarios WHERE id_usuario = %s AND activo = TRUE",
+                (payload['id'],)
+            )
+            usuario = await cur.fetchone()
             
             if not usuario:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Usuario no encontrado"
                 )
-            
-            return usuario
\ No newline at end of file
+    
+    cache_usuarios.set(usuario['id_usuario'], usuario, generacion=generacion)
+    return usuario
+
+@router.post("/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Revoca el token actual"""
+    payload = verify_token(credentials.credentials)
+    digest = revocar_token(credentials.credentials, payload['exp'])
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "INSERT INTO tokens_revocados (digest, expira) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (digest, datetime.fromtimestamp(payload['exp'], timezone.utc))
+            )
+            await notificaciones.notificar_lista(cur, AVISO_TOKENS_REVOCADOS, [[digest.hex(), payload['exp']]])
+    
+    return {"message": "Sesión cerrada correctamente"}
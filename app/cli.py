@@ -0,0 +1,144 @@
+"""
+Comandos de mantenimiento.
+
+Uso:
+    python -m app.cli estadisticas-reconstruir
+    python -m app.cli estadisticas-verificar
+    python -m app.cli sincronizacion-purgar [--dias N]
+    python -m app.cli calidad-auditar [--regla R] [--limite N]
+    python -m app.cli duplicados-detectar [--completo]
+    python -m app.cli usuarios-desactivar EMAIL
+"""
+import argparse
+import asyncio
+import sys
+
+from app.auth import desactivar_usuario
+from app.database import init_db, close_db, get_db
+from app.utils import calidad, duplicados, estadisticas, sincronizacion
+
+
+async def _estadisticas_reconstruir(args):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            grupos = await estadisticas.reconstruir(cur)
+    print(f"Estadísticas reconstruidas: {grupos} grupos")
+    return 0
+
+
+async def _estadisticas_verificar(args):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            diferencias = await estadisticas.verificar(cur)
+    if not diferencias:
+        print("Estadísticas consistentes")
+        return 0
+    print(f"{len(diferencias)} grupos no coinciden:")
+    for fila in diferencias:
+        print("  ", dict(fila))
+    return 1
+
+
+async def _sincronizacion_purgar(args):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            borradas = await sincronizacion.purgar_lapidas(cur, args.dias)
+    print(f"Lápidas de sincronización borradas: {borradas}")
+    return 0
+
+
+async def _calidad_auditar(args):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            datos = await calidad.cargar(cur)
+    auditoria = calidad.evaluar(datos)
+    resumen = auditoria.resumen()
+    print(
+        f"{resumen['total_granjas']} granjas auditadas en {resumen['duracion_ms']} ms, "
+        f"{resumen['granjas_con_problemas']} con problemas"
+    )
+    reglas = [args.regla] if args.regla else list(calidad.REGLAS)
+    for regla in reglas:
+        datos = resumen["reglas"][regla]
+        print(f"  {regla}: {datos['granjas']} ({datos['descripcion']})")
+        if datos["granjas"] and args.limite:
+            ids, siguiente = auditoria.pagina(regla, limite=args.limite)
+            print(f"    ids: {', '.join(map(str, ids))}{' ...' if siguiente is not None else ''}")
+    return 1 if resumen["granjas_con_problemas"] else 0
+
+
+async def _duplicados_detectar(args):
+    resumen = await duplicados.detectar(completo=args.completo)
+    if resumen is None:
+        print("Otra detección de duplicados está en curso")
+        return 1
+    print(
+        f"Granjas revisadas: {resumen['granjas_revisadas']}{' (completa)' if resumen['completo'] else ''}, "
+        f"pares guardados: {resumen['pares']}, bloques omitidos: {resumen['bloques_omitidos']}"
+    )
+    return 0
+
+
+async def _usuarios_desactivar(args):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id_usuario FROM usuarios WHERE email = %s", (args.email,))
+            usuario = await cur.fetchone()
+            if usuario is None:
+                print(f"No existe el usuario {args.email}")
+                return 1
+            await desactivar_usuario(cur, usuario['id_usuario'])
+    print(f"Usuario {args.email} desactivado; sus tokens quedan revocados")
+    return 0
+
+
+async def _ejecutar(args):
+    await init_db()
+    try:
+        return await args.funcion(args)
+    finally:
+        await close_db()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("estadisticas-reconstruir", help="Recalcula la tabla resumen de estadísticas").set_defaults(
+        funcion=_estadisticas_reconstruir
+    )
+    comandos.add_parser("estadisticas-verificar", help="Compara el resumen con un recálculo completo").set_defaults(
+        funcion=_estadisticas_verificar
+    )
+    purgar = comandos.add_parser(
+        "sincronizacion-purgar", help="Borra las lápidas de granjas eliminadas más viejas que la retención"
+    )
+    purgar.add_argument(
+        "--dias", type=int, default=sincronizacion.SYNC_RETENCION_DIAS,
+        help="Antigüedad mínima de las lápidas a borrar (no menos que SYNC_RETENCION_DIAS)",
+    )
+    purgar.set_defaults(funcion=_sincronizacion_purgar)
+    auditar = comandos.add_parser("calidad-auditar", help="Revisa la calidad de datos de todo el padrón")
+    auditar.add_argument("--regla", choices=list(calidad.REGLAS))
+    auditar.add_argument("--limite", type=int, default=20, help="Ids por regla a mostrar (0 = ninguno)")
+    auditar.set_defaults(funcion=_calidad_auditar)
+    detectar = comandos.add_parser("duplicados-detectar", help="Busca granjas posiblemente duplicadas")
+    detectar.add_argument("--completo", action="store_true", help="Revisar todo el padrón, no solo lo que cambió")
+    detectar.set_defaults(funcion=_duplicados_detectar)
+    desactivar = comandos.add_parser(
+        "usuarios-desactivar", help="Desactiva un usuario y revoca sus tokens en todos los workers"
+    )
+    desactivar.add_argument("email")
+    desactivar.set_defaults(funcion=_usuarios_desactivar)
+
+    args = parser.parse_args(argv)
+    if args.comando == "sincronizacion-purgar" and args.dias < sincronizacion.SYNC_RETENCION_DIAS:
+        parser.error(
+            f"--dias no puede ser menor que SYNC_RETENCION_DIAS ({sincronizacion.SYNC_RETENCION_DIAS}): "
+            "los clientes con tokens de hasta esa antigüedad no verían esas bajas"
+        )
+    return asyncio.run(_ejecutar(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import os
 
-from app.database import init_db, get_db
-from app.routes import granjas, usuarios
-from app.auth import get_current_user
+from app.database import init_db, close_db, get_db
+from app import notificaciones
+from app.utils import auditoria, consultas_lentas, duplicados, eventos
+from app.utils.metricas import MiddlewareMetricas, exponer
+from app.routes import granjas, estadisticas
+from app import auth
+from app.auth import get_current_user, cache_usuarios, cargar_tokens_revocados
+from app.utils.security import get_hash_stats, cache_tokens, puede_modificar_campos_admin
+from app.routes.estadisticas import inicializar_estadisticas
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Inicializar base de datos al iniciar
-    init_db()
+    # Inicializar base de datos al iniciar (pool precalentado)
+    await init_db()
+    await cargar_tokens_revocados()
+    await inicializar_estadisticas()
+    await notificaciones.iniciar()
+    await auditoria.iniciar()
+    await eventos.iniciar()
+    await duplicados.iniciar()
     yield
+    await duplicados.detener()
+    await eventos.detener()
+    await auditoria.detener()
+    await notificaciones.detener()
+    await close_db()
 
 app = FastAPI(
     title="Sistema de Gestión de Granjas",
@@ -27,12 +44,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Total-Count"],
 )
+# Después de CORS para quedar por fuera y medir también sus respuestas
+app.add_middleware(MiddlewareMetricas)
 
 # Incluir rutas
 app.include_router(auth.router, prefix="/api/auth", tags=["Autenticación"])
-app.include_router(usuarios.router, prefix="/api/usuarios", tags=["Usuarios"])
 app.include_router(granjas.router, prefix="/api/granjas", tags=["Granjas"])
+app.include_router(estadisticas.router, prefix="/api/estadisticas", tags=["Estadísticas"])
 
 @app.get("/")
 async def root():
@@ -40,7 +60,43 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "service": "sistema-granjas-api"}
+    return {
+        "status": "healthy",
+        "service": "sistema-granjas-api",
+        "auth_hash": get_hash_stats(),
+        "cache_usuarios": cache_usuarios.stats(),
+        "cache_tokens": cache_tokens.stats(),
+        "cache_granjas": granjas.cache_granjas.stats(),
+        "cache_facetas": granjas.cache_facetas.stats(),
+        "notificaciones": notificaciones.get_notificaciones_stats(),
+        "auditoria": auditoria.get_auditoria_stats(),
+        "consultas_lentas": consultas_lentas.get_consultas_lentas_stats(),
+        "stream": eventos.get_eventos_stats(),
+        "duplicados": duplicados.get_duplicados_stats(),
+    }
+
+@app.get("/api/metrics", include_in_schema=False)
+async def metricas():
+    """Métricas del worker en formato de texto de Prometheus"""
+    return Response(content=exponer(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/slow-queries")
+async def listar_consultas_lentas(
+    limite: int = Query(20, ge=1, le=500),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Consultas lentas de este worker agrupadas por huella, ordenadas por tiempo total (solo admin)"""
+    if not puede_modificar_campos_admin(usuario_actual):
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+    return {**consultas_lentas.get_consultas_lentas_stats(), "consultas": consultas_lentas.top(limite)}
+
+@app.delete("/api/admin/slow-queries")
+async def reiniciar_consultas_lentas(usuario_actual: dict = Depends(get_current_user)):
+    """Vaciar el registro de consultas lentas de este worker (solo admin)"""
+    if not puede_modificar_campos_admin(usuario_actual):
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+    consultas_lentas.reiniciar()
+    return {"mensaje": "Registro de consultas lentas vaciado"}
 
 if __name__ == "__main__":
     import uvicorn
@@ -124,6 +124,31 @@ class GranjaAdminUpdate(BaseModel):
     estatus_actual: Optional[EstatusUnidad] = None
     registro_censo: Optional[bool] = None
 
+class GranjaBatchCampos(GranjaUpdate, GranjaAdminUpdate):
+    # Campos básicos y de administración; los admin solo los puede enviar un admin
+    class Config:
+        extra = "forbid"
+
+class GranjaBatchItem(BaseModel):
+    id_granja: int
+    fields: GranjaBatchCampos
+
+class ModoBatch(str, Enum):
+    TODO_O_NADA = "todo_o_nada"
+    MEJOR_ESFUERZO = "mejor_esfuerzo"
+
+class GranjaBatchUpdate(BaseModel):
+    items: List[GranjaBatchItem]
+    modo: ModoBatch = ModoBatch.TODO_O_NADA
+
+class EstadoDuplicado(str, Enum):
+    PENDIENTE = "pendiente"
+    DUPLICADO = "duplicado"
+    DISTINTO = "distinto"
+
+class DuplicadoRevision(BaseModel):
+    estado: EstadoDuplicado
+
 class Granja(GranjaBase):
     id_granja: int
     # Campos solo admin (ocultos para captura)
@@ -134,6 +159,8 @@ class Granja(GranjaBase):
     creado_por: int
     fecha_creacion: datetime
     fecha_actualizacion: datetime
+    # Se incrementa en cada modificación (bloqueo optimista con If-Match)
+    version: int = 1
 
     class Config:
         from_attributes = True
@@ -144,6 +171,8 @@ class GranjaPublica(GranjaBase):
     creado_por: int
     fecha_creacion: datetime
     fecha_actualizacion: datetime
+    # Se incrementa en cada modificación (bloqueo optimista con If-Match)
+    version: int = 1
 
     class Config:
         from_attributes = True
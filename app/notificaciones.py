@@ -0,0 +1,162 @@
+"""
+Avisos entre workers con LISTEN/NOTIFY de PostgreSQL.
+
+Las rutas publican con `notificar(cur, tipo, datos)` dentro de su transacción;
+PostgreSQL entrega el aviso a todos los workers (incluido el que lo emitió)
+solo si la transacción hace commit. Cada worker mantiene una única conexión
+dedicada, fuera del pool, que escucha el canal y despacha cada aviso a los
+manejadores registrados con `suscribir(tipo, manejador)`.
+
+Mientras la conexión de escucha está caída se pueden perder avisos, así que
+al (re)conectar se llama a los manejadores registrados con `al_reconectar`
+(p. ej. para vaciar caches).
+"""
+from typing import Callable, Dict, List, Optional
+import asyncio
+import json
+import logging
+
+import psycopg
+
+from app.database import DATABASE_URL, DB_CONNECT_TIMEOUT
+from app.utils.metricas import MedidorFuncion
+
+logger = logging.getLogger(__name__)
+
+CANAL = "granjas_eventos"
+# PostgreSQL limita el payload de NOTIFY a 8000 bytes
+MAX_PAYLOAD = 7900
+# Cada cuánto se comprueba que la conexión de escucha sigue viva si no llegan avisos
+LATIDO_S = 30.0
+
+_manejadores: Dict[str, List[Callable]] = {}
+_reconexion: List[Callable] = []
+_tarea: Optional[asyncio.Task] = None
+
+conectado = False
+avisos_recibidos = 0
+
+
+def suscribir(tipo: str, manejador: Callable):
+    """Registra `manejador(datos)` para los avisos de `tipo`; se ejecuta en el event loop y no debe bloquear"""
+    _manejadores.setdefault(tipo, []).append(manejador)
+
+
+def al_reconectar(manejador: Callable):
+    """Registra `manejador()` para cuando la escucha se (re)establece y pudo perder avisos"""
+    _reconexion.append(manejador)
+
+
+def mensaje(tipo: str, datos) -> str:
+    """Payload de un aviso, para publicarlo con pg_notify(CANAL, payload) desde SQL"""
+    payload = json.dumps({"tipo": tipo, "datos": datos}, separators=(",", ":"), default=str)
+    if len(payload.encode()) > MAX_PAYLOAD:
+        raise ValueError(f"Aviso '{tipo}' demasiado grande para NOTIFY ({len(payload)} bytes)")
+    return payload
+
+
+def sql_mensaje(tipo: str, datos: str) -> str:
+    """Equivalente SQL de mensaje(); `datos` es una expresión SQL de tipo json"""
+    return f"json_build_object('tipo', '{tipo}', 'datos', {datos})::text"
+
+
+async def notificar(cur, tipo: str, datos):
+    """Publica un aviso; solo se entrega si la transacción de `cur` hace commit"""
+    await cur.execute("SELECT pg_notify(%s, %s)", (CANAL, mensaje(tipo, datos)))
+
+
+async def notificar_lista(cur, tipo: str, elementos):
+    """Publica una lista (p. ej. de ids) en tantos avisos como haga falta según el límite de NOTIFY"""
+    base = len(mensaje(tipo, []).encode())
+    lote, tamano = [], base
+    for elemento in elementos:
+        # +1 por la coma que lo separa del anterior
+        medida = len(json.dumps(elemento, separators=(",", ":"), default=str).encode()) + 1
+        if lote and tamano + medida > MAX_PAYLOAD:
+            await notificar(cur, tipo, lote)
+            lote, tamano = [], base
+        lote.append(elemento)
+        tamano += medida
+    if lote:
+        await notificar(cur, tipo, lote)
+
+
+def _despachar(payload: str):
+    global avisos_recibidos
+    avisos_recibidos += 1
+    try:
+        aviso = json.loads(payload)
+        tipo, datos = aviso["tipo"], aviso["datos"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Aviso con formato inválido en %s: %.200s", CANAL, payload)
+        return
+    for manejador in _manejadores.get(tipo, ()):
+        try:
+            manejador(datos)
+        except Exception:
+            logger.exception("Error en el manejador de avisos '%s'", tipo)
+
+
+def _reconectado():
+    for manejador in _reconexion:
+        try:
+            manejador()
+        except Exception:
+            logger.exception("Error en el manejador de reconexión")
+
+
+async def _escuchar():
+    global conectado
+    espera = 1.0
+    while True:
+        try:
+            conn = await psycopg.AsyncConnection.connect(
+                DATABASE_URL, autocommit=True, connect_timeout=DB_CONNECT_TIMEOUT
+            )
+            async with conn:
+                await conn.execute(f"LISTEN {CANAL}")
+                conectado = True
+                espera = 1.0
+                _reconectado()
+                while True:
+                    async for aviso in conn.notifies(timeout=LATIDO_S):
+                        _despachar(aviso.payload)
+                    # Sin avisos en LATIDO_S: una consulta detecta conexiones muertas
+                    await conn.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Escucha de %s interrumpida, reintento en %.0f s: %s", CANAL, espera, e)
+        finally:
+            conectado = False
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, 30.0)
+
+
+async def iniciar():
+    """Arranca la escucha del canal en este worker"""
+    global _tarea
+    if _tarea is None:
+        _tarea = asyncio.create_task(_escuchar(), name="notificaciones")
+
+
+async def detener():
+    global _tarea
+    if _tarea is None:
+        return
+    _tarea.cancel()
+    try:
+        await _tarea
+    except asyncio.CancelledError:
+        pass
+    _tarea = None
+
+
+def get_notificaciones_stats() -> dict:
+    return {"canal": CANAL, "conectado": conectado, "avisos_recibidos": avisos_recibidos}
+
+
+MedidorFuncion("granjas_notificaciones_conectado", "1 si la escucha de avisos está conectada", lambda: {(): int(conectado)})
+MedidorFuncion(
+    "granjas_notificaciones_recibidas_total", "Avisos recibidos por LISTEN", lambda: {(): avisos_recibidos}, tipo="counter"
+)
@@ -0,0 +1,141 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import os
+from app.database import get_db
+from app.auth import get_current_user
+from app.utils.security import puede_modificar_campos_admin
+from app.utils import calidad, estadisticas
+from app.utils.cache import TTLCache
+from app.utils.estadisticas import DIMENSIONES, METRICAS
+
+router = APIRouter()
+
+# La auditoría recorre todo el padrón; se reutiliza para paginar sus resultados
+CALIDAD_CACHE_TTL = float(os.getenv("CALIDAD_CACHE_TTL", "300"))
+CALIDAD_MAX_LIMIT = int(os.getenv("CALIDAD_MAX_LIMIT", "10000"))
+
+cache_calidad = TTLCache(maxsize=1, ttl=CALIDAD_CACHE_TTL, nombre="calidad")
+# Una sola auditoría a la vez por worker; las peticiones concurrentes esperan su resultado
+_auditando = asyncio.Lock()
+
+def _requiere_admin(usuario_actual):
+    if not puede_modificar_campos_admin(usuario_actual):
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+
+async def inicializar_estadisticas():
+    """Llena la tabla resumen en el primer arranque (se llama desde el lifespan)"""
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await estadisticas.asegurar_inicializado(cur)
+
+@router.get("/")
+async def obtener_estadisticas(
+    agrupar: str = Query("municipio", description=f"Dimensiones separadas por coma: {', '.join(DIMENSIONES)}"),
+    municipio: Optional[str] = Query(None),
+    asociacion: Optional[str] = Query(None),
+    tipo_produccion: Optional[str] = Query(None),
+    estatus_folio: Optional[str] = Query(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Totales de granjas, casetas, capacidad y población agrupados (desde la tabla resumen)"""
+    dimensiones = [d.strip() for d in agrupar.split(',') if d.strip()]
+    invalidas = [d for d in dimensiones if d not in DIMENSIONES]
+    if invalidas or len(set(dimensiones)) != len(dimensiones):
+        raise HTTPException(status_code=400, detail=f"Dimensiones no válidas: {', '.join(invalidas) or agrupar}")
+    
+    condiciones = ["granjas <> 0"]
+    params = []
+    
+    # Usuarios captura solo ven agregados de sus asociaciones
+    if usuario_actual['tipo_usuario'] == 'captura':
+        if not usuario_actual['asociaciones_permitidas']:
+            return []
+        condiciones.append("asociacion = ANY(%s)")
+        params.append(list(usuario_actual['asociaciones_permitidas']))
+    
+    for dimension, valor in (
+        ('municipio', municipio),
+        ('asociacion', asociacion),
+        ('tipo_produccion', tipo_produccion),
+        ('estatus_folio', estatus_folio),
+    ):
+        if valor is not None:
+            condiciones.append(f"{dimension} = %s")
+            params.append(valor)
+    
+    columnas = [f"NULLIF({d}, '') AS {d}" for d in dimensiones]
+    columnas.append("SUM(granjas)::bigint AS granjas")
+    columnas.extend(f"SUM({m})::bigint AS {m}" for m in METRICAS)
+    query = f"SELECT {', '.join(columnas)} FROM estadisticas_granjas WHERE {' AND '.join(condiciones)}"
+    if dimensiones:
+        posiciones = ', '.join(str(i + 1) for i in range(len(dimensiones)))
+        query += f" GROUP BY {posiciones} ORDER BY {posiciones}"
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            grupos = await cur.fetchall()
+    
+    resultado = []
+    for grupo in grupos:
+        if not grupo['granjas']:
+            continue
+        capacidad = grupo['capacidad_instalada']
+        grupo['ocupacion'] = grupo['poblacion_total'] / capacidad if capacidad else None
+        grupo['poblacion_promedio'] = grupo['poblacion_total'] / grupo['granjas']
+        resultado.append(grupo)
+    return resultado
+
+@router.post("/reconstruir")
+async def reconstruir_estadisticas(usuario_actual: dict = Depends(get_current_user)):
+    """Recalcular la tabla resumen desde cero (solo admin)"""
+    _requiere_admin(usuario_actual)
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            grupos = await estadisticas.reconstruir(cur)
+    return {"message": "Estadísticas reconstruidas", "grupos": grupos}
+
+@router.get("/verificar")
+async def verificar_estadisticas(usuario_actual: dict = Depends(get_current_user)):
+    """Comparar la tabla resumen con un recálculo completo (solo admin)"""
+    _requiere_admin(usuario_actual)
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            diferencias = await estadisticas.verificar(cur)
+    return {"consistente": not diferencias, "diferencias": diferencias}
+
+async def _auditoria(refrescar: bool):
+    auditoria = None if refrescar else cache_calidad.get(())
+    if auditoria is not None:
+        return auditoria
+    async with _auditando:
+        auditoria = None if refrescar else cache_calidad.get(())
+        if auditoria is None:
+            async with get_db() as conn:
+                async with conn.cursor() as cur:
+                    datos = await calidad.cargar(cur)
+            # Las reglas son CPU pura: fuera del event loop
+            auditoria = await run_in_threadpool(calidad.evaluar, datos)
+            cache_calidad.set((), auditoria)
+    return auditoria
+
+@router.get("/calidad")
+async def auditar_calidad(
+    regla: Optional[str] = Query(None, description=f"Devuelve los ids que incumplen esta regla: {', '.join(calidad.REGLAS)}"),
+    despues_de: int = Query(0, ge=0, description="Último id_granja de la página anterior"),
+    limite: int = Query(1000, ge=1, le=CALIDAD_MAX_LIMIT),
+    refrescar: bool = Query(False, description="Ignorar la auditoría en cache y recorrer el padrón otra vez"),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Auditoría de calidad de datos de todo el padrón: conteos por regla e ids infractores paginados (solo admin)"""
+    _requiere_admin(usuario_actual)
+    if regla is not None and regla not in calidad.REGLAS:
+        raise HTTPException(status_code=400, detail=f"Regla no válida: {regla}")
+    auditoria = await _auditoria(refrescar)
+    resultado = auditoria.resumen()
+    if regla is not None:
+        ids, siguiente = auditoria.pagina(regla, despues_de, limite)
+        resultado.update({"regla": regla, "ids": ids, "siguiente": siguiente})
+    return resultado
@@ -1,78 +1,907 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header, Request, Response, UploadFile, File
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import TypeAdapter
+from typing import List, Optional, Union, get_args
+from datetime import datetime
+import os
+import time
+from app import database, notificaciones
 from app.database import get_db
-from app.models import Granja, GranjaCreate, GranjaUpdate, GranjaAdminUpdate, GranjaPublica
-from app.auth import get_current_user
-from app.utils.security import puede_editar_granja, puede_eliminar_granja, puede_modificar_campos_admin, filtrar_campos_admin
+from app.models import (
+    Granja,
+    GranjaCreate,
+    GranjaUpdate,
+    GranjaAdminUpdate,
+    GranjaPublica,
+    GranjaBatchCampos,
+    GranjaBatchUpdate,
+    ModoBatch,
+    DuplicadoRevision,
+    EstadoDuplicado,
+)
+from app.auth import get_current_user, security
+from app.utils import eventos, sincronizacion
+from app.utils import filtros as filtros_listado
+from app.utils.security import (
+    puede_editar_granja,
+    puede_modificar_campos_admin,
+    puede_ver_campos_admin,
+    condicion_editar_granja,
+    columnas_granja,
+    modelo_granja,
+    campos_granja,
+    CAMPOS_GRANJA_ADMIN,
+)
+from app.utils.paginacion import codificar_posicion, decodificar_posicion
+from app.utils.cache import TTLCache
+from app.utils.etag import etag_granja, etag_lista, coincide, versiones_if_match
+from app.utils.exportar import ESCRITORES
+from app.utils.importar import ArchivoInvalido, leer_filas_csv, leer_filas_xlsx, validar_bloque
+from app.utils.geo import FILTRO_CAJA, DISTANCIA_KM, caja_de_radio, tamano_celda
+from app.utils.auditoria import diferencias, registrar, sql_diferencias, sql_registrar
+from app.utils.estadisticas import DIMENSIONES, aplicar_delta, aplicar_delta_tabla, facetas, sql_delta
 
 router = APIRouter()
 
-@router.get("/", response_model=List[Union[Granja, GranjaPublica]])
+# Filas leídas por cada FETCH del cursor de servidor en la exportación
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+# Filas validadas por bloque en la importación y tope de errores detallados en la respuesta
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+IMPORT_MAX_ERRORES = int(os.getenv("IMPORT_MAX_ERRORES", "1000"))
+
+# Campos que solo un admin puede establecer
+CAMPOS_ADMIN_RESTRINGIDOS = ('estatus_anterior', 'estatus_actual', 'registro_censo')
+
+# Campos que cualquier usuario puede establecer al crear (incluye asociación, estratificación, clave INEGI)
+CAMPOS_CREACION = (
+    'asociacion', 'estratificacion', 'clave_municipio_inegi',
+    'municipio', 'nombre_granja', 'propietario_ap_paterno', 
+    'propietario_ap_materno', 'propietario_nombres', 'tipo_produccion',
+    'numero_casetas', 'capacidad_instalada', 'ubicacion_granja',
+    'georreferenciacion_ln', 'georreferenciacion_lo', 'clave_registro_produccion',
+    'estatus_folio', 'poblacion_cerdos_s', 'poblacion_cerdos_hr', 
+    'poblacion_cerdos_hrzo', 'poblacion_cerdos_l', 'poblacion_cerdos_d',
+    'poblacion_cerdos_e', 'poblacion_total', 'tipo_establecimiento_destino',
+    'nombre_establecimiento_destino', 'ubicacion_establecimiento_destino'
+)
+
+# Tamaño de página por defecto y máximo de GET /changes
+SYNC_LIMIT = int(os.getenv("SYNC_LIMIT", "500"))
+SYNC_MAX_LIMIT = int(os.getenv("SYNC_MAX_LIMIT", "5000"))
+
+# Máximo de granjas por PATCH /batch (cada campo es un parámetro del VALUES)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+def _tipo_sql(anotacion):
+    tipos = [t for t in (get_args(anotacion) or (anotacion,)) if t is not type(None)]
+    return {int: 'integer', float: 'double precision', bool: 'boolean'}.get(tipos[0], 'text')
+
+# Tipo SQL de cada campo editable en lote, para tipar las columnas del VALUES
+TIPOS_CAMPOS_BATCH = {
+    campo: _tipo_sql(info.annotation) for campo, info in GranjaBatchCampos.model_fields.items()
+}
+
+# Campos devueltos por las búsquedas geográficas (ligeros para pintar mapas; ninguno es admin)
+COLUMNAS_GEO = (
+    "id_granja, nombre_granja, municipio, asociacion, tipo_produccion, poblacion_total, "
+    "georreferenciacion_ln, georreferenciacion_lo"
+)
+GEO_MAX_LIMIT = int(os.getenv("GEO_MAX_LIMIT", "10000"))
+
+# Campos devueltos por la búsqueda por nombre (ninguno es admin)
+COLUMNAS_BUSQUEDA = (
+    "id_granja, nombre_granja, propietario_ap_paterno, propietario_ap_materno, propietario_nombres, "
+    "municipio, asociacion, tipo_produccion"
+)
+BUSQUEDA_MAX_LIMIT = int(os.getenv("BUSQUEDA_MAX_LIMIT", "100"))
+# Similitud mínima (word_similarity de pg_trgm, 0..1) para considerar una granja como resultado
+BUSQUEDA_UMBRAL = float(os.getenv("BUSQUEDA_UMBRAL", "0.3"))
+
+# Cache de filas completas por id_granja para las lecturas de detalle. Toda
+# escritura lo invalida en el worker local y, vía NOTIFY al hacer commit, en
+# los demás. GRANJA_CACHE_TTL=0 lo deshabilita (p. ej. para depurar).
+GRANJA_CACHE_TTL = float(os.getenv("GRANJA_CACHE_TTL", "30"))
+GRANJA_CACHE_MAXSIZE = int(os.getenv("GRANJA_CACHE_MAXSIZE", "10000"))
+cache_granjas = TTLCache(maxsize=GRANJA_CACHE_MAXSIZE, ttl=GRANJA_CACHE_TTL, nombre="granjas")
+
+AVISO_GRANJAS = "granjas"
+
+def _invalidar_granjas(ids):
+    for id_granja in ids:
+        cache_granjas.invalidate(id_granja)
+
+notificaciones.suscribir(AVISO_GRANJAS, _invalidar_granjas)
+notificaciones.al_reconectar(cache_granjas.clear)
+
+# Conteos de facetas por (asociaciones visibles, filtros). Toda escritura en granjas
+# publica eventos.AVISO_CAMBIOS al hacer commit; al recibirlo cada worker vacía el cache.
+FACETAS_CACHE_TTL = float(os.getenv("FACETAS_CACHE_TTL", "60"))
+FACETAS_CACHE_MAXSIZE = int(os.getenv("FACETAS_CACHE_MAXSIZE", "1000"))
+cache_facetas = TTLCache(maxsize=FACETAS_CACHE_MAXSIZE, ttl=FACETAS_CACHE_TTL, nombre="facetas")
+
+notificaciones.suscribir(eventos.AVISO_CAMBIOS, lambda _cambios: cache_facetas.clear())
+notificaciones.al_reconectar(cache_facetas.clear)
+
+async def _granjas_modificadas(cur, ids):
+    """Invalida las granjas en el cache local y avisa a los demás workers (al hacer commit)"""
+    _invalidar_granjas(ids)
+    await notificaciones.notificar_lista(cur, AVISO_GRANJAS, ids)
+
+def _campos_creacion(usuario_actual):
+    if usuario_actual['tipo_usuario'] == 'admin':
+        return CAMPOS_CREACION + CAMPOS_ADMIN_RESTRINGIDOS
+    return CAMPOS_CREACION
+
+# Un adaptador por modelo de rol: cada respuesta se valida directamente contra
+# el modelo correcto en lugar de probar Union[Granja, GranjaPublica] en orden
+_ADAPTADORES = {
+    modelo: (TypeAdapter(modelo), TypeAdapter(List[modelo]))
+    for modelo in (Granja, GranjaPublica)
+}
+
+def _respuesta_granja(granja, usuario_actual, headers=None):
+    adaptador, _ = _ADAPTADORES[modelo_granja(usuario_actual)]
+    contenido = adaptador.dump_json(adaptador.validate_python(granja))
+    return Response(content=contenido, media_type="application/json", headers=headers)
+
+def _respuesta_granjas(granjas, usuario_actual, headers=None):
+    _, adaptador = _ADAPTADORES[modelo_granja(usuario_actual)]
+    contenido = adaptador.dump_json(adaptador.validate_python(granjas))
+    return Response(content=contenido, media_type="application/json", headers=headers)
+
+def _filtros_granjas(usuario_actual, asociacion=None, municipio=None):
+    """
+    Condiciones WHERE según permisos y filtros del usuario.
+    Devuelve (condiciones, params) o None si el usuario no puede ver ninguna granja.
+    """
+    condiciones = ["1=1"]
+    params = []
+    
+    # Filtro por asociación para usuarios captura
+    if usuario_actual['tipo_usuario'] == 'captura':
+        if not usuario_actual['asociaciones_permitidas']:
+            return None
+        placeholders = ','.join(['%s'] * len(usuario_actual['asociaciones_permitidas']))
+        condiciones.append(f"asociacion IN ({placeholders})")
+        params.extend(usuario_actual['asociaciones_permitidas'])
+    
+    if asociacion:
+        condiciones.append("asociacion = %s")
+        params.append(asociacion)
+    if municipio:
+        condiciones.append("municipio = %s")
+        params.append(municipio)
+    
+    return condiciones, params
+
+async def _facetas(usuario_actual, filtros):
+    """Total y facetas visibles para el usuario, desde cache_facetas o la tabla resumen"""
+    asociaciones = None
+    if usuario_actual['tipo_usuario'] == 'captura':
+        asociaciones = sorted(usuario_actual['asociaciones_permitidas'] or [])
+    clave = (tuple(asociaciones) if asociaciones is not None else None, tuple(filtros.get(d) for d in DIMENSIONES))
+    resultado = cache_facetas.get(clave)
+    if resultado is None:
+        # Generación antes de consultar: si llega un aviso de cambios mientras tanto, no se guarda
+        generacion = cache_facetas.generacion
+        async with get_db() as conn:
+            async with conn.cursor() as cur:
+                resultado = await facetas(cur, filtros, asociaciones)
+        cache_facetas.set(clave, resultado, generacion=generacion)
+    return resultado
+
+async def _contar(usuario_actual, consulta, condiciones, params):
+    """Granjas que cumplen filtros que el resumen no puede contar, desde cache_facetas o con COUNT"""
+    asociaciones = None
+    if usuario_actual['tipo_usuario'] == 'captura':
+        asociaciones = tuple(sorted(usuario_actual['asociaciones_permitidas'] or []))
+    clave = ("conteo", asociaciones, consulta.clave)
+    total = cache_facetas.get(clave)
+    if total is None:
+        generacion = cache_facetas.generacion
+        async with get_db() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT COUNT(*) AS total FROM granjas WHERE {' AND '.join(condiciones)}", params)
+                total = (await cur.fetchone())['total']
+        cache_facetas.set(clave, total, generacion=generacion)
+    return total
+
+@router.get(
+    "/",
+    response_model=List[Union[Granja, GranjaPublica]],
+    description=filtros_listado.describir(),
+)
 async def listar_granjas(
+    request: Request,
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Cursor opaco de la página anterior (header X-Next-Cursor); si se envía se ignora skip"),
+    orden: str = Query(filtros_listado.ORDEN_DEFECTO, description=f"Una de {', '.join(filtros_listado.ORDENES)}; con '-' al inicio es descendente"),
+    include: Optional[str] = Query(None, description="'total': agrega el header X-Total-Count con las granjas que cumplen los filtros"),
+    if_none_match: Optional[str] = Header(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    # Paginación por keyset sobre (columna del orden, id_granja): el costo de cada
+    # página no depende de su profundidad y las inserciones concurrentes no
+    # desplazan filas entre páginas. skip/limit se mantiene para clientes antiguos.
+    try:
+        consulta = filtros_listado.interpretar(
+            request.query_params, puede_ver_campos_admin(usuario_actual), orden
+        )
+    except filtros_listado.FiltroNoPermitido as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except filtros_listado.FiltroInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    posicion = None
+    if cursor:
+        try:
+            posicion = consulta.decodificar(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+    incluir = {i.strip() for i in (include or "").split(',') if i.strip()}
+    if incluir - {"total"}:
+        raise HTTPException(status_code=400, detail="include solo admite 'total'; las facetas están en /api/granjas/facets")
+    
+    filtros = _filtros_granjas(usuario_actual)
+    if filtros is None:
+        return []
+    condiciones, params = filtros
+    condiciones.extend(consulta.condiciones)
+    params.extend(consulta.params)
+    condiciones_total, params_total = list(condiciones), list(params)
+    
+    query = f"FROM granjas WHERE {' AND '.join(condiciones)}"
+    if posicion:
+        query += f" AND {consulta.condicion_posicion}"
+        params.extend(posicion)
+        query += f" ORDER BY {consulta.order_by} LIMIT %s"
+        params.append(limit)
+    else:
+        query += f" ORDER BY {consulta.order_by} LIMIT %s OFFSET %s"
+        params.extend([limit, skip])
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            if if_none_match:
+                # Revalidación: solo se calcula el ETag de la página, sin leer ni serializar las filas
+                await cur.execute(
+                    f"SELECT MAX(fecha_actualizacion) AS max_fecha, COUNT(*) AS filas "
+                    f"FROM (SELECT fecha_actualizacion {query}) AS pagina",
+                    params
+                )
+                pagina = await cur.fetchone()
+                etag = etag_lista(pagina['max_fecha'], pagina['filas'], usuario_actual)
+                if coincide(if_none_match, etag):
+                    return Response(status_code=304, headers={"ETag": etag})
+            
+            await cur.execute(f"SELECT {columnas_granja(usuario_actual)} {query}", params)
+            granjas = await cur.fetchall()
+    
+    headers = {
+        "ETag": etag_lista(max((g['fecha_actualizacion'] for g in granjas), default=None), len(granjas), usuario_actual),
+    }
+    if "total" in incluir:
+        # Si solo se filtra por dimensiones del resumen el total sale de él; si no, COUNT
+        if consulta.dimensiones is not None:
+            dimensiones = {d: tuple(v) for d, v in consulta.dimensiones.items()}
+            total = (await _facetas(usuario_actual, dimensiones))["total"]
+        else:
+            total = await _contar(usuario_actual, consulta, condiciones_total, params_total)
+        headers["X-Total-Count"] = str(total)
+    # El cursor se emite también en modo skip/limit para poder cambiar de modo
+    if len(granjas) == limit:
+        headers["X-Next-Cursor"] = consulta.codificar(granjas[-1])
+    
+    return _respuesta_granjas(granjas, usuario_actual, headers)
+
+@router.get("/facets")
+async def facetas_granjas(
     asociacion: Optional[str] = Query(None),
     municipio: Optional[str] = Query(None),
+    tipo_produccion: Optional[str] = Query(None),
+    estatus_folio: Optional[str] = Query(None),
     usuario_actual: dict = Depends(get_current_user),
 ):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            query = "SELECT * FROM granjas WHERE 1=1"
-            params = []
-            
-            if usuario_actual['tipo_usuario'] == 'captura':
-                if usuario_actual['asociaciones_permitidas']:
-                    placeholders = ','.join(['%s'] * len(usuario_actual['asociaciones_permitidas']))
-                    query += f" AND asociacion IN ({placeholders})"
-                    params.extend(usuario_actual['asociaciones_permitidas'])
-                else:
-                    return []
+    """
+    Valores de asociacion, municipio, tipo_produccion y estatus_folio con su
+    número de granjas bajo los filtros dados, para las listas desplegables, y
+    el total que cumple todos. Cada faceta ignora su propio filtro para
+    mostrar las alternativas. Solo cuenta las asociaciones visibles para el
+    usuario; se calcula con la tabla resumen de estadísticas, no con granjas.
+    """
+    return await _facetas(usuario_actual, {
+        "asociacion": asociacion,
+        "municipio": municipio,
+        "tipo_produccion": tipo_produccion,
+        "estatus_folio": estatus_folio,
+    })
+
+@router.get("/export")
+async def exportar_granjas(
+    formato: str = Query("csv", pattern="^(csv|ndjson|xlsx)$"),
+    asociacion: Optional[str] = Query(None),
+    municipio: Optional[str] = Query(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Exportar el padrón completo visible para el usuario (CSV, NDJSON o XLSX)"""
+    filtros = _filtros_granjas(usuario_actual, asociacion, municipio)
+    campos = campos_granja(usuario_actual)
+    escritor = ESCRITORES[formato](campos)
+    
+    async def generar():
+        yield escritor.inicio()
+        if filtros is not None:
+            condiciones, params = filtros
+            # La conexión se toma dentro del generador: vive mientras dura el streaming.
+            # El cursor con nombre es de servidor, así que la memoria no depende del total de filas.
+            async with get_db() as conn:
+                async with conn.cursor(name="exportar_granjas") as cur:
+                    await cur.execute(
+                        f"SELECT {', '.join(campos)} FROM granjas WHERE {' AND '.join(condiciones)} ORDER BY id_granja",
+                        params
+                    )
+                    while True:
+                        filas = await cur.fetchmany(EXPORT_BATCH_SIZE)
+                        if not filas:
+                            break
+                        yield escritor.lote(filas)
+        yield escritor.fin()
+    
+    nombre = f"granjas_{datetime.now():%Y%m%d_%H%M}.{escritor.extension}"
+    return StreamingResponse(
+        generar(),
+        media_type=escritor.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+@router.post("/import")
+async def importar_granjas(
+    archivo: UploadFile = File(...),
+    dry_run: bool = Query(False, description="Valida y simula la carga sin guardar cambios"),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Importar granjas desde CSV o XLSX (carga con COPY y auditoría en bloque)"""
+    es_admin = usuario_actual['tipo_usuario'] == 'admin'
+    if not es_admin and not usuario_actual['asociaciones_permitidas']:
+        raise HTTPException(status_code=403, detail="No tiene asociaciones asignadas")
+    
+    nombre = (archivo.filename or "").lower()
+    lector = leer_filas_xlsx if nombre.endswith(".xlsx") else leer_filas_csv
+    try:
+        filas = await run_in_threadpool(lector, archivo.file)
+    except ArchivoInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    campos = _campos_creacion(usuario_actual)
+    campos_admin = () if es_admin else CAMPOS_ADMIN_RESTRINGIDOS
+    asociaciones = None if es_admin else usuario_actual['asociaciones_permitidas']
+    leidas, validas, insertadas, errores, total_errores = 0, 0, 0, [], 0
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"CREATE TEMP TABLE granjas_staging ON COMMIT DROP AS "
+                f"SELECT 0 AS fila, {', '.join(campos)} FROM granjas WITH NO DATA"
+            )
             
-            if asociacion:
-                query += " AND asociacion = %s"
-                params.append(asociacion)
-            if municipio:
-                query += " AND municipio = %s"
-                params.append(municipio)
+            async with cur.copy(f"COPY granjas_staging (fila, {', '.join(campos)}) FROM STDIN") as copy:
+                while True:
+                    # Lectura y validación de cada bloque fuera del event loop
+                    try:
+                        bloque, errores_bloque, n = await run_in_threadpool(
+                            validar_bloque, filas, IMPORT_BATCH_SIZE, campos_admin, asociaciones
+                        )
+                    except ArchivoInvalido as e:
+                        raise HTTPException(status_code=400, detail=str(e))
+                    if n == 0:
+                        break
+                    leidas += n
+                    validas += len(bloque)
+                    total_errores += len(errores_bloque)
+                    errores.extend(errores_bloque[:max(0, IMPORT_MAX_ERRORES - len(errores))])
+                    for numero, granja in bloque:
+                        datos = granja.model_dump(mode="json")
+                        await copy.write_row([numero] + [datos[c] for c in campos])
             
-            query += " ORDER BY fecha_creacion DESC LIMIT %s OFFSET %s"
-            params.extend([limit, skip])
+            if validas:
+                # Merge + auditoría en una sola sentencia
+                await cur.execute(
+                    f"""
+                    WITH nuevas AS (
+                        INSERT INTO granjas ({', '.join(campos)}, creado_por, fecha_creacion, fecha_actualizacion)
+                        SELECT {', '.join(campos)}, %s, NOW(), NOW() FROM granjas_staging ORDER BY fila
+                        RETURNING id_granja
+                    )
+                    INSERT INTO logs_cambios (id_usuario, id_granja, tabla_afectada, accion, campo_modificado)
+                    SELECT %s, id_granja, 'granjas', 'INSERT', 'importación masiva' FROM nuevas
+                    """,
+                    (usuario_actual['id_usuario'], usuario_actual['id_usuario'])
+                )
+                insertadas = cur.rowcount
+                await aplicar_delta_tabla(cur, "granjas_staging")
+                await eventos.publicar(cur, [(eventos.IMPORTACION, None, None, None)])
             
-            cur.execute(query, params)
-            granjas = cur.fetchall()
+            if dry_run:
+                await conn.rollback()
+    
+    return {
+        "dry_run": dry_run,
+        "filas_leidas": leidas,
+        "filas_validas": validas,
+        "insertadas": 0 if dry_run else insertadas,
+        "total_errores": total_errores,
+        "errores": errores,
+        "errores_truncados": total_errores > len(errores),
+    }
+
+@router.patch("/batch")
+async def actualizar_granjas_lote(lote: GranjaBatchUpdate, usuario_actual: dict = Depends(get_current_user)):
+    """Actualizar muchas granjas en una transacción (UPDATE ... FROM (VALUES ...))"""
+    if len(lote.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_MAX_ITEMS} granjas por lote")
+    
+    resultados = {}
+    cambios = {}
+    for item in lote.items:
+        campos = item.fields.model_dump(exclude_unset=True, exclude_none=True, mode="json")
+        if item.id_granja in resultados:
+            resultados[item.id_granja] = (400, "id_granja repetido en el lote")
+            cambios.pop(item.id_granja, None)
+        elif not campos:
+            resultados[item.id_granja] = (400, "No hay campos para actualizar")
+        elif not puede_modificar_campos_admin(usuario_actual) and set(campos) & set(CAMPOS_ADMIN_RESTRINGIDOS):
+            resultados[item.id_granja] = (403, "Se requieren permisos de administrador")
+        else:
+            resultados[item.id_granja] = None
+            cambios[item.id_granja] = campos
+    
+    aplicado = False
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            if cambios:
+                # Permisos de todo el lote en una consulta; FOR UPDATE evita cambios entre la verificación y el UPDATE
+                await cur.execute(
+                    "SELECT * FROM granjas WHERE id_granja = ANY(%s) FOR UPDATE",
+                    (list(cambios),)
+                )
+                existentes = {g['id_granja']: g for g in await cur.fetchall()}
+                for id_granja in list(cambios):
+                    if id_granja not in existentes:
+                        resultados[id_granja] = (404, "Granja no encontrada")
+                        del cambios[id_granja]
+                    elif not puede_editar_granja(usuario_actual, existentes[id_granja]):
+                        resultados[id_granja] = (403, "No tiene permisos para editar esta granja")
+                        del cambios[id_granja]
             
-            granjas_filtradas = []
-            for granja in granjas:
-                granja_filtrada = filtrar_campos_admin(granja.copy(), usuario_actual)
-                granjas_filtradas.append(granja_filtrada)
+            hay_errores = any(r is not None for r in resultados.values())
+            if cambios and not (hay_errores and lote.modo == ModoBatch.TODO_O_NADA):
+                columnas = [c for c in TIPOS_CAMPOS_BATCH if any(c in campos for campos in cambios.values())]
+                fila_valores = "(%s::integer, " + ", ".join(f"%s::{TIPOS_CAMPOS_BATCH[c]}" for c in columnas) + ")"
+                params = []
+                for id_granja, campos in cambios.items():
+                    params.append(id_granja)
+                    params.extend(campos.get(c) for c in columnas)
+                
+                # NULL en el VALUES significa "campo no enviado": se conserva el valor actual
+                await cur.execute(
+                    f"""
+                    UPDATE granjas AS g
+                    SET {', '.join(f"{c} = COALESCE(v.{c}, g.{c})" for c in columnas)}, fecha_actualizacion = NOW(), version = g.version + 1
+                    FROM (VALUES {', '.join([fila_valores] * len(cambios))}) AS v (id_granja, {', '.join(columnas)})
+                    WHERE g.id_granja = v.id_granja
+                    RETURNING g.*
+                    """,
+                    params
+                )
+                filas_nuevas = await cur.fetchall()
+                
+                # Resumen, auditoría (un registro por campo que cambió) y avisos en un solo viaje
+                entradas = []
+                for granja in filas_nuevas:
+                    entradas.extend(diferencias(
+                        usuario_actual['id_usuario'], granja['id_granja'], 'UPDATE',
+                        anterior=existentes[granja['id_granja']], nuevo=granja,
+                    ))
+                async with conn.pipeline():
+                    await aplicar_delta(cur, quitar=[existentes[i] for i in cambios], agregar=filas_nuevas)
+                    await registrar(cur, entradas)
+                    await _granjas_modificadas(cur, cambios)
+                    await eventos.publicar(cur, [
+                        ('UPDATE', g['id_granja'], existentes[g['id_granja']]['asociacion'], g['asociacion'])
+                        for g in filas_nuevas
+                    ])
+                aplicado = True
+                for id_granja in cambios:
+                    resultados[id_granja] = (200, "Actualizada")
+            elif cambios:
+                for id_granja in cambios:
+                    resultados[id_granja] = (409, "No aplicada: otras granjas del lote fallaron (modo todo_o_nada)")
+    
+    items = [
+        {"id_granja": id_granja, "status": codigo, "detalle": detalle}
+        for id_granja, (codigo, detalle) in resultados.items()
+    ]
+    actualizadas = sum(1 for i in items if i["status"] == 200)
+    return JSONResponse(
+        status_code=200 if actualizadas == len(items) else 207,
+        content={"modo": lote.modo.value, "aplicado": aplicado, "actualizadas": actualizadas, "items": items},
+    )
+
+@router.get("/geo/bbox")
+async def buscar_granjas_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    modo: str = Query("puntos", pattern="^(puntos|clusters)$"),
+    zoom: int = Query(10, ge=0, le=22, description="Nivel de zoom del mapa (solo modo clusters)"),
+    limit: int = Query(2000, ge=1),
+    asociacion: Optional[str] = Query(None),
+    municipio: Optional[str] = Query(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Granjas dentro de una ventana de mapa, como puntos o agrupadas por celda"""
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="La caja debe cumplir min_lat <= max_lat y min_lon <= max_lon")
+    limit = min(limit, GEO_MAX_LIMIT)
+    
+    filtros = _filtros_granjas(usuario_actual, asociacion, municipio)
+    if filtros is None:
+        return {"modo": modo, "truncado": False, "granjas" if modo == "puntos" else "clusters": []}
+    condiciones, params = filtros
+    condiciones = condiciones + [FILTRO_CAJA]
+    params = params + [min_lon, min_lat, max_lon, max_lat]
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            if modo == "puntos":
+                await cur.execute(
+                    f"SELECT {COLUMNAS_GEO} FROM granjas WHERE {' AND '.join(condiciones)} LIMIT %s",
+                    params + [limit + 1]
+                )
+                granjas = await cur.fetchall()
+                return {"modo": modo, "truncado": len(granjas) > limit, "granjas": granjas[:limit]}
             
-            return granjas_filtradas
+            celda = tamano_celda(zoom)
+            await cur.execute(
+                f"""
+                SELECT COUNT(*) AS granjas,
+                       AVG(georreferenciacion_ln) AS lat,
+                       AVG(georreferenciacion_lo) AS lon,
+                       SUM(COALESCE(poblacion_total, 0))::bigint AS poblacion_total,
+                       CASE WHEN COUNT(*) = 1 THEN MIN(id_granja) END AS id_granja
+                FROM granjas
+                WHERE {' AND '.join(condiciones)}
+                GROUP BY floor(georreferenciacion_ln / %s), floor(georreferenciacion_lo / %s)
+                ORDER BY granjas DESC, lat, lon
+                LIMIT %s
+                """,
+                params + [celda, celda, limit + 1]
+            )
+            clusters = await cur.fetchall()
+            return {"modo": modo, "tamano_celda": celda, "truncado": len(clusters) > limit, "clusters": clusters[:limit]}
+
+@router.get("/geo/radio")
+async def buscar_granjas_radio(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radio_km: float = Query(..., gt=0, le=1000),
+    limit: int = Query(2000, ge=1),
+    asociacion: Optional[str] = Query(None),
+    municipio: Optional[str] = Query(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Granjas a menos de radio_km de un punto, ordenadas por distancia (haversine)"""
+    limit = min(limit, GEO_MAX_LIMIT)
+    filtros = _filtros_granjas(usuario_actual, asociacion, municipio)
+    if filtros is None:
+        return {"truncado": False, "granjas": []}
+    condiciones, params = filtros
+    
+    # Filtro grueso por caja (usa el índice GiST) y después distancia exacta
+    min_lat, min_lon, max_lat, max_lon = caja_de_radio(lat, lon, radio_km)
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                SELECT * FROM (
+                    SELECT {COLUMNAS_GEO}, {DISTANCIA_KM} AS distancia_km
+                    FROM granjas
+                    WHERE {' AND '.join(condiciones + [FILTRO_CAJA])}
+                ) AS candidatas
+                WHERE distancia_km <= %s
+                ORDER BY distancia_km
+                LIMIT %s
+                """,
+                [lat, lat, lon] + params + [min_lon, min_lat, max_lon, max_lat, radio_km, limit + 1]
+            )
+            granjas = await cur.fetchall()
+    return {"truncado": len(granjas) > limit, "granjas": granjas[:limit]}
+
+def _patron_like(termino):
+    return "%" + termino.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+@router.get("/search")
+async def buscar_granjas(
+    q: str = Query(..., min_length=2, max_length=200, description="Nombre de la granja o del propietario"),
+    limit: int = Query(20, ge=1),
+    asociacion: Optional[str] = Query(None),
+    municipio: Optional[str] = Query(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """
+    Búsqueda difusa por nombre de granja y propietario, sin distinguir acentos
+    ni mayúsculas, ordenada por similitud.
+
+    Con pg_trgm usa el índice trigram sobre nombre_busqueda (tolera errores de
+    escritura); sin la extensión recurre a LIKE por palabra, que solo encuentra
+    coincidencias exactas de cada palabra.
+    """
+    limit = min(limit, BUSQUEDA_MAX_LIMIT)
+    filtros = _filtros_granjas(usuario_actual, asociacion, municipio)
+    if filtros is None:
+        return []
+    condiciones, params = filtros
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            if "pg_trgm" in database.extensiones:
+                # El umbral del operador <% se fija solo para esta transacción
+                await cur.execute(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                    (str(BUSQUEDA_UMBRAL),)
+                )
+                await cur.execute(
+                    f"""
+                    SELECT {COLUMNAS_BUSQUEDA},
+                           word_similarity(normalizar_busqueda(%s), nombre_busqueda) AS similitud
+                    FROM granjas
+                    WHERE normalizar_busqueda(%s) <%% nombre_busqueda AND {' AND '.join(condiciones)}
+                    ORDER BY similitud DESC, id_granja
+                    LIMIT %s
+                    """,
+                    [q, q] + params + [limit]
+                )
+            else:
+                await cur.execute("SELECT normalizar_busqueda(%s) AS q", (q,))
+                terminos = (await cur.fetchone())['q'].split()
+                if not terminos:
+                    return []
+                condiciones = condiciones + ["nombre_busqueda LIKE %s"] * len(terminos)
+                await cur.execute(
+                    f"""
+                    SELECT {COLUMNAS_BUSQUEDA},
+                           (%s::float / GREATEST(char_length(nombre_busqueda), 1)) AS similitud
+                    FROM granjas
+                    WHERE {' AND '.join(condiciones)}
+                    ORDER BY similitud DESC, id_granja
+                    LIMIT %s
+                    """,
+                    [sum(len(t) for t in terminos)] + params + [_patron_like(t) for t in terminos] + [limit]
+                )
+            return await cur.fetchall()
+
+@router.get("/changes")
+async def cambios_granjas(
+    since: Optional[str] = Query(None, description="Token de la respuesta anterior; sin él se descargan todas las granjas"),
+    limite: int = Query(SYNC_LIMIT, ge=1, le=SYNC_MAX_LIMIT),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """
+    Cambios desde `since` para sincronizar clientes sin conexión: granjas
+    creadas o modificadas e ids eliminados (o que dejaron las asociaciones del
+    usuario). El cliente aplica primero `eliminadas` y después `granjas`, y
+    guarda `token`; si `hay_mas` pide de inmediato la siguiente página con él.
+    """
+    horizonte, emitido, posicion = 0, None, None
+    if since:
+        try:
+            horizonte, emitido, posicion = sincronizacion.decodificar_token(since)
+        except sincronizacion.TokenExpirado as e:
+            raise HTTPException(status_code=410, detail=str(e))
+        except sincronizacion.TokenInvalido as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    restringido = usuario_actual['tipo_usuario'] == 'captura'
+    params = {"desde": str(horizonte), "limite": limite + 1}
+    if posicion is not None:
+        params.update(txid=str(posicion[0]), id_granja=posicion[2])
+    if restringido:
+        params["asociaciones"] = list(usuario_actual['asociaciones_permitidas'] or [])
+    sql = sincronizacion.sql_cambios(
+        campos_granja(usuario_actual), posicion, restringido, ver_reasignadas=restringido
+    )
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            filas = await cur.fetchall()
+    
+    # En páginas siguientes se conserva el horizonte de la primera: es el que cubre todo lo leído
+    if posicion is None:
+        horizonte, emitido = int(filas[0]['horizonte']), time.time()
+    cambios = [f for f in filas if f['orden'] is not None]
+    hay_mas = len(cambios) > limite
+    cambios = cambios[:limite]
+    
+    siguiente = None
+    if hay_mas:
+        ultimo = cambios[-1]
+        siguiente = (int(ultimo['txid']), ultimo['orden'], ultimo['id_cambio'])
+    _, adaptador = _ADAPTADORES[modelo_granja(usuario_actual)]
+    granjas = [f for f in cambios if f['orden'] == sincronizacion.GRANJA]
+    return {
+        "granjas": adaptador.dump_python(adaptador.validate_python(granjas), mode="json"),
+        "eliminadas": [f['id_cambio'] for f in cambios if f['orden'] == sincronizacion.LAPIDA],
+        "token": sincronizacion.codificar_token(horizonte, emitido, siguiente),
+        "hay_mas": hay_mas,
+    }
+
+@router.get("/stream")
+async def stream_granjas(
+    credenciales: HTTPAuthorizationCredentials = Depends(security),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """
+    Cambios de granjas en vivo (Server-Sent Events): eventos `creada` y
+    `actualizada` con la granja según el rol, `eliminada` con su id y
+    `resincronizar` cuando el cliente debe volver a listar. Solo incluye las
+    granjas de las asociaciones que el usuario puede ver; `actualizada` puede
+    traer una granja que el cliente aún no tenía (cambió a una de ellas).
+    """
+    if not eventos.hay_cupo():
+        raise HTTPException(status_code=503, detail="Demasiados clientes conectados al flujo de cambios")
+    async def vigente():
+        # Token y principal de nuevo: la revocación, la desactivación o un cambio
+        # de permisos llegan al flujo abierto en el siguiente latido
+        try:
+            return await get_current_user(credenciales)
+        except HTTPException:
+            return None
+    
+    return StreamingResponse(
+        eventos.flujo(usuario_actual, vigente),
+        media_type="text/event-stream",
+        # Sin buffer en proxies (nginx) para que cada evento llegue al momento
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+_COLUMNAS_PAR = ", ".join(
+    f"g{lado}.nombre_granja AS nombre_granja_{lado}, "
+    f"concat_ws(' ', g{lado}.propietario_nombres, g{lado}.propietario_ap_paterno, g{lado}.propietario_ap_materno) AS propietario_{lado}, "
+    f"g{lado}.municipio AS municipio_{lado}, g{lado}.asociacion AS asociacion_{lado}"
+    for lado in ("a", "b")
+)
+
+@router.get("/duplicados")
+async def listar_duplicados(
+    estado: EstadoDuplicado = Query(EstadoDuplicado.PENDIENTE),
+    puntaje_min: float = Query(0, ge=0, le=1),
+    limite: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="Valor `siguiente` de la página anterior"),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """
+    Pares de granjas posiblemente duplicadas que encontró la detección en
+    segundo plano (app/utils/duplicados.py), de mayor a menor puntaje (solo admin).
+    """
+    if not puede_modificar_campos_admin(usuario_actual):
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+    
+    condiciones = ["d.estado = %s", "d.puntaje >= %s"]
+    params = [estado.value, puntaje_min]
+    if cursor:
+        try:
+            posicion = decodificar_posicion(cursor, (float, int, int))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        condiciones.append("(d.puntaje, d.id_granja_a, d.id_granja_b) < (%s::real, %s, %s)")
+        params.extend(posicion)
+    params.append(limite)
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"""
+                SELECT d.*, {_COLUMNAS_PAR}
+                FROM granjas_duplicados AS d
+                JOIN granjas AS ga ON ga.id_granja = d.id_granja_a
+                JOIN granjas AS gb ON gb.id_granja = d.id_granja_b
+                WHERE {' AND '.join(condiciones)}
+                ORDER BY d.puntaje DESC, d.id_granja_a DESC, d.id_granja_b DESC
+                LIMIT %s
+                """,
+                params,
+            )
+            pares = await cur.fetchall()
+    
+    siguiente = None
+    if len(pares) == limite:
+        ultimo = pares[-1]
+        siguiente = codificar_posicion(ultimo['puntaje'], ultimo['id_granja_a'], ultimo['id_granja_b'])
+    return {"duplicados": pares, "siguiente": siguiente}
+
+@router.put("/duplicados/{id_granja_a}/{id_granja_b}")
+async def revisar_duplicado(
+    id_granja_a: int,
+    id_granja_b: int,
+    revision: DuplicadoRevision,
+    usuario_actual: dict = Depends(get_current_user),
+):
+    """Marcar un par como duplicado, distinto o devolverlo a pendiente (solo admin)"""
+    if not puede_modificar_campos_admin(usuario_actual):
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                UPDATE granjas_duplicados
+                SET estado = %s, revisado_por = %s, fecha_revision = NOW()
+                WHERE id_granja_a = %s AND id_granja_b = %s
+                RETURNING *
+                """,
+                (revision.estado.value, usuario_actual['id_usuario'],
+                 min(id_granja_a, id_granja_b), max(id_granja_a, id_granja_b)),
+            )
+            par = await cur.fetchone()
+    
+    if par is None:
+        raise HTTPException(status_code=404, detail="Par de granjas no encontrado")
+    return par
 
 @router.get("/{granja_id}", response_model=Union[Granja, GranjaPublica])
-async def obtener_granja(granja_id: int, usuario_actual: dict = Depends(get_current_user)):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM granjas WHERE id_granja = %s", (granja_id,))
-            granja = cur.fetchone()
-            
-            if not granja:
-                raise HTTPException(status_code=404, detail="Granja no encontrada")
-            
-            if usuario_actual['tipo_usuario'] == 'captura':
-                if granja.get('asociacion') not in usuario_actual.get('asociaciones_permitidas', []):
-                    raise HTTPException(status_code=403, detail="No tiene permisos para ver esta granja")
-            
-            return filtrar_campos_admin(granja, usuario_actual)
+async def obtener_granja(
+    granja_id: int,
+    if_none_match: Optional[str] = Header(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    # El cache guarda la fila completa; la respuesta se valida contra el modelo del rol
+    granja = cache_granjas.get(granja_id)
+    parcial = False
+    if granja is None:
+        generacion = cache_granjas.generacion
+        # Sin cache, una revalidación lee primero solo las columnas que deciden permiso y ETag
+        parcial = bool(if_none_match) and not cache_granjas.habilitado
+        columnas = "id_granja, asociacion, version" if parcial else "*"
+        async with get_db() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {columnas} FROM granjas WHERE id_granja = %s", (granja_id,))
+                granja = await cur.fetchone()
+        if granja and not parcial:
+            cache_granjas.set(granja_id, granja, generacion=generacion)
+    
+    if not granja:
+        raise HTTPException(status_code=404, detail="Granja no encontrada")
+    
+    if usuario_actual['tipo_usuario'] == 'captura':
+        if granja.get('asociacion') not in usuario_actual.get('asociaciones_permitidas', []):
+            raise HTTPException(status_code=403, detail="No tiene permisos para ver esta granja")
+    
+    etag = etag_granja(granja['id_granja'], granja['version'], usuario_actual)
+    if coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    if parcial:
+        async with get_db() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {columnas_granja(usuario_actual)} FROM granjas WHERE id_granja = %s", (granja_id,))
+                granja = await cur.fetchone()
+        if not granja:
+            raise HTTPException(status_code=404, detail="Granja no encontrada")
+        etag = etag_granja(granja['id_granja'], granja['version'], usuario_actual)
+    
+    return _respuesta_granja(granja, usuario_actual, {"ETag": etag})
 
-@router.post("/", response_model=Granja)
+@router.post("/", response_model=Union[Granja, GranjaPublica])
 async def crear_granja(granja: GranjaCreate, usuario_actual: dict = Depends(get_current_user)):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            campos_admin_restringidos = ['estatus_anterior', 'estatus_actual', 'registro_censo']
-            
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
             if usuario_actual['tipo_usuario'] != 'admin':
-                for campo in campos_admin_restringidos:
-                    if getattr(granja, campo) is not None:
+                # Solo cuentan los campos enviados: registro_censo tiene default False en el modelo
+                for campo in CAMPOS_ADMIN_RESTRINGIDOS:
+                    if campo in granja.model_fields_set and getattr(granja, campo) is not None:
                         raise HTTPException(
                             status_code=status.HTTP_403_FORBIDDEN,
                             detail=f"No tiene permisos para modificar el campo: {campo}"
@@ -82,22 +911,7 @@ async def crear_granja(granja: GranjaCreate, usuario_actual: dict = Depends(get_
             values = []
             placeholders = []
             
-            campos_permitidos = [
-                'asociacion', 'estratificacion', 'clave_municipio_inegi',
-                'municipio', 'nombre_granja', 'propietario_ap_paterno', 
-                'propietario_ap_materno', 'propietario_nombres', 'tipo_produccion',
-                'numero_casetas', 'capacidad_instalada', 'ubicacion_granja',
-                'georreferenciacion_ln', 'georreferenciacion_lo', 'clave_registro_produccion',
-                'estatus_folio', 'poblacion_cerdos_s', 'poblacion_cerdos_hr', 
-                'poblacion_cerdos_hrzo', 'poblacion_cerdos_l', 'poblacion_cerdos_d',
-                'poblacion_cerdos_e', 'poblacion_total', 'tipo_establecimiento_destino',
-                'nombre_establecimiento_destino', 'ubicacion_establecimiento_destino'
-            ]
-            
-            if usuario_actual['tipo_usuario'] == 'admin':
-                campos_permitidos.extend(campos_admin_restringidos)
-            
-            for field in campos_permitidos:
+            for field in _campos_creacion(usuario_actual):
                 value = getattr(granja, field)
                 if value is not None:
                     columns.append(field)
@@ -109,90 +923,150 @@ async def crear_granja(granja: GranjaCreate, usuario_actual: dict = Depends(get_
             placeholders.extend(['%s', 'NOW()', 'NOW()'])
             
             query = f"INSERT INTO granjas ({', '.join(columns)}) VALUES ({', '.join(placeholders)}) RETURNING *"
-            cur.execute(query, values)
-            nueva_granja = cur.fetchone()
+            await cur.execute(query, values)
+            nueva_granja = await cur.fetchone()
             
-            cur.execute("INSERT INTO logs_cambios (id_usuario, id_granja, tabla_afectada, accion) VALUES (%s, %s, 'granjas', 'INSERT')", 
-                       (usuario_actual['id_usuario'], nueva_granja['id_granja']))
+            async with conn.pipeline():
+                await aplicar_delta(cur, agregar=[nueva_granja])
+                await registrar(cur, diferencias(usuario_actual['id_usuario'], nueva_granja['id_granja'], 'INSERT', nuevo=nueva_granja))
+                await eventos.publicar(cur, [('INSERT', nueva_granja['id_granja'], None, nueva_granja['asociacion'])])
             
-            return nueva_granja
+            return _respuesta_granja(nueva_granja, usuario_actual)
+
+def _sql_modificar_granja(condicion_permiso, accion, campos=()):
+    """
+    Sentencia única para modificar (UPDATE) o borrar (DELETE) una granja:
+    bloquea la fila, aplica el cambio solo si el permiso y la versión
+    (If-Match) se cumplen, y en la misma sentencia actualiza el resumen de
+    estadísticas, escribe la auditoría y avisa a los demás workers y a los
+    clientes del flujo de cambios.
+
+    Devuelve 0 filas si la granja no existe; si existe, una fila con
+    version_actual, permitido y las columnas de la granja resultante (todas
+    NULL si el cambio no se aplicó por permiso o versión).
+    """
+    version = "(%(versiones)s::integer[] IS NULL OR a.version = ANY(%(versiones)s::integer[]))"
+    if accion == 'UPDATE':
+        cambio = f"""
+            UPDATE granjas AS g
+            SET {', '.join(f"{c} = %(v_{c})s" for c in campos)}, fecha_actualizacion = NOW(), version = g.version + 1
+            FROM anterior AS a
+            WHERE g.id_granja = a.id_granja AND {condicion_permiso} AND {version}
+            RETURNING g.*
+        """
+        delta = sql_delta(anterior="anterior", nuevo="cambio")
+        auditoria = sql_registrar(sql_diferencias(campos, accion, anterior="anterior", nuevo="cambio"))
+    else:
+        cambio = f"""
+            DELETE FROM granjas AS g
+            USING anterior AS a
+            WHERE g.id_granja = a.id_granja AND {condicion_permiso} AND {version}
+            RETURNING g.*
+        """
+        delta = sql_delta(anterior="cambio")
+        auditoria = sql_registrar(sql_diferencias(CAMPOS_GRANJA_ADMIN, accion, anterior="cambio"))
+    return f"""
+        WITH anterior AS (
+            SELECT * FROM granjas WHERE id_granja = %(id_granja)s FOR UPDATE
+        ),
+        cambio AS ({cambio}),
+        delta AS ({delta}),
+        auditoria AS ({auditoria}),
+        aviso AS (
+            SELECT pg_notify(%(canal)s, %(aviso)s), {eventos.sql_publicar(accion, "a", "c" if accion == 'UPDATE' else None)}
+            FROM anterior AS a JOIN cambio AS c USING (id_granja)
+        )
+        SELECT a.version AS version_actual, {condicion_permiso} AS permitido,
+               (SELECT COUNT(*) FROM aviso) AS avisos, c.*
+        FROM anterior AS a
+        LEFT JOIN cambio AS c ON TRUE
+    """
+
+async def _modificar_granja(cur, usuario_actual, granja_id, if_match, accion, cambios=None, verificar_permiso=True):
+    """
+    Ejecuta _sql_modificar_granja en un solo viaje y traduce el resultado:
+    404 si no existe, 403 sin permiso, 409 si If-Match no coincide con la versión actual.
+    """
+    if verificar_permiso:
+        condicion, params = condicion_editar_granja(usuario_actual, "a")
+    else:
+        condicion, params = "TRUE", {}
+    cambios = cambios or {}
+    params.update({f"v_{campo}": valor for campo, valor in cambios.items()})
+    params.update(
+        id_granja=granja_id,
+        versiones=versiones_if_match(if_match, granja_id),
+        id_usuario=usuario_actual['id_usuario'],
+        canal=notificaciones.CANAL,
+        aviso=notificaciones.mensaje(AVISO_GRANJAS, [granja_id]),
+    )
+    await cur.execute(_sql_modificar_granja(condicion, accion, tuple(cambios)), params)
+    resultado = await cur.fetchone()
+    
+    if not resultado:
+        raise HTTPException(status_code=404, detail="Granja no encontrada")
+    if not resultado['permitido']:
+        accion_texto = "editar" if accion == 'UPDATE' else "eliminar"
+        raise HTTPException(status_code=403, detail=f"No tiene permisos para {accion_texto} esta granja")
+    if resultado['id_granja'] is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"La granja fue modificada por otro usuario (versión actual {resultado['version_actual']})",
+            headers={"ETag": etag_granja(granja_id, resultado['version_actual'], usuario_actual)},
+        )
+    _invalidar_granjas([granja_id])
+    return resultado
+
+def _campos_enviados(modelo):
+    return {campo: valor for campo, valor in modelo.dict(exclude_unset=True).items() if valor is not None}
 
 @router.put("/{granja_id}", response_model=Union[Granja, GranjaPublica])
-async def actualizar_granja(granja_id: int, granja_update: GranjaUpdate, usuario_actual: dict = Depends(get_current_user)):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM granjas WHERE id_granja = %s", (granja_id,))
-            granja_existente = cur.fetchone()
-            
-            if not granja_existente:
-                raise HTTPException(status_code=404, detail="Granja no encontrada")
-            
-            if not puede_editar_granja(usuario_actual, granja_existente):
-                raise HTTPException(status_code=403, detail="No tiene permisos para editar esta granja")
-            
-            update_fields = []
-            values = []
-            
-            for field, value in granja_update.dict(exclude_unset=True).items():
-                if value is not None:
-                    update_fields.append(f"{field} = %s")
-                    values.append(value)
-            
-            if not update_fields:
-                raise HTTPException(status_code=400, detail="No hay campos para actualizar")
-            
-            values.append(granja_id)
-            query = f"UPDATE granjas SET {', '.join(update_fields)}, fecha_actualizacion = NOW() WHERE id_granja = %s RETURNING *"
-            cur.execute(query, values)
-            granja_actualizada = cur.fetchone()
-            
-            cur.execute("INSERT INTO logs_cambios (id_usuario, id_granja, tabla_afectada, accion) VALUES (%s, %s, 'granjas', 'UPDATE')", 
-                       (usuario_actual['id_usuario'], granja_id))
-            
-            return filtrar_campos_admin(granja_actualizada, usuario_actual)
+async def actualizar_granja(
+    granja_id: int,
+    granja_update: GranjaUpdate,
+    if_match: Optional[str] = Header(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    cambios = _campos_enviados(granja_update)
+    if not cambios:
+        raise HTTPException(status_code=400, detail="No hay campos para actualizar")
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            granja = await _modificar_granja(cur, usuario_actual, granja_id, if_match, 'UPDATE', cambios)
+    
+    return _respuesta_granja(granja, usuario_actual, {"ETag": etag_granja(granja_id, granja['version'], usuario_actual)})
 
 @router.put("/{granja_id}/admin", response_model=Granja)
-async def actualizar_campos_admin(granja_id: int, admin_update: GranjaAdminUpdate, usuario_actual: dict = Depends(get_current_user)):
+async def actualizar_campos_admin(
+    granja_id: int,
+    admin_update: GranjaAdminUpdate,
+    if_match: Optional[str] = Header(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
     if not puede_modificar_campos_admin(usuario_actual):
         raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
     
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM granjas WHERE id_granja = %s", (granja_id,))
-            if not cur.fetchone():
-                raise HTTPException(status_code=404, detail="Granja no encontrada")
-            
-            update_fields = []
-            values = []
-            
-            for field, value in admin_update.dict(exclude_unset=True).items():
-                if value is not None:
-                    update_fields.append(f"{field} = %s")
-                    values.append(value)
-            
-            if not update_fields:
-                raise HTTPException(status_code=400, detail="No hay campos para actualizar")
-            
-            values.append(granja_id)
-            query = f"UPDATE granjas SET {', '.join(update_fields)}, fecha_actualizacion = NOW() WHERE id_granja = %s RETURNING *"
-            cur.execute(query, values)
-            return cur.fetchone()
+    cambios = _campos_enviados(admin_update)
+    if not cambios:
+        raise HTTPException(status_code=400, detail="No hay campos para actualizar")
+    
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            granja = await _modificar_granja(
+                cur, usuario_actual, granja_id, if_match, 'UPDATE', cambios, verificar_permiso=False
+            )
+    
+    return _respuesta_granja(granja, usuario_actual, {"ETag": etag_granja(granja_id, granja['version'], usuario_actual)})
 
 @router.delete("/{granja_id}")
-async def eliminar_granja(granja_id: int, usuario_actual: dict = Depends(get_current_user)):
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM granjas WHERE id_granja = %s", (granja_id,))
-            granja = cur.fetchone()
-            
-            if not granja:
-                raise HTTPException(status_code=404, detail="Granja no encontrada")
-            
-            if not puede_eliminar_granja(usuario_actual, granja):
-                raise HTTPException(status_code=403, detail="No tiene permisos para eliminar esta granja")
-            
-            cur.execute("DELETE FROM granjas WHERE id_granja = %s", (granja_id,))
-            cur.execute("INSERT INTO logs_cambios (id_usuario, id_granja, tabla_afectada, accion) VALUES (%s, %s, 'granjas', 'DELETE')", 
-                       (usuario_actual['id_usuario'], granja_id))
-            
-            return {"message": "Granja eliminada correctamente"}
\ No newline at end of file
+async def eliminar_granja(
+    granja_id: int,
+    if_match: Optional[str] = Header(None),
+    usuario_actual: dict = Depends(get_current_user),
+):
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await _modificar_granja(cur, usuario_actual, granja_id, if_match, 'DELETE')
+    
+    return {"message": "Granja eliminada correctamente"}
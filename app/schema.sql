@@ -0,0 +1,228 @@
+-- Esquema base del sistema de granjas.
+-- Se aplica en init_db() al arrancar; todas las sentencias son idempotentes.
+
+CREATE TABLE IF NOT EXISTS usuarios (
+    id_usuario SERIAL PRIMARY KEY,
+    nombre VARCHAR(150) NOT NULL,
+    email VARCHAR(150) NOT NULL UNIQUE,
+    password_hash VARCHAR(255) NOT NULL,
+    tipo_usuario VARCHAR(20) NOT NULL DEFAULT 'captura',
+    asociaciones_permitidas TEXT[] NOT NULL DEFAULT '{}',
+    activo BOOLEAN NOT NULL DEFAULT TRUE,
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS granjas (
+    id_granja SERIAL PRIMARY KEY,
+    asociacion VARCHAR(150),
+    estratificacion VARCHAR(100),
+    clave_municipio_inegi VARCHAR(10),
+    municipio VARCHAR(150) NOT NULL,
+    nombre_granja VARCHAR(200) NOT NULL,
+    propietario_ap_paterno VARCHAR(100) NOT NULL,
+    propietario_ap_materno VARCHAR(100),
+    propietario_nombres VARCHAR(150) NOT NULL,
+    clave_registro_produccion VARCHAR(50),
+    estatus_folio VARCHAR(20),
+    tipo_produccion VARCHAR(30) NOT NULL,
+    numero_casetas INTEGER NOT NULL,
+    capacidad_instalada INTEGER NOT NULL,
+    poblacion_cerdos_s INTEGER DEFAULT 0,
+    poblacion_cerdos_hr INTEGER DEFAULT 0,
+    poblacion_cerdos_hrzo INTEGER DEFAULT 0,
+    poblacion_cerdos_l INTEGER DEFAULT 0,
+    poblacion_cerdos_d INTEGER DEFAULT 0,
+    poblacion_cerdos_e INTEGER DEFAULT 0,
+    poblacion_total INTEGER DEFAULT 0,
+    tipo_establecimiento_destino VARCHAR(30),
+    nombre_establecimiento_destino VARCHAR(200),
+    ubicacion_establecimiento_destino VARCHAR(255),
+    ubicacion_granja VARCHAR(255),
+    georreferenciacion_ln DOUBLE PRECISION,
+    georreferenciacion_lo DOUBLE PRECISION,
+    -- Campos solo admin
+    estatus_anterior VARCHAR(30),
+    estatus_actual VARCHAR(30),
+    registro_censo BOOLEAN DEFAULT FALSE,
+    -- Auditoría
+    creado_por INTEGER NOT NULL REFERENCES usuarios (id_usuario),
+    fecha_creacion TIMESTAMP NOT NULL DEFAULT NOW(),
+    fecha_actualizacion TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS logs_cambios (
+    id_log SERIAL PRIMARY KEY,
+    id_usuario INTEGER REFERENCES usuarios (id_usuario),
+    id_granja INTEGER,
+    tabla_afectada VARCHAR(50) NOT NULL,
+    accion VARCHAR(20) NOT NULL,
+    campo_modificado VARCHAR(100),
+    valor_anterior TEXT,
+    valor_nuevo TEXT,
+    fecha_cambio TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Outbox de auditoría (AUDITORIA_MODO=outbox): una fila por transacción con sus
+-- entradas; el relevo de cada worker las mueve a logs_cambios
+CREATE TABLE IF NOT EXISTS auditoria_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    entradas JSONB NOT NULL,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Tokens revocados por logout; se cargan en memoria al iniciar
+CREATE TABLE IF NOT EXISTS tokens_revocados (
+    digest BYTEA PRIMARY KEY,
+    expira TIMESTAMPTZ NOT NULL
+);
+
+-- Desactivación (app/auth.py desactivar_usuario): invalida todo token emitido hasta
+-- ese momento; las revocaciones aún vigentes se cargan en memoria al iniciar
+ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS sesiones_revocadas_en TIMESTAMPTZ;
+
+-- Resumen de estadísticas por municipio / asociación / tipo de producción / estatus de folio.
+-- Lo mantienen con deltas las rutas que escriben en granjas (app/utils/estadisticas.py);
+-- las dimensiones NULL se guardan como ''.
+CREATE TABLE IF NOT EXISTS estadisticas_granjas (
+    municipio VARCHAR(150) NOT NULL,
+    asociacion VARCHAR(150) NOT NULL,
+    tipo_produccion VARCHAR(30) NOT NULL,
+    estatus_folio VARCHAR(20) NOT NULL,
+    granjas BIGINT NOT NULL DEFAULT 0,
+    numero_casetas BIGINT NOT NULL DEFAULT 0,
+    capacidad_instalada BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_s BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_hr BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_hrzo BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_l BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_d BIGINT NOT NULL DEFAULT 0,
+    poblacion_cerdos_e BIGINT NOT NULL DEFAULT 0,
+    poblacion_total BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (municipio, asociacion, tipo_produccion, estatus_folio)
+);
+
+-- Versión de la fila para bloqueo optimista (If-Match); cada modificación la incrementa
+ALTER TABLE granjas ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+-- Normalización para búsqueda sin acentos ni mayúsculas. translate/lower son inmutables,
+-- así que no depende de la extensión unaccent y se puede usar en una columna generada.
+CREATE OR REPLACE FUNCTION normalizar_busqueda(texto TEXT) RETURNS TEXT AS $$
+    SELECT lower(translate(
+        texto,
+        'ÁÀÂÄÃáàâäãÉÈÊËéèêëÍÌÎÏíìîïÓÒÔÖÕóòôöõÚÙÛÜúùûüÑñÇç',
+        'aaaaaaaaaaeeeeeeeeiiiiiiiioooooooooouuuuuuuunncc'
+    ))
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+-- Texto de búsqueda de la granja (nombre y propietario); el índice trigram está en schema_pg_trgm.sql
+ALTER TABLE granjas ADD COLUMN IF NOT EXISTS nombre_busqueda TEXT GENERATED ALWAYS AS (
+    normalizar_busqueda(
+        nombre_granja || ' ' || propietario_ap_paterno || ' '
+        || COALESCE(propietario_ap_materno, '') || ' ' || propietario_nombres
+    )
+) STORED;
+
+-- Índices para la paginación por keyset de listar_granjas (fecha_creacion, id_granja)
+CREATE INDEX IF NOT EXISTS idx_granjas_fecha_creacion_id ON granjas (fecha_creacion, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_asociacion_fecha_id ON granjas (asociacion, fecha_creacion, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_municipio_fecha_id ON granjas (municipio, fecha_creacion, id_granja);
+-- Filtros y órdenes de listar_granjas (app/utils/filtros.py): el resto de dimensiones
+-- con el mismo orden, los otros órdenes permitidos y las granjas sin coordenadas
+-- (el predicado debe implicarse por las condiciones georreferenciacion_*_nulo=true)
+CREATE INDEX IF NOT EXISTS idx_granjas_tipo_fecha_id ON granjas (tipo_produccion, fecha_creacion, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_estatus_fecha_id ON granjas (estatus_folio, fecha_creacion, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_actualizacion_id ON granjas (fecha_actualizacion, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_nombre_id ON granjas (nombre_granja, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_sin_coordenadas ON granjas (fecha_creacion, id_granja)
+    WHERE georreferenciacion_ln IS NULL OR georreferenciacion_lo IS NULL;
+-- Índice espacial nativo (GiST sobre point, sin PostGIS) para búsquedas por caja y radio;
+-- la expresión debe coincidir con PUNTO_GRANJA en app/utils/geo.py
+CREATE INDEX IF NOT EXISTS idx_granjas_geo ON granjas USING gist (point(georreferenciacion_lo, georreferenciacion_ln));
+CREATE INDEX IF NOT EXISTS idx_logs_cambios_granja ON logs_cambios (id_granja);
+
+-- Sincronización incremental (GET /api/granjas/changes, app/utils/sincronizacion.py):
+-- cada alta o modificación marca la fila con el id de su transacción y cada baja, o
+-- cambio de asociación, deja una lápida. Con triggers para que ninguna ruta lo olvide.
+ALTER TABLE granjas ADD COLUMN IF NOT EXISTS txid_cambio xid8 NOT NULL DEFAULT '0';
+
+CREATE TABLE IF NOT EXISTS granjas_eliminadas (
+    id BIGSERIAL PRIMARY KEY,
+    id_granja INTEGER NOT NULL,
+    asociacion VARCHAR(150),
+    motivo VARCHAR(20) NOT NULL,  -- 'eliminada' o 'reasignada' (dejó la asociación)
+    txid_cambio xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    fecha TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION marcar_cambio_granja() RETURNS trigger AS $$
+BEGIN
+    NEW.txid_cambio := pg_current_xact_id();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION registrar_lapida_granja() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO granjas_eliminadas (id_granja, asociacion, motivo)
+    VALUES (OLD.id_granja, OLD.asociacion, CASE TG_OP WHEN 'DELETE' THEN 'eliminada' ELSE 'reasignada' END);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- Solo si no existen: recrearlos en cada arranque bloquearía la tabla
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'granjas'::regclass AND tgname = 'granjas_marcar_cambio') THEN
+        CREATE TRIGGER granjas_marcar_cambio BEFORE INSERT OR UPDATE ON granjas
+            FOR EACH ROW EXECUTE FUNCTION marcar_cambio_granja();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'granjas'::regclass AND tgname = 'granjas_lapida') THEN
+        CREATE TRIGGER granjas_lapida AFTER DELETE ON granjas
+            FOR EACH ROW EXECUTE FUNCTION registrar_lapida_granja();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'granjas'::regclass AND tgname = 'granjas_lapida_reasignada') THEN
+        CREATE TRIGGER granjas_lapida_reasignada AFTER UPDATE OF asociacion ON granjas
+            FOR EACH ROW WHEN (OLD.asociacion IS DISTINCT FROM NEW.asociacion)
+            EXECUTE FUNCTION registrar_lapida_granja();
+    END IF;
+END
+$$;
+
+-- Páginas de cambios en orden (txid_cambio, id_granja): sin cambios es una sola lectura de cada índice
+CREATE INDEX IF NOT EXISTS idx_granjas_txid_cambio_id ON granjas (txid_cambio, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_eliminadas_txid_id ON granjas_eliminadas (txid_cambio, id_granja);
+CREATE INDEX IF NOT EXISTS idx_granjas_eliminadas_fecha ON granjas_eliminadas (fecha);
+
+-- Detección de granjas duplicadas (app/utils/duplicados.py). Bloque por apellido del
+-- propietario y municipio normalizados; la expresión debe coincidir con clave_propietario()
+CREATE INDEX IF NOT EXISTS idx_granjas_bloque_propietario
+    ON granjas (normalizar_busqueda(trim(propietario_ap_paterno)), normalizar_busqueda(trim(municipio)));
+
+-- Pares candidatos para revisión, con id_granja_a < id_granja_b. Cada ejecución recalcula
+-- los pares de las granjas que cambiaron; los ya revisados conservan su estado.
+CREATE TABLE IF NOT EXISTS granjas_duplicados (
+    id_granja_a INTEGER NOT NULL REFERENCES granjas (id_granja) ON DELETE CASCADE,
+    id_granja_b INTEGER NOT NULL REFERENCES granjas (id_granja) ON DELETE CASCADE,
+    puntaje REAL NOT NULL,
+    similitud_nombre REAL NOT NULL,
+    similitud_propietario REAL NOT NULL,
+    distancia_km REAL,
+    bloques VARCHAR(30) NOT NULL,  -- 'propietario', 'ubicacion' o ambos separados por coma
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',  -- 'pendiente', 'duplicado' o 'distinto'
+    revisado_por INTEGER REFERENCES usuarios (id_usuario),
+    fecha_revision TIMESTAMP,
+    fecha_calculo TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id_granja_a, id_granja_b),
+    CHECK (id_granja_a < id_granja_b)
+);
+CREATE INDEX IF NOT EXISTS idx_granjas_duplicados_b ON granjas_duplicados (id_granja_b);
+CREATE INDEX IF NOT EXISTS idx_granjas_duplicados_revision
+    ON granjas_duplicados (estado, puntaje, id_granja_a, id_granja_b);
+
+-- Horizonte (xid8) de la última ejecución completada: la siguiente solo recalcula
+-- las granjas con txid_cambio mayor o igual
+CREATE TABLE IF NOT EXISTS duplicados_estado (
+    unica BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (unica),
+    horizonte xid8 NOT NULL,
+    fecha TIMESTAMP NOT NULL DEFAULT NOW()
+);
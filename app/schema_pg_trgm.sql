@@ -0,0 +1,3 @@
+-- Se aplica solo si la extensión pg_trgm está disponible (ver init_db).
+-- Índice trigram para la búsqueda difusa de /api/granjas/search.
+CREATE INDEX IF NOT EXISTS idx_granjas_busqueda_trgm ON granjas USING gin (nombre_busqueda gin_trgm_ops);
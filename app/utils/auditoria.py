@@ -0,0 +1,200 @@
+"""
+Auditoría de cambios en granjas (tabla logs_cambios).
+
+`diferencias()` compara la fila que la ruta ya leyó con la devuelta por
+RETURNING y genera una entrada por campo modificado, con su valor anterior
+y nuevo; `registrar()` las escribe todas de una vez según AUDITORIA_MODO:
+
+- transaccion: INSERT multi-fila en logs_cambios dentro de la misma transacción.
+- outbox: un único INSERT (JSONB) en auditoria_outbox dentro de la transacción;
+  un relevo en segundo plano mueve los lotes a logs_cambios. Es igual de
+  durable (el outbox confirma o se revierte con el cambio) y deja fuera de la
+  petición la escritura en logs_cambios y su índice.
+"""
+from datetime import date, datetime
+from enum import Enum
+from typing import Optional
+import asyncio
+import logging
+import os
+
+from psycopg.types.json import Jsonb
+
+from app.database import get_db
+from app.utils.metricas import MedidorFuncion
+
+logger = logging.getLogger(__name__)
+
+MODOS = ("transaccion", "outbox")
+AUDITORIA_MODO = os.getenv("AUDITORIA_MODO", "transaccion")
+if AUDITORIA_MODO not in MODOS:
+    raise ValueError(f"AUDITORIA_MODO debe ser uno de {', '.join(MODOS)}")
+# Entradas del outbox movidas por sentencia y espera del relevo cuando queda vacío
+AUDITORIA_LOTE = int(os.getenv("AUDITORIA_LOTE", "5000"))
+AUDITORIA_INTERVALO_S = float(os.getenv("AUDITORIA_INTERVALO_S", "1"))
+
+# Identidad, metadatos y columnas derivadas: no son cambios del usuario
+CAMPOS_NO_AUDITADOS = frozenset({
+    'id_granja', 'creado_por', 'fecha_creacion', 'fecha_actualizacion', 'nombre_busqueda', 'version',
+    'txid_cambio',
+})
+
+_COLUMNAS_LOG = "id_usuario, id_granja, tabla_afectada, accion, campo_modificado, valor_anterior, valor_nuevo"
+
+_SQL_INSERTAR = f"""
+    INSERT INTO logs_cambios ({_COLUMNAS_LOG})
+    SELECT * FROM unnest(%s::integer[], %s::integer[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+"""
+
+# Cada elemento del outbox es [id_usuario, id_granja, tabla, accion, campo, anterior, nuevo];
+# fecha_cambio es la de la transacción que lo escribió
+_SQL_RELEVO = f"""
+    WITH lote AS (
+        DELETE FROM auditoria_outbox
+        WHERE id IN (SELECT id FROM auditoria_outbox ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING id, entradas, fecha
+    )
+    INSERT INTO logs_cambios ({_COLUMNAS_LOG}, fecha_cambio)
+    SELECT (e->>0)::integer, (e->>1)::integer, e->>2, e->>3, e->>4, e->>5, e->>6, l.fecha
+    FROM lote AS l, jsonb_array_elements(l.entradas) WITH ORDINALITY AS x (e, n)
+    ORDER BY l.id, x.n
+"""
+
+_tarea: Optional[asyncio.Task] = None
+_stats = {"relevadas": 0, "errores": 0}
+
+
+def _texto(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, Enum):
+        return str(valor.value)
+    if isinstance(valor, bool):
+        # Igual que el cast ::text de PostgreSQL que usa sql_diferencias()
+        return "true" if valor else "false"
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def diferencias(id_usuario: int, id_granja: int, accion: str, anterior: Optional[dict] = None, nuevo: Optional[dict] = None):
+    """
+    Entradas de auditoría por campo entre dos versiones de una granja.
+    Sin `anterior` es un alta y sin `nuevo` una baja (se guardan los valores
+    no nulos). Si no cambió ningún campo se devuelve una sola entrada sin
+    campo para que la operación quede registrada.
+    """
+    if anterior is not None and nuevo is not None:
+        campos = [c for c in nuevo if c in anterior]
+    else:
+        campos = list(nuevo if nuevo is not None else anterior)
+
+    entradas = []
+    for campo in campos:
+        if campo in CAMPOS_NO_AUDITADOS:
+            continue
+        antes = anterior.get(campo) if anterior is not None else None
+        despues = nuevo.get(campo) if nuevo is not None else None
+        if antes != despues:
+            entradas.append((id_usuario, id_granja, 'granjas', accion, campo, _texto(antes), _texto(despues)))
+    return entradas or [(id_usuario, id_granja, 'granjas', accion, None, None, None)]
+
+
+def sql_diferencias(campos, accion: str, anterior: str = None, nuevo: str = None) -> str:
+    """
+    Equivalente SQL de diferencias() entre relaciones de la misma sentencia
+    (p. ej. CTEs con la fila antes y después, unidas por id_granja). Compara
+    los `campos` como texto y usa el parámetro nombrado %(id_usuario)s.
+    """
+    campos = [c for c in campos if c not in CAMPOS_NO_AUDITADOS]
+    if anterior and nuevo:
+        origen = f"{anterior} AS a JOIN {nuevo} AS n USING (id_granja)"
+    else:
+        origen = f"{anterior or nuevo} AS {'a' if anterior else 'n'}"
+    valor_a = (lambda c: f"a.{c}::text") if anterior else (lambda c: "NULL::text")
+    valor_n = (lambda c: f"n.{c}::text") if nuevo else (lambda c: "NULL::text")
+    valores = ", ".join(f"('{c}', {valor_a(c)}, {valor_n(c)})" for c in campos)
+    # LEFT JOIN: si ningún campo cambió queda una fila sin campo, como en diferencias()
+    return f"""
+        SELECT %(id_usuario)s::integer, id_granja, 'granjas', '{accion}', d.campo, d.anterior, d.nuevo
+        FROM {origen}
+        LEFT JOIN LATERAL (
+            SELECT * FROM (VALUES {valores}) AS v (campo, anterior, nuevo)
+            WHERE v.anterior IS DISTINCT FROM v.nuevo
+        ) AS d ON TRUE
+    """
+
+
+def sql_registrar(origen: str) -> str:
+    """Equivalente SQL de registrar() para las entradas de la consulta `origen`, usable como CTE"""
+    if AUDITORIA_MODO == "outbox":
+        return f"""
+            INSERT INTO auditoria_outbox (entradas)
+            SELECT jsonb_agg(jsonb_build_array(o.e0, o.e1, o.e2, o.e3, o.e4, o.e5, o.e6))
+            FROM ({origen}) AS o (e0, e1, e2, e3, e4, e5, e6)
+            HAVING COUNT(*) > 0
+        """
+    return f"INSERT INTO logs_cambios ({_COLUMNAS_LOG}) {origen}"
+
+
+async def registrar(cur, entradas):
+    """Escribe las entradas en la transacción de `cur` con una sola sentencia"""
+    entradas = list(entradas)
+    if not entradas:
+        return
+    if AUDITORIA_MODO == "outbox":
+        await cur.execute("INSERT INTO auditoria_outbox (entradas) VALUES (%s)", (Jsonb(entradas),))
+    else:
+        await cur.execute(_SQL_INSERTAR, [list(columna) for columna in zip(*entradas)])
+
+
+async def relevar_outbox(cur, lote: int = AUDITORIA_LOTE) -> int:
+    """Mueve hasta `lote` transacciones del outbox a logs_cambios; devuelve las entradas movidas"""
+    await cur.execute(_SQL_RELEVO, (lote,))
+    return cur.rowcount
+
+
+async def _relevo():
+    while True:
+        try:
+            async with get_db() as conn:
+                async with conn.cursor() as cur:
+                    movidas = await relevar_outbox(cur)
+            _stats["relevadas"] += movidas
+            if movidas:
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errores"] += 1
+            logger.exception("Error al relevar el outbox de auditoría")
+        await asyncio.sleep(AUDITORIA_INTERVALO_S)
+
+
+async def iniciar():
+    """Arranca el relevo del outbox en este worker (solo en modo outbox)"""
+    global _tarea
+    if AUDITORIA_MODO == "outbox" and _tarea is None:
+        _tarea = asyncio.create_task(_relevo(), name="auditoria-outbox")
+
+
+async def detener():
+    global _tarea
+    if _tarea is None:
+        return
+    _tarea.cancel()
+    try:
+        await _tarea
+    except asyncio.CancelledError:
+        pass
+    _tarea = None
+
+
+def get_auditoria_stats() -> dict:
+    return {"modo": AUDITORIA_MODO, **_stats}
+
+
+MedidorFuncion(
+    "granjas_auditoria_outbox_eventos_total", "Entradas movidas del outbox de auditoría y errores del relevo",
+    lambda: {(clave,): valor for clave, valor in _stats.items()}, etiquetas=("dato",), tipo="counter",
+)
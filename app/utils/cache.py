@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+import threading
+import time
+
+from app.utils.metricas import MedidorFuncion
+
+# Todas las instancias, para exponer sus métricas
+_caches = []
+
+
+class TTLCache:
+    """
+    Cache LRU acotado en memoria con expiración por entrada.
+
+    Cada entrada vence a los `ttl` segundos de insertarse o en el instante
+    `expira_en` (time.time()) indicado al guardarla, lo que ocurra primero.
+    Con maxsize <= 0 o ttl <= 0 el cache queda deshabilitado.
+
+    `generacion` aumenta con cada invalidación. Quien lee de la base de datos
+    para llenar el cache la toma antes de consultar y la pasa a set(): si hubo
+    una invalidación mientras tanto, el valor (posiblemente viejo) se descarta.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, nombre: str = ""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.nombre = nombre
+        self.habilitado = maxsize > 0 and ttl > 0
+        self._datos: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expiraciones = 0
+        self.invalidaciones = 0
+        self.generacion = 0
+        _caches.append(self)
+
+    def get(self, clave: Hashable) -> Optional[Any]:
+        if not self.habilitado:
+            return None
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            valor, vence = entrada
+            if vence <= time.monotonic():
+                del self._datos[clave]
+                self.expiraciones += 1
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def set(self, clave: Hashable, valor: Any, expira_en: Optional[float] = None, generacion: Optional[int] = None):
+        if not self.habilitado:
+            return
+        ahora = time.monotonic()
+        vence = ahora + self.ttl
+        if expira_en is not None:
+            # expira_en es tiempo de reloj (p. ej. el `exp` de un JWT)
+            vence = min(vence, ahora + (expira_en - time.time()))
+        if vence <= ahora:
+            return
+        with self._lock:
+            if generacion is not None and generacion != self.generacion:
+                return
+            self._datos[clave] = (valor, vence)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, clave: Hashable) -> bool:
+        with self._lock:
+            self.generacion += 1
+            if self._datos.pop(clave, None) is None:
+                return False
+            self.invalidaciones += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.generacion += 1
+            self.invalidaciones += len(self._datos)
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+    def stats(self) -> dict:
+        consultas = self.hits + self.misses
+        return {
+            "nombre": self.nombre,
+            "habilitado": self.habilitado,
+            "tamano": len(self._datos),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / consultas if consultas else 0.0,
+            "evictions": self.evictions,
+            "expiraciones": self.expiraciones,
+            "invalidaciones": self.invalidaciones,
+        }
+
+
+def _por_cache(atributo):
+    return lambda: {(c.nombre,): (len(c) if atributo == "tamano" else getattr(c, atributo)) for c in _caches}
+
+
+for _atributo, _tipo, _ayuda in (
+    ("tamano", "gauge", "Entradas en el cache"),
+    ("hits", "counter", "Aciertos del cache"),
+    ("misses", "counter", "Fallos del cache"),
+    ("evictions", "counter", "Entradas desalojadas por tamaño (LRU)"),
+    ("invalidaciones", "counter", "Entradas invalidadas"),
+):
+    MedidorFuncion(
+        f"granjas_cache_{_atributo}" + ("_total" if _tipo == "counter" else ""), _ayuda,
+        _por_cache(_atributo), etiquetas=("cache",), tipo=_tipo,
+    )
@@ -0,0 +1,208 @@
+"""
+Auditoría de calidad de datos sobre el padrón completo.
+
+`cargar()` trae en una sola consulta las columnas que revisan las reglas,
+cada una como un arreglo en el formato binario de PostgreSQL
+(array_send(array_agg(...))), y `evaluar()` interpreta cada uno directamente
+como un arreglo NumPy: los NULL se reemplazan en SQL, así que todos los
+elementos miden lo mismo y no se crea un objeto de Python por valor. Cada
+regla es después una operación vectorizada sobre todas las granjas a la vez.
+
+georreferenciacion_ln es la latitud y georreferenciacion_lo la longitud con
+signo (ver app/utils/geo.py); las coordenadas se comparan con la caja del
+estado de Sonora y la clave INEGI con el catálogo de sus municipios.
+"""
+from datetime import datetime
+import time
+
+import numpy as np
+
+ESTADO_INEGI = 26
+
+# Catálogo INEGI de municipios de Sonora: nombre -> clave de municipio (sin la del estado)
+MUNICIPIOS_SONORA = {
+    "Aconchi": 1, "Agua Prieta": 2, "Álamos": 3, "Altar": 4, "Arivechi": 5, "Arizpe": 6,
+    "Atil": 7, "Bacadéhuachi": 8, "Bacanora": 9, "Bacerac": 10, "Bacoachi": 11, "Bácum": 12,
+    "Banámichi": 13, "Baviácora": 14, "Bavispe": 15, "Benjamín Hill": 16, "Caborca": 17,
+    "Cajeme": 18, "Cananea": 19, "Carbó": 20, "La Colorada": 21, "Cucurpe": 22, "Cumpas": 23,
+    "Divisaderos": 24, "Empalme": 25, "Etchojoa": 26, "Fronteras": 27, "Granados": 28,
+    "Guaymas": 29, "Hermosillo": 30, "Huachinera": 31, "Huásabas": 32, "Huatabampo": 33,
+    "Huépac": 34, "Imuris": 35, "Magdalena": 36, "Mazatán": 37, "Moctezuma": 38, "Naco": 39,
+    "Nácori Chico": 40, "Nacozari de García": 41, "Navojoa": 42, "Nogales": 43, "Ónavas": 44,
+    "Opodepe": 45, "Oquitoa": 46, "Pitiquito": 47, "Puerto Peñasco": 48, "Quiriego": 49,
+    "Rayón": 50, "Rosario": 51, "Sahuaripa": 52, "San Felipe de Jesús": 53, "San Javier": 54,
+    "San Luis Río Colorado": 55, "San Miguel de Horcasitas": 56, "San Pedro de la Cueva": 57,
+    "Santa Ana": 58, "Santa Cruz": 59, "Sáric": 60, "Soyopa": 61, "Suaqui Grande": 62,
+    "Tepache": 63, "Trincheras": 64, "Tubutama": 65, "Ures": 66, "Villa Hidalgo": 67,
+    "Villa Pesqueira": 68, "Yécora": 69, "General Plutarco Elías Calles": 70,
+    "Benito Juárez": 71, "San Ignacio Río Muerto": 72,
+}
+
+# Caja que contiene al estado (grados), con un margen pequeño
+LAT_MIN, LAT_MAX = 26.2, 32.6
+LON_MIN, LON_MAX = -115.2, -108.3
+
+REGLAS = {
+    "poblacion_total": "poblacion_total distinta de la suma de poblacion_cerdos_*",
+    "sobre_capacidad": "poblacion_total mayor que capacidad_instalada",
+    "coordenadas_incompletas": "solo una de georreferenciacion_ln / georreferenciacion_lo",
+    "coordenadas_invertidas": "latitud y longitud intercambiadas",
+    "longitud_sin_signo": "longitud positiva (falta el signo negativo del oeste)",
+    "coordenadas_fuera": "coordenadas fuera del estado",
+    "municipio_desconocido": "municipio que no está en el catálogo INEGI del estado",
+    "clave_municipio": "clave_municipio_inegi que no corresponde al municipio",
+}
+
+CAMPOS_POBLACION = (
+    "poblacion_cerdos_s", "poblacion_cerdos_hr", "poblacion_cerdos_hrzo",
+    "poblacion_cerdos_l", "poblacion_cerdos_d", "poblacion_cerdos_e",
+)
+
+# (nombre, expresión, tipo SQL, tipo NumPy del formato binario: big-endian).
+# Los NULL se reemplazan para que todos los elementos tengan el mismo tamaño:
+# poblaciones -> 0, coordenadas -> NaN, clave -> 0 (vacía) o -1 (no numérica);
+# clave_esperada es la del catálogo para el municipio, -1 si no está en él
+_COLUMNAS = (
+    ("id_granja", "g.id_granja", "integer", ">i4"),
+    ("poblacion_total", "COALESCE(g.poblacion_total, 0)", "integer", ">i4"),
+    *((c, f"COALESCE(g.{c}, 0)", "integer", ">i4") for c in CAMPOS_POBLACION),
+    ("capacidad_instalada", "g.capacidad_instalada", "integer", ">i4"),
+    ("latitud", "COALESCE(g.georreferenciacion_ln, 'NaN')", "double precision", ">f8"),
+    ("longitud", "COALESCE(g.georreferenciacion_lo, 'NaN')", "double precision", ">f8"),
+    ("clave", "COALESCE(k.clave, 0)", "integer", ">i4"),
+    ("clave_esperada", "COALESCE(m.clave, -1)", "integer", ">i4"),
+)
+
+# Municipio y clave tienen pocos valores distintos: se normalizan y validan
+# una vez por valor (DISTINCT) y no una vez por granja
+_SQL_CARGAR = f"""
+    SELECT {", ".join(f"array_send(array_agg(({expresion})::{tipo})) AS {nombre}" for nombre, expresion, tipo, _ in _COLUMNAS)}
+    FROM granjas AS g
+    LEFT JOIN (
+        SELECT d.municipio, c.clave
+        FROM (SELECT DISTINCT municipio FROM granjas) AS d
+        JOIN unnest(%s::text[], %s::integer[]) AS c (nombre, clave)
+            ON c.nombre = normalizar_busqueda(trim(d.municipio))
+    ) AS m ON m.municipio = g.municipio
+    LEFT JOIN (
+        SELECT d.texto, CASE
+            WHEN trim(d.texto) = '' THEN 0
+            WHEN trim(d.texto) ~ '^[0-9]{{1,9}}$' THEN trim(d.texto)::integer
+            ELSE -1
+        END AS clave
+        FROM (SELECT DISTINCT clave_municipio_inegi AS texto FROM granjas) AS d
+    ) AS k ON k.texto = g.clave_municipio_inegi
+"""
+# Encabezado de array_send para una dimensión: ndim, banderas, oid, tamaño, límite inferior
+_ENCABEZADO_ARREGLO = 20
+
+
+_SIN_ACENTOS = str.maketrans(
+    "ÁÀÂÄÃáàâäãÉÈÊËéèêëÍÌÎÏíìîïÓÒÔÖÕóòôöõÚÙÛÜúùûüÑñÇç",
+    "aaaaaaaaaaeeeeeeeeiiiiiiiioooooooooouuuuuuuunncc",
+)
+
+
+def _normalizar(texto: str) -> str:
+    """Igual que la función SQL normalizar_busqueda(): sin acentos y en minúsculas"""
+    return texto.translate(_SIN_ACENTOS).lower()
+
+
+async def cargar(cur) -> dict:
+    """Columnas de todas las granjas en formato binario (bytes por columna, None si no hay granjas)"""
+    nombres = [_normalizar(nombre) for nombre in MUNICIPIOS_SONORA]
+    claves = [ESTADO_INEGI * 1000 + clave for clave in MUNICIPIOS_SONORA.values()]
+    await cur.execute(_SQL_CARGAR, (nombres, claves), binary=True)
+    return await cur.fetchone()
+
+
+def _columnas(datos: dict) -> dict:
+    """Arreglos NumPy (orden nativo) por columna a partir de la salida de cargar()"""
+    columnas = {}
+    for nombre, _, _, tipo in _COLUMNAS:
+        crudo = datos[nombre] if datos else None
+        if crudo is None:
+            columnas[nombre] = np.empty(0, dtype=np.int64 if tipo.startswith(">i") else np.float64)
+            continue
+        # Cada elemento va precedido de su longitud (nunca -1: no hay NULL)
+        elementos = np.frombuffer(crudo, dtype=[("largo", ">i4"), ("valor", tipo)], offset=_ENCABEZADO_ARREGLO)
+        columnas[nombre] = elementos["valor"].astype(np.int64 if tipo.startswith(">i") else np.float64)
+    return columnas
+
+
+class Auditoria:
+    """Resultado de evaluar(): conteos por regla e ids infractores ordenados"""
+
+    def __init__(self, total: int, ids_por_regla: dict, con_problemas: int, duracion_ms: float):
+        self.total = total
+        self.ids_por_regla = ids_por_regla
+        self.con_problemas = con_problemas
+        self.duracion_ms = duracion_ms
+        self.fecha = datetime.now()
+
+    def resumen(self) -> dict:
+        return {
+            "fecha": self.fecha,
+            "total_granjas": self.total,
+            "granjas_con_problemas": self.con_problemas,
+            "duracion_ms": round(self.duracion_ms, 1),
+            "reglas": {
+                regla: {"descripcion": REGLAS[regla], "granjas": int(ids.size)}
+                for regla, ids in self.ids_por_regla.items()
+            },
+        }
+
+    def pagina(self, regla: str, despues_de: int = 0, limite: int = 1000):
+        """Ids infractores de `regla` mayores que `despues_de`; devuelve (ids, siguiente o None)"""
+        ids = self.ids_por_regla[regla]
+        inicio = int(np.searchsorted(ids, despues_de, side="right"))
+        pagina = ids[inicio:inicio + limite]
+        siguiente = int(pagina[-1]) if inicio + limite < ids.size else None
+        return pagina.tolist(), siguiente
+
+
+def evaluar(datos: dict) -> Auditoria:
+    """Aplica todas las reglas de forma vectorizada (CPU: llamar fuera del event loop)"""
+    inicio = time.perf_counter()
+    columnas = _columnas(datos)
+    ids = columnas["id_granja"]
+    total = columnas["poblacion_total"]
+    suma = sum(columnas[campo] for campo in CAMPOS_POBLACION)
+    capacidad = columnas["capacidad_instalada"]
+    lat, lon = columnas["latitud"], columnas["longitud"]
+    clave, clave_esperada = columnas["clave"], columnas["clave_esperada"]
+
+    tiene_lat, tiene_lon = ~np.isnan(lat), ~np.isnan(lon)
+    completas = tiene_lat & tiene_lon
+
+    def _en_estado(la, lo):
+        return (la >= LAT_MIN) & (la <= LAT_MAX) & (lo >= LON_MIN) & (lo <= LON_MAX)
+
+    # NaN compara siempre falso, así que las coordenadas faltantes no entran en estas máscaras
+    dentro = _en_estado(lat, lon)
+    invertidas = ~dentro & _en_estado(lon, lat)
+    sin_signo = ~dentro & ~invertidas & _en_estado(lat, -lon)
+
+    # La clave de 3 dígitos (solo municipio) se acepta como abreviatura de la de 5
+    clave = np.where((clave > 0) & (clave < 1000), clave + ESTADO_INEGI * 1000, clave)
+
+    mascaras = {
+        "poblacion_total": total != suma,
+        "sobre_capacidad": total > capacidad,
+        "coordenadas_incompletas": tiene_lat ^ tiene_lon,
+        "coordenadas_invertidas": invertidas,
+        "longitud_sin_signo": sin_signo,
+        "coordenadas_fuera": completas & ~dentro & ~invertidas & ~sin_signo,
+        "municipio_desconocido": clave_esperada < 0,
+        "clave_municipio": (clave_esperada >= 0) & (clave != 0) & (clave != clave_esperada),
+    }
+
+    orden = np.argsort(ids, kind="stable")
+    ids = ids[orden]
+    cualquiera = np.zeros(ids.size, dtype=bool)
+    ids_por_regla = {}
+    for regla, mascara in mascaras.items():
+        mascara = mascara[orden]
+        cualquiera |= mascara
+        ids_por_regla[regla] = ids[mascara]
+    return Auditoria(int(ids.size), ids_por_regla, int(cualquiera.sum()), (time.perf_counter() - inicio) * 1000)
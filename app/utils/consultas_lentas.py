@@ -0,0 +1,141 @@
+"""
+Registro de consultas lentas.
+
+El cursor de la base de datos (app.database.CursorMedido) reporta cada
+sentencia que supera DB_SLOW_QUERY_MS. Se agrupan por huella: el SQL con
+literales y parámetros reemplazados por `?` y las listas colapsadas, de modo
+que las variantes que arman las rutas (listas IN, VALUES de varias filas)
+cuenten como la misma consulta mientras las columnas sean las mismas.
+
+Con DB_SLOW_QUERY_EXPLAIN_RATE > 0 se vuelve a ejecutar una fracción de las
+consultas lentas con EXPLAIN (ANALYZE, BUFFERS) dentro de un savepoint que se
+revierte, y se guarda el último plan de cada huella. Ese muestreo repite la
+consulta en la misma petición (y en un INSERT consume valores de la
+secuencia), por eso está desactivado por defecto.
+
+Las estadísticas son por worker y solo se modifican desde el event loop.
+"""
+from datetime import datetime
+from typing import Dict, Optional
+import logging
+import os
+import random
+import re
+
+from app.utils.metricas import Contador
+
+logger = logging.getLogger(__name__)
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))  # 0 = desactivado
+DB_SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("DB_SLOW_QUERY_EXPLAIN_RATE", "0"))
+# Huellas distintas que se conservan; al llenarse se descarta la de menor tiempo total
+DB_SLOW_QUERY_MAX_HUELLAS = int(os.getenv("DB_SLOW_QUERY_MAX_HUELLAS", "500"))
+
+UMBRAL_S = DB_SLOW_QUERY_MS / 1000
+
+_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_CADENAS = re.compile(r"'(?:[^']|'')*'")
+_PARAMETROS = re.compile(r"%(?:\(\w+\))?[sbt]")
+_NUMEROS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_FILAS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+
+_huellas: Dict[str, dict] = {}
+_stats = {"registradas": 0, "planes": 0, "errores_plan": 0}
+
+DB_CONSULTAS_LENTAS = Contador(
+    "granjas_db_consultas_lentas_total", f"Consultas que superaron {DB_SLOW_QUERY_MS:g} ms", ("ruta",)
+)
+
+
+def huella(sql: str) -> str:
+    """SQL normalizado: sin literales ni parámetros, con listas colapsadas y espacios simples"""
+    sql = _COMENTARIOS.sub(" ", sql)
+    sql = _CADENAS.sub("?", sql)
+    sql = _PARAMETROS.sub("?", sql)
+    sql = _NUMEROS.sub("?", sql)
+    sql = _ESPACIOS.sub(" ", sql).strip()
+    sql = _LISTAS.sub("(?)", sql)
+    return _FILAS.sub("(?), ...", sql)
+
+
+def es_lenta(duracion: float) -> bool:
+    return DB_SLOW_QUERY_MS > 0 and duracion >= UMBRAL_S
+
+
+def muestrear_plan() -> bool:
+    return DB_SLOW_QUERY_EXPLAIN_RATE > 0 and random.random() < DB_SLOW_QUERY_EXPLAIN_RATE
+
+
+def registrar(sql: str, duracion: float, parametros: int, filas: Optional[int], ruta: str,
+              error: Optional[str] = None, plan: Optional[str] = None):
+    """Agrega una consulta lenta a su huella y la escribe en el log"""
+    clave = huella(sql)
+    _stats["registradas"] += 1
+    DB_CONSULTAS_LENTAS.inc(ruta)
+    logger.warning(
+        "Consulta lenta %.1f ms (ruta=%s, parámetros=%s, filas=%s%s): %.500s",
+        duracion * 1000, ruta, parametros, filas, f", error={error}" if error else "", clave,
+    )
+
+    entrada = _huellas.get(clave)
+    if entrada is None:
+        if len(_huellas) >= DB_SLOW_QUERY_MAX_HUELLAS:
+            del _huellas[min(_huellas, key=lambda h: _huellas[h]["tiempo_total_ms"])]
+        entrada = _huellas[clave] = {
+            "huella": clave,
+            "ejecuciones": 0,
+            "tiempo_total_ms": 0.0,
+            "tiempo_max_ms": 0.0,
+            "filas_total": 0,
+            "parametros": parametros,
+            "errores": 0,
+            "rutas": {},
+            "ultima": None,
+            "plan": None,
+        }
+    ms = duracion * 1000
+    entrada["ejecuciones"] += 1
+    entrada["tiempo_total_ms"] += ms
+    entrada["tiempo_max_ms"] = max(entrada["tiempo_max_ms"], ms)
+    entrada["filas_total"] += max(filas or 0, 0)
+    entrada["parametros"] = parametros
+    entrada["rutas"][ruta] = entrada["rutas"].get(ruta, 0) + 1
+    entrada["ultima"] = datetime.now()
+    if error:
+        entrada["errores"] += 1
+    if plan is not None:
+        _stats["planes"] += 1
+        entrada["plan"] = {"fecha": entrada["ultima"], "duracion_ms": ms, "texto": plan}
+
+
+def error_plan():
+    _stats["errores_plan"] += 1
+
+
+def top(limite: int = 20) -> list:
+    """Las `limite` huellas con mayor tiempo total"""
+    entradas = sorted(_huellas.values(), key=lambda e: e["tiempo_total_ms"], reverse=True)[:limite]
+    return [
+        {
+            **e,
+            "tiempo_promedio_ms": e["tiempo_total_ms"] / e["ejecuciones"],
+            "filas_promedio": e["filas_total"] / e["ejecuciones"],
+            "rutas": dict(e["rutas"]),
+        }
+        for e in entradas
+    ]
+
+
+def reiniciar():
+    _huellas.clear()
+
+
+def get_consultas_lentas_stats() -> dict:
+    return {
+        "umbral_ms": DB_SLOW_QUERY_MS,
+        "explain_rate": DB_SLOW_QUERY_EXPLAIN_RATE,
+        "huellas": len(_huellas),
+        **_stats,
+    }
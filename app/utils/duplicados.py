@@ -0,0 +1,304 @@
+"""
+Detección de granjas duplicadas (recapturas con otra ortografía).
+
+En lugar de comparar todos los pares, cada granja se compara solo con las de
+sus bloques:
+
+- propietario: mismo apellido paterno y municipio normalizados (índice
+  idx_granjas_bloque_propietario).
+- ubicacion: su celda de DUPLICADOS_CELDA_GRADOS y las ocho vecinas, buscadas
+  como una caja con el índice GiST de coordenadas (app/utils/geo.py). Las
+  vecinas cubren los duplicados que caen a ambos lados del borde de una celda
+  y este bloque encuentra los que tienen el apellido mal escrito.
+
+Un bloque con más de DUPLICADOS_MAX_BLOQUE granjas (un apellido muy común en
+un municipio grande) se omite para esa granja. Cada candidato recibe un
+puntaje de 0 a 1 con la similitud por trigramas del nombre de la granja y del
+propietario (la misma medida que pg_trgm) y la distancia entre ambas; los
+pares con puntaje de al menos DUPLICADOS_UMBRAL se guardan en
+granjas_duplicados para revisión.
+
+La detección es incremental: la primera ejecución revisa todo el padrón y
+las siguientes solo las granjas con txid_cambio desde el horizonte de la
+anterior, el mismo marcador que usa la sincronización (app/utils/sincronizacion.py).
+Se usa en lugar de fecha_actualizacion porque NOW() es el inicio de la
+transacción y una que confirma tarde puede dejar una fecha anterior a la
+última ejecución. Los pares pendientes de esas granjas se recalculan; los ya
+revisados conservan su estado.
+
+Corre en segundo plano en cada worker cada DUPLICADOS_INTERVALO_S; un
+advisory lock de sesión hace que solo un worker ejecute a la vez.
+"""
+from typing import Optional
+import asyncio
+import logging
+import os
+import re
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.database import get_db
+from app.utils.geo import PUNTO_GRANJA, distancia_km
+from app.utils.metricas import MedidorFuncion
+
+logger = logging.getLogger(__name__)
+
+DUPLICADOS_INTERVALO_S = float(os.getenv("DUPLICADOS_INTERVALO_S", "600"))  # 0 = sin detección en segundo plano
+DUPLICADOS_UMBRAL = float(os.getenv("DUPLICADOS_UMBRAL", "0.6"))
+DUPLICADOS_CELDA_GRADOS = float(os.getenv("DUPLICADOS_CELDA_GRADOS", "0.01"))  # ~1.1 km
+# Distancia a la que la cercanía deja de sumar al puntaje
+DUPLICADOS_RADIO_KM = float(os.getenv("DUPLICADOS_RADIO_KM", "2"))
+DUPLICADOS_MAX_BLOQUE = int(os.getenv("DUPLICADOS_MAX_BLOQUE", "200"))
+# Granjas revisadas por transacción
+DUPLICADOS_LOTE = int(os.getenv("DUPLICADOS_LOTE", "500"))
+
+# Pesos del puntaje; sin coordenadas en alguna de las dos solo cuentan los nombres
+PESO_NOMBRE, PESO_PROPIETARIO, PESO_DISTANCIA = 0.35, 0.45, 0.2
+
+# Clave arbitraria del advisory lock que serializa las ejecuciones entre workers
+_LOCK_ID = 7203543
+
+_PALABRAS = re.compile(r"[a-z0-9]+")
+
+_tarea: Optional[asyncio.Task] = None
+_stats = {"ejecuciones": 0, "granjas_revisadas": 0, "pares": 0, "bloques_omitidos": 0, "errores": 0}
+
+
+def clave_propietario(alias: str) -> str:
+    """Clave del bloque propietario; debe coincidir con idx_granjas_bloque_propietario en schema.sql"""
+    return f"(normalizar_busqueda(trim({alias}.propietario_ap_paterno)), normalizar_busqueda(trim({alias}.municipio)))"
+
+
+def _celda(alias: str, columna: str, desplazamiento: int) -> str:
+    return f"(floor({alias}.{columna} / %(celda)s) + {desplazamiento}) * %(celda)s"
+
+
+# Candidatos de cada granja del lote, hasta DUPLICADOS_MAX_BLOQUE + 1 por bloque para
+# detectar los bloques demasiado grandes. Dentro de las subconsultas, PUNTO_GRANJA
+# (sin alias) se refiere a la granja candidata `g`.
+_SQL_CANDIDATOS = f"""
+    SELECT c.id_granja AS id_granja, b.candidato, b.bloque
+    FROM granjas AS c
+    CROSS JOIN LATERAL (
+        (SELECT g.id_granja AS candidato, 'propietario' AS bloque
+         FROM granjas AS g
+         WHERE {clave_propietario('g')} = {clave_propietario('c')} AND g.id_granja <> c.id_granja
+         LIMIT %(tope)s)
+        UNION ALL
+        (SELECT g.id_granja, 'ubicacion'
+         FROM granjas AS g
+         WHERE c.georreferenciacion_ln IS NOT NULL AND c.georreferenciacion_lo IS NOT NULL
+           AND {PUNTO_GRANJA} <@ box(
+               point({_celda('c', 'georreferenciacion_lo', -1)}, {_celda('c', 'georreferenciacion_ln', -1)}),
+               point({_celda('c', 'georreferenciacion_lo', 2)}, {_celda('c', 'georreferenciacion_ln', 2)})
+           )
+           AND g.id_granja <> c.id_granja
+         LIMIT %(tope)s)
+    ) AS b
+    WHERE c.id_granja = ANY(%(ids)s)
+"""
+
+_SQL_DATOS = """
+    SELECT id_granja,
+           normalizar_busqueda(nombre_granja) AS nombre,
+           normalizar_busqueda(concat_ws(' ', propietario_nombres, propietario_ap_paterno, propietario_ap_materno)) AS propietario,
+           georreferenciacion_ln AS lat, georreferenciacion_lo AS lon
+    FROM granjas WHERE id_granja = ANY(%s)
+"""
+
+_SQL_GUARDAR = """
+    INSERT INTO granjas_duplicados
+        (id_granja_a, id_granja_b, puntaje, similitud_nombre, similitud_propietario, distancia_km, bloques)
+    SELECT u.*
+    FROM unnest(%s::integer[], %s::integer[], %s::real[], %s::real[], %s::real[], %s::real[], %s::text[])
+        AS u (a, b, puntaje, nombre, propietario, distancia, bloques)
+    -- Descarta las granjas eliminadas mientras se calculaba el lote
+    WHERE EXISTS (SELECT 1 FROM granjas WHERE id_granja = u.a)
+      AND EXISTS (SELECT 1 FROM granjas WHERE id_granja = u.b)
+    ON CONFLICT (id_granja_a, id_granja_b) DO UPDATE SET
+        puntaje = EXCLUDED.puntaje,
+        similitud_nombre = EXCLUDED.similitud_nombre,
+        similitud_propietario = EXCLUDED.similitud_propietario,
+        distancia_km = EXCLUDED.distancia_km,
+        bloques = EXCLUDED.bloques,
+        fecha_calculo = NOW()
+"""
+
+
+def _trigramas(texto: str) -> frozenset:
+    """Trigramas de cada palabra con el relleno de pg_trgm (dos espacios antes, uno después)"""
+    trigramas = set()
+    for palabra in _PALABRAS.findall(texto or ""):
+        palabra = f"  {palabra} "
+        trigramas.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return frozenset(trigramas)
+
+
+def similitud(a: frozenset, b: frozenset) -> float:
+    """Como similarity() de pg_trgm: trigramas compartidos entre trigramas distintos"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def puntuar(pares: dict, datos: dict) -> list:
+    """
+    Puntaje de cada par {(a, b): bloques}; `datos` tiene por id_granja sus
+    textos normalizados y coordenadas. Devuelve las filas a guardar (puntaje >= umbral).
+    """
+    trigramas = {
+        id_granja: (_trigramas(fila['nombre']), _trigramas(fila['propietario']))
+        for id_granja, fila in datos.items()
+    }
+    filas = []
+    for (a, b), bloques in pares.items():
+        if a not in datos or b not in datos:
+            continue
+        nombre = similitud(trigramas[a][0], trigramas[b][0])
+        propietario = similitud(trigramas[a][1], trigramas[b][1])
+        fila_a, fila_b = datos[a], datos[b]
+        distancia = None
+        if None not in (fila_a['lat'], fila_a['lon'], fila_b['lat'], fila_b['lon']):
+            distancia = distancia_km(fila_a['lat'], fila_a['lon'], fila_b['lat'], fila_b['lon'])
+            cercania = max(0.0, 1 - distancia / DUPLICADOS_RADIO_KM)
+            puntaje = PESO_NOMBRE * nombre + PESO_PROPIETARIO * propietario + PESO_DISTANCIA * cercania
+        else:
+            puntaje = (PESO_NOMBRE * nombre + PESO_PROPIETARIO * propietario) / (PESO_NOMBRE + PESO_PROPIETARIO)
+        if puntaje >= DUPLICADOS_UMBRAL:
+            filas.append((a, b, puntaje, nombre, propietario, distancia, ",".join(sorted(bloques))))
+    return filas
+
+
+async def _revisar_lote(cur, ids: list) -> tuple:
+    """
+    Recalcula todos los pares de las granjas `ids`; devuelve (pares guardados, bloques omitidos).
+    Un par entre dos granjas cambiadas de lotes distintos se calcula en ambos: el segundo
+    lote borra el pendiente que dejó el primero y lo vuelve a guardar.
+    """
+    await cur.execute(
+        _SQL_CANDIDATOS, {"ids": ids, "tope": DUPLICADOS_MAX_BLOQUE + 1, "celda": DUPLICADOS_CELDA_GRADOS}
+    )
+    por_bloque = {}
+    for fila in await cur.fetchall():
+        por_bloque.setdefault((fila['id_granja'], fila['bloque']), []).append(fila['candidato'])
+
+    pares = {}
+    omitidos = 0
+    for (id_granja, bloque), candidatos in por_bloque.items():
+        if len(candidatos) > DUPLICADOS_MAX_BLOQUE:
+            omitidos += 1
+            continue
+        for candidato in candidatos:
+            pares.setdefault((min(id_granja, candidato), max(id_granja, candidato)), set()).add(bloque)
+
+    filas = []
+    if pares:
+        involucradas = sorted({i for par in pares for i in par})
+        await cur.execute(_SQL_DATOS, (involucradas,))
+        datos = {fila['id_granja']: fila for fila in await cur.fetchall()}
+        # Los trigramas son CPU pura: fuera del event loop
+        filas = await run_in_threadpool(puntuar, pares, datos)
+
+    await cur.execute(
+        "DELETE FROM granjas_duplicados WHERE estado = 'pendiente' AND (id_granja_a = ANY(%(ids)s) OR id_granja_b = ANY(%(ids)s))",
+        {"ids": ids},
+    )
+    if filas:
+        await cur.execute(_SQL_GUARDAR, [list(columna) for columna in zip(*filas)])
+    return len(filas), omitidos
+
+
+async def detectar(completo: bool = False) -> Optional[dict]:
+    """
+    Una ejecución de la detección, con un commit por lote. Devuelve un resumen,
+    o None si otro worker está ejecutándola.
+    """
+    async with get_db() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT pg_try_advisory_lock(%s) AS libre", (_LOCK_ID,))
+            if not (await cur.fetchone())['libre']:
+                return None
+            try:
+                await cur.execute("SELECT horizonte::text AS horizonte FROM duplicados_estado")
+                estado = await cur.fetchone()
+                desde = "0" if completo or estado is None else estado['horizonte']
+                # Horizonte y granjas cambiadas en el mismo snapshot (ver app/utils/sincronizacion.py)
+                await cur.execute(
+                    """
+                    SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS horizonte,
+                           ARRAY(SELECT id_granja FROM granjas WHERE txid_cambio >= %s::xid8 ORDER BY id_granja) AS ids
+                    """,
+                    (desde,),
+                )
+                fila = await cur.fetchone()
+                await conn.commit()
+
+                ids = fila['ids']
+                pares = omitidos = 0
+                for inicio in range(0, len(ids), DUPLICADOS_LOTE):
+                    guardados, omitidos_lote = await _revisar_lote(cur, ids[inicio:inicio + DUPLICADOS_LOTE])
+                    await conn.commit()
+                    pares += guardados
+                    omitidos += omitidos_lote
+
+                await cur.execute(
+                    """
+                    INSERT INTO duplicados_estado (horizonte) VALUES (%s::xid8)
+                    ON CONFLICT (unica) DO UPDATE SET horizonte = EXCLUDED.horizonte, fecha = NOW()
+                    """,
+                    (fila['horizonte'],),
+                )
+                await conn.commit()
+            finally:
+                # La sesión vuelve al pool: el lock se libera aunque un lote haya fallado
+                await conn.rollback()
+                await cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_ID,))
+
+    _stats["ejecuciones"] += 1
+    _stats["granjas_revisadas"] += len(ids)
+    _stats["pares"] += pares
+    _stats["bloques_omitidos"] += omitidos
+    return {"completo": desde == "0", "granjas_revisadas": len(ids), "pares": pares, "bloques_omitidos": omitidos}
+
+
+async def _ciclo():
+    while True:
+        try:
+            resumen = await detectar()
+            if resumen and resumen["granjas_revisadas"]:
+                logger.info("Detección de duplicados: %s", resumen)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _stats["errores"] += 1
+            logger.exception("Error en la detección de granjas duplicadas")
+        await asyncio.sleep(DUPLICADOS_INTERVALO_S)
+
+
+async def iniciar():
+    """Arranca la detección periódica en este worker (si DUPLICADOS_INTERVALO_S > 0)"""
+    global _tarea
+    if DUPLICADOS_INTERVALO_S > 0 and _tarea is None:
+        _tarea = asyncio.create_task(_ciclo(), name="duplicados")
+
+
+async def detener():
+    global _tarea
+    if _tarea is None:
+        return
+    _tarea.cancel()
+    try:
+        await _tarea
+    except asyncio.CancelledError:
+        pass
+    _tarea = None
+
+
+def get_duplicados_stats() -> dict:
+    return {"intervalo_s": DUPLICADOS_INTERVALO_S, "umbral": DUPLICADOS_UMBRAL, **_stats}
+
+
+MedidorFuncion(
+    "granjas_duplicados_eventos_total", "Ejecuciones, granjas revisadas, pares guardados y bloques omitidos de la detección de duplicados",
+    lambda: {(clave,): valor for clave, valor in _stats.items()}, etiquetas=("dato",), tipo="counter",
+)
@@ -0,0 +1,188 @@
+"""
+Mantenimiento de la tabla resumen estadisticas_granjas.
+
+La tabla guarda, por (municipio, asociacion, tipo_produccion, estatus_folio),
+el número de granjas y la suma de casetas, capacidad y poblaciones. Las rutas
+que escriben en granjas le aplican deltas dentro de su misma transacción; la
+reconstrucción completa y la verificación quedan para mantenimiento.
+Las dimensiones NULL se guardan como '' para que formen parte de la llave.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONES = ('municipio', 'asociacion', 'tipo_produccion', 'estatus_folio')
+METRICAS = (
+    'numero_casetas', 'capacidad_instalada',
+    'poblacion_cerdos_s', 'poblacion_cerdos_hr', 'poblacion_cerdos_hrzo',
+    'poblacion_cerdos_l', 'poblacion_cerdos_d', 'poblacion_cerdos_e',
+    'poblacion_total',
+)
+# Columnas de granjas necesarias para calcular un delta
+COLUMNAS_ESTADISTICAS = ', '.join(DIMENSIONES + METRICAS)
+
+# Clave arbitraria para serializar reconstrucciones entre workers
+_LOCK_RECONSTRUCCION = 7203542
+
+
+def _sql_aplicar(origen: str) -> str:
+    """
+    Upsert aditivo a partir de una consulta `origen` que expone las columnas
+    signo, DIMENSIONES y METRICAS. Las filas se agrupan y ordenan por llave
+    para que transacciones concurrentes bloqueen el resumen en el mismo orden.
+    """
+    dims = ', '.join(DIMENSIONES)
+    return f"""
+        INSERT INTO estadisticas_granjas ({dims}, granjas, {', '.join(METRICAS)})
+        SELECT {', '.join(f"COALESCE({d}, '')" for d in DIMENSIONES)},
+               SUM(signo),
+               {', '.join(f"SUM(signo * COALESCE({m}, 0))" for m in METRICAS)}
+        FROM ({origen}) AS o
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT ({dims}) DO UPDATE SET
+            granjas = estadisticas_granjas.granjas + EXCLUDED.granjas,
+            {', '.join(f"{m} = estadisticas_granjas.{m} + EXCLUDED.{m}" for m in METRICAS)}
+    """
+
+
+_SQL_DESDE_FILAS = _sql_aplicar(
+    "SELECT * FROM unnest(%s::integer[], "
+    + ", ".join(["%s::text[]"] * len(DIMENSIONES))
+    + ", "
+    + ", ".join(["%s::integer[]"] * len(METRICAS))
+    + f") AS u (signo, {', '.join(DIMENSIONES + METRICAS)})"
+)
+
+
+def _clave(fila):
+    return tuple(fila.get(c) for c in DIMENSIONES + METRICAS)
+
+
+async def aplicar_delta(cur, quitar=(), agregar=()):
+    """
+    Resta las filas `quitar` (estado anterior) y suma las filas `agregar`
+    (estado nuevo) en el resumen. Las filas son dicts con al menos las
+    columnas de COLUMNAS_ESTADISTICAS. Los pares sin cambios se omiten.
+    """
+    quitar, agregar = list(quitar), list(agregar)
+    if len(quitar) == 1 and len(agregar) == 1 and _clave(quitar[0]) == _clave(agregar[0]):
+        return
+    filas = [(-1, f) for f in quitar] + [(1, f) for f in agregar]
+    if not filas:
+        return
+    columnas = [[signo for signo, _ in filas]]
+    columnas.extend([f.get(c) for _, f in filas] for c in DIMENSIONES + METRICAS)
+    await cur.execute(_SQL_DESDE_FILAS, columnas)
+
+
+async def aplicar_delta_tabla(cur, tabla: str, signo: int = 1):
+    """Aplica como delta todas las filas de una tabla (p. ej. la de staging de la importación)"""
+    await cur.execute(_sql_aplicar(f"SELECT {int(signo)} AS signo, {COLUMNAS_ESTADISTICAS} FROM {tabla}"))
+
+
+def sql_delta(anterior: str = None, nuevo: str = None) -> str:
+    """
+    Upsert del delta entre relaciones de la misma sentencia (p. ej. CTEs con
+    la fila antes y después, unidas por id_granja), para usarlo como CTE
+    dentro de una modificación. Como aplicar_delta, omite los pares sin cambios.
+    """
+    columnas = DIMENSIONES + METRICAS
+    if anterior and nuevo:
+        cols_a = ', '.join(f"a.{c}" for c in columnas)
+        cols_n = ', '.join(f"n.{c}" for c in columnas)
+        pares = f"FROM {anterior} AS a JOIN {nuevo} AS n USING (id_granja) WHERE ROW({cols_a}) IS DISTINCT FROM ROW({cols_n})"
+        return _sql_aplicar(f"SELECT -1 AS signo, {cols_a} {pares} UNION ALL SELECT 1, {cols_n} {pares}")
+    if anterior:
+        return _sql_aplicar(f"SELECT -1 AS signo, {COLUMNAS_ESTADISTICAS} FROM {anterior}")
+    return _sql_aplicar(f"SELECT 1 AS signo, {COLUMNAS_ESTADISTICAS} FROM {nuevo}")
+
+
+async def reconstruir(cur):
+    """Recalcula el resumen completo; bloquea escrituras en granjas mientras tanto"""
+    await cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_RECONSTRUCCION,))
+    await cur.execute("LOCK TABLE granjas IN SHARE MODE")
+    await cur.execute("TRUNCATE estadisticas_granjas")
+    await cur.execute(_sql_aplicar(f"SELECT 1 AS signo, {COLUMNAS_ESTADISTICAS} FROM granjas"))
+    await cur.execute("SELECT COUNT(*) AS grupos FROM estadisticas_granjas")
+    grupos = (await cur.fetchone())['grupos']
+    logger.info("Resumen de estadísticas reconstruido (%s grupos)", grupos)
+    return grupos
+
+
+async def asegurar_inicializado(cur):
+    """Reconstruye el resumen si está vacío y hay granjas (primer arranque tras migrar)"""
+    await cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM granjas) AS hay_granjas, "
+        "EXISTS (SELECT 1 FROM estadisticas_granjas) AS hay_resumen"
+    )
+    estado = await cur.fetchone()
+    if estado['hay_granjas'] and not estado['hay_resumen']:
+        await reconstruir(cur)
+
+
+async def verificar(cur):
+    """Compara el resumen con un recálculo completo; devuelve los grupos que no coinciden"""
+    dims = ', '.join(DIMENSIONES)
+    valores = ('granjas',) + METRICAS
+    await cur.execute(f"""
+        WITH real AS (
+            SELECT {', '.join(f"COALESCE({d}, '') AS {d}" for d in DIMENSIONES)},
+                   COUNT(*) AS granjas,
+                   {', '.join(f"SUM(COALESCE({m}, 0)) AS {m}" for m in METRICAS)}
+            FROM granjas
+            GROUP BY 1, 2, 3, 4
+        )
+        SELECT {dims},
+               {', '.join(f"COALESCE(r.{v}, 0) AS {v}_real, COALESCE(e.{v}, 0) AS {v}_resumen" for v in valores)}
+        FROM real AS r
+        FULL OUTER JOIN estadisticas_granjas AS e USING ({dims})
+        WHERE {' OR '.join(f"COALESCE(r.{v}, 0) <> COALESCE(e.{v}, 0)" for v in valores)}
+        ORDER BY {dims}
+    """)
+    return await cur.fetchall()
+
+
+async def facetas(cur, filtros: dict, asociaciones=None) -> dict:
+    """
+    Total de granjas y conteo por valor de cada dimensión desde el resumen,
+    para las listas desplegables de la pantalla de granjas. `filtros` es
+    {dimensión: valor o lista de valores} y `asociaciones`, si no es None,
+    limita a esas (captura).
+
+    Cada faceta aplica los filtros de las otras dimensiones pero no el suyo,
+    para ofrecer las alternativas al valor elegido; el total los aplica todos.
+    Los valores NULL se devuelven como None.
+    """
+    params = {f"f_{d}": list(v) if isinstance(v, tuple) else v for d, v in filtros.items() if v is not None}
+    params["asociaciones"] = list(asociaciones or [])
+
+    def _condiciones(excluir=None):
+        condiciones = ["granjas <> 0"]
+        if asociaciones is not None:
+            condiciones.append("asociacion = ANY(%(asociaciones)s::text[])")
+        for d in DIMENSIONES:
+            if f"f_{d}" in params and d != excluir:
+                lista = isinstance(params[f"f_{d}"], list)
+                condiciones.append(f"{d} = ANY(%(f_{d})s::text[])" if lista else f"{d} = %(f_{d})s")
+        return " AND ".join(condiciones)
+
+    ramas = [
+        f"SELECT '{d}' AS faceta, NULLIF({d}, '') AS valor, SUM(granjas)::bigint AS granjas "
+        f"FROM estadisticas_granjas WHERE {_condiciones(d)} GROUP BY {d}"
+        for d in DIMENSIONES
+    ]
+    ramas.append(
+        f"SELECT NULL, NULL, COALESCE(SUM(granjas), 0)::bigint FROM estadisticas_granjas WHERE {_condiciones()}"
+    )
+    await cur.execute(" UNION ALL ".join(f"({r})" for r in ramas), params)
+
+    resultado = {"total": 0, "facetas": {d: [] for d in DIMENSIONES}}
+    for fila in await cur.fetchall():
+        if fila['faceta'] is None:
+            resultado["total"] = fila['granjas']
+        else:
+            resultado["facetas"][fila['faceta']].append({"valor": fila['valor'], "granjas": fila['granjas']})
+    for valores in resultado["facetas"].values():
+        valores.sort(key=lambda v: (-v["granjas"], v["valor"] or ""))
+    return resultado
@@ -0,0 +1,65 @@
+"""
+Validadores ETag para las lecturas de granjas.
+
+Una granja se identifica por (id_granja, version) y el rol del usuario,
+porque admin y captura reciben campos distintos de la misma fila. La versión
+va legible en el ETag para que If-Match pueda verificarse en SQL.
+Las páginas de listado usan ETags débiles a partir de la fecha_actualizacion
+máxima y el número de filas de la página.
+"""
+from datetime import datetime
+from typing import List, Optional
+import hashlib
+
+
+def _resumen(*partes) -> str:
+    crudo = "|".join("" if p is None else str(p) for p in partes)
+    return hashlib.sha256(crudo.encode()).hexdigest()[:32]
+
+
+def clave_rol(usuario_actual: dict) -> str:
+    """Rol del usuario; para captura incluye sus asociaciones, que determinan qué filas ve"""
+    if usuario_actual['tipo_usuario'] == 'captura':
+        return "captura:" + ",".join(sorted(usuario_actual.get('asociaciones_permitidas') or []))
+    return usuario_actual['tipo_usuario']
+
+
+def etag_granja(id_granja: int, version: int, usuario_actual: dict) -> str:
+    """ETag fuerte de una granja tal como la ve el rol del usuario"""
+    return f'"{id_granja}-{version}-{_resumen(usuario_actual["tipo_usuario"])[:8]}"'
+
+
+def etag_lista(max_fecha: Optional[datetime], filas: int, usuario_actual: dict) -> str:
+    """ETag débil de una página de listado"""
+    fecha = max_fecha.isoformat() if max_fecha else None
+    return f'W/"{_resumen(fecha, filas, clave_rol(usuario_actual))}"'
+
+
+def coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110 §13.1.2) contra el ETag actual"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    actual = etag.removeprefix("W/")
+    return any(v.strip().removeprefix("W/") == actual for v in if_none_match.split(","))
+
+
+def versiones_if_match(if_match: Optional[str], id_granja: int) -> Optional[List[int]]:
+    """
+    Versiones aceptables según If-Match para una granja: None si no hay
+    precondición (encabezado ausente o '*'); si no, las versiones de los ETags
+    fuertes de esa granja (lista vacía si ninguno corresponde).
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    versiones = []
+    for valor in if_match.split(","):
+        valor = valor.strip()
+        # If-Match usa comparación fuerte: los ETags débiles nunca coinciden
+        if valor.startswith("W/") or len(valor) < 2 or valor[0] != '"' or valor[-1] != '"':
+            continue
+        partes = valor[1:-1].split("-")
+        if len(partes) == 3 and partes[0] == str(id_granja) and partes[1].isdigit():
+            versiones.append(int(partes[1]))
+    return versiones
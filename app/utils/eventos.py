@@ -0,0 +1,259 @@
+"""
+Flujo de cambios de granjas para los clientes conectados (Server-Sent Events).
+
+Las rutas que modifican granjas publican, en su transacción, el aviso
+AVISO_CAMBIOS con una entrada [accion, id_granja, asociacion_anterior,
+asociacion_nueva] por granja. Cada worker lo recibe por su única conexión de
+escucha (app.notificaciones), lee una sola vez las filas afectadas y reparte
+el evento entre sus suscriptores según asociaciones_permitidas, serializado
+una vez por rol con el modelo correspondiente (sin campos admin para captura).
+Un usuario captura que deja de ver una granja porque cambió de asociación
+la recibe como eliminada.
+
+Cada suscriptor tiene una cola acotada: si un cliente lento la llena, se
+vacía y recibe un evento `resincronizar` para que vuelva a listar, en lugar de
+acumular memoria en el servidor. La cola de avisos por repartir del worker
+también está acotada: si se llena (ráfaga de escrituras) el aviso se descarta
+y todos resincronizan. También se envía `resincronizar` cuando la escucha se
+reconecta (pudieron perderse avisos) y tras una importación.
+Los suscriptores solo se modifican desde el event loop.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import os
+
+from pydantic import TypeAdapter
+
+from app import notificaciones
+from app.database import get_db
+from app.models import Granja, GranjaPublica
+from app.utils.metricas import MedidorFuncion
+from app.utils.security import COLUMNAS_GRANJA_ADMIN, puede_ver_campos_admin
+
+logger = logging.getLogger(__name__)
+
+AVISO_CAMBIOS = "granjas_cambios"
+# Acción de las cargas masivas: los clientes deben volver a listar
+IMPORTACION = "IMPORT"
+
+# Eventos pendientes por cliente antes de descartarlos y pedirle que resincronice
+STREAM_COLA = int(os.getenv("STREAM_COLA", "100"))
+# Comentario SSE enviado sin eventos, para mantener viva la conexión en proxies
+STREAM_LATIDO_S = float(os.getenv("STREAM_LATIDO_S", "15"))
+STREAM_MAX_SUSCRIPTORES = int(os.getenv("STREAM_MAX_SUSCRIPTORES", "1000"))  # por worker
+# Avisos recibidos pendientes de repartir (cada uno es una consulta) antes de descartarlos
+STREAM_PENDIENTES = int(os.getenv("STREAM_PENDIENTES", "1000"))
+
+EVENTOS = {"INSERT": "creada", "UPDATE": "actualizada", "DELETE": "eliminada"}
+
+_ADAPTADORES = {True: TypeAdapter(Granja), False: TypeAdapter(GranjaPublica)}
+
+_suscriptores: set = set()
+_pendientes: "Optional[asyncio.Queue[list]]" = None
+_tarea: Optional[asyncio.Task] = None
+_stats = {"eventos": 0, "desbordes": 0, "avisos_descartados": 0, "resincronizaciones": 0}
+
+
+def _sse(evento: str, datos: str) -> str:
+    return f"event: {evento}\ndata: {datos}\n\n"
+
+
+RESINCRONIZAR = _sse("resincronizar", "{}")
+LATIDO = ": latido\n\n"
+
+
+def _permisos(usuario_actual: dict):
+    """(ve campos admin, asociaciones visibles o None si ve todas)"""
+    # Como en listar_granjas: solo captura está limitado a sus asociaciones
+    if usuario_actual['tipo_usuario'] == 'captura':
+        return puede_ver_campos_admin(usuario_actual), set(usuario_actual.get('asociaciones_permitidas') or [])
+    return puede_ver_campos_admin(usuario_actual), None
+
+
+class Suscriptor:
+    """Un cliente conectado: su rol, las asociaciones que ve y su cola de eventos"""
+    __slots__ = ("admin", "asociaciones", "cola")
+
+    def __init__(self, usuario_actual: dict):
+        self.admin, self.asociaciones = _permisos(usuario_actual)
+        self.cola: "asyncio.Queue[str]" = asyncio.Queue(maxsize=STREAM_COLA)
+
+    def actualizar(self, usuario_actual: dict) -> bool:
+        """Toma el rol y las asociaciones de `usuario_actual`; devuelve True si cambiaron"""
+        permisos = _permisos(usuario_actual)
+        cambio = permisos != (self.admin, self.asociaciones)
+        self.admin, self.asociaciones = permisos
+        return cambio
+
+    def ve(self, asociacion) -> bool:
+        return self.asociaciones is None or asociacion in self.asociaciones
+
+    def enviar(self, mensaje: str):
+        try:
+            self.cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            # Cliente lento: lo pendiente ya no sirve, que vuelva a listar
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(RESINCRONIZAR)
+            _stats["desbordes"] += 1
+
+
+async def publicar(cur, cambios):
+    """Publica [(accion, id_granja, asociacion_anterior, asociacion_nueva), ...] al hacer commit"""
+    await notificaciones.notificar_lista(cur, AVISO_CAMBIOS, [list(c) for c in cambios])
+
+
+def sql_publicar(accion: str, anterior: str, nuevo: Optional[str]) -> str:
+    """
+    Equivalente SQL de publicar() para una granja, como columna de un SELECT
+    sobre las relaciones `anterior` y `nuevo` (alias con la fila antes y después).
+    """
+    asociacion_anterior = f"{anterior}.asociacion" if anterior else "NULL"
+    asociacion_nueva = f"{nuevo}.asociacion" if nuevo else "NULL"
+    entrada = f"json_build_array('{accion}', {anterior or nuevo}.id_granja, {asociacion_anterior}, {asociacion_nueva})"
+    return f"pg_notify('{notificaciones.CANAL}', {notificaciones.sql_mensaje(AVISO_CAMBIOS, f'json_build_array({entrada})')})"
+
+
+def _recibir(cambios):
+    if _suscriptores and _pendientes is not None:
+        try:
+            _pendientes.put_nowait(cambios)
+        except asyncio.QueueFull:
+            # El reparto no da abasto: este aviso se pierde, que todos vuelvan a listar
+            _stats["avisos_descartados"] += 1
+            resincronizar()
+
+
+def resincronizar():
+    """Pide a todos los clientes conectados que vuelvan a listar"""
+    _stats["resincronizaciones"] += 1
+    for suscriptor in list(_suscriptores):
+        suscriptor.enviar(RESINCRONIZAR)
+
+
+notificaciones.suscribir(AVISO_CAMBIOS, _recibir)
+notificaciones.al_reconectar(resincronizar)
+
+
+async def _repartir(cambios):
+    if any(accion == IMPORTACION for accion, *_ in cambios):
+        resincronizar()
+        return
+
+    ids = [id_granja for accion, id_granja, _, _ in cambios if accion != 'DELETE']
+    filas = {}
+    if ids:
+        async with get_db() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {COLUMNAS_GRANJA_ADMIN} FROM granjas WHERE id_granja = ANY(%s)", (ids,))
+                filas = {fila['id_granja']: fila for fila in await cur.fetchall()}
+
+    for accion, id_granja, anterior, nueva in cambios:
+        fila = filas.get(id_granja)
+        if accion != 'DELETE':
+            if fila is None:
+                # Se borró después del aviso; su propio aviso de DELETE llegará
+                continue
+            nueva = fila['asociacion']
+        eliminada = _sse(EVENTOS['DELETE'], f'{{"id_granja":{int(id_granja)}}}')
+        # Serializada una vez por rol, no por suscriptor
+        por_rol = {}
+        for suscriptor in list(_suscriptores):
+            if fila is not None and suscriptor.ve(nueva):
+                if suscriptor.admin not in por_rol:
+                    adaptador = _ADAPTADORES[suscriptor.admin]
+                    datos = adaptador.dump_json(adaptador.validate_python(fila)).decode()
+                    por_rol[suscriptor.admin] = _sse(EVENTOS[accion], datos)
+                mensaje = por_rol[suscriptor.admin]
+            elif accion != 'INSERT' and suscriptor.ve(anterior):
+                mensaje = eliminada
+            else:
+                continue
+            suscriptor.enviar(mensaje)
+            _stats["eventos"] += 1
+
+
+async def _consumir():
+    while True:
+        cambios = await _pendientes.get()
+        if not _suscriptores:
+            continue
+        try:
+            await _repartir(cambios)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error al repartir cambios de granjas")
+            resincronizar()
+
+
+async def flujo(usuario_actual: dict, vigente: Callable[[], Awaitable[Optional[dict]]]):
+    """
+    Generador SSE para un cliente. Se registra al empezar a enviar (y se da de
+    baja al desconectarse). Cada STREAM_LATIDO_S, lleguen eventos o no, pide a
+    `vigente()` el usuario actualizado: si el token ya no es válido o el
+    usuario fue desactivado (None) cierra el flujo, y si cambiaron su rol o
+    sus asociaciones descarta lo encolado con los permisos anteriores y le
+    pide resincronizar.
+    """
+    loop = asyncio.get_running_loop()
+    suscriptor = Suscriptor(usuario_actual)
+    _suscriptores.add(suscriptor)
+    try:
+        yield f"retry: {int(STREAM_LATIDO_S * 1000)}\n\n"
+        revision = loop.time() + STREAM_LATIDO_S
+        while True:
+            try:
+                mensaje = await asyncio.wait_for(suscriptor.cola.get(), max(0.0, revision - loop.time()))
+            except asyncio.TimeoutError:
+                mensaje = LATIDO
+            if loop.time() >= revision:
+                usuario = await vigente()
+                if usuario is None:
+                    return
+                if suscriptor.actualizar(usuario):
+                    while not suscriptor.cola.empty():
+                        suscriptor.cola.get_nowait()
+                    mensaje = RESINCRONIZAR
+                revision = loop.time() + STREAM_LATIDO_S
+            yield mensaje
+    finally:
+        _suscriptores.discard(suscriptor)
+
+
+def hay_cupo() -> bool:
+    return len(_suscriptores) < STREAM_MAX_SUSCRIPTORES
+
+
+async def iniciar():
+    """Arranca el reparto de cambios a los clientes de este worker"""
+    global _tarea, _pendientes
+    if _tarea is None:
+        _pendientes = asyncio.Queue(maxsize=STREAM_PENDIENTES)
+        _tarea = asyncio.create_task(_consumir(), name="eventos-granjas")
+
+
+async def detener():
+    global _tarea
+    if _tarea is None:
+        return
+    _tarea.cancel()
+    try:
+        await _tarea
+    except asyncio.CancelledError:
+        pass
+    _tarea = None
+
+
+def get_eventos_stats() -> dict:
+    pendientes = _pendientes.qsize() if _pendientes is not None else 0
+    return {"suscriptores": len(_suscriptores), "pendientes": pendientes, **_stats}
+
+
+MedidorFuncion("granjas_stream_suscriptores", "Clientes conectados al flujo de cambios", lambda: {(): len(_suscriptores)})
+MedidorFuncion(
+    "granjas_stream_eventos_total", "Eventos enviados, desbordes de clientes lentos y resincronizaciones",
+    lambda: {(clave,): valor for clave, valor in _stats.items()}, etiquetas=("dato",), tipo="counter",
+)
@@ -0,0 +1,199 @@
+"""
+Escritores incrementales para exportar el padrón.
+
+Cada escritor convierte lotes de filas (dicts) a bytes sin acumular el
+archivo completo en memoria: `inicio()` devuelve el encabezado, `lote(filas)`
+la porción correspondiente a esas filas y `fin()` el cierre del archivo.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from xml.sax.saxutils import escape
+import csv
+import io
+import json
+import re
+import zipfile
+
+
+def _valor_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, Enum):
+        return valor.value
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+class EscritorCSV:
+    media_type = "text/csv; charset=utf-8"
+    extension = "csv"
+
+    def __init__(self, columnas):
+        self.columnas = columnas
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+
+    def _vaciar(self) -> bytes:
+        datos = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return datos.encode("utf-8")
+
+    def inicio(self) -> bytes:
+        # BOM para que Excel detecte UTF-8 (acentos y ñ)
+        self._csv.writerow(self.columnas)
+        return b"\xef\xbb\xbf" + self._vaciar()
+
+    def lote(self, filas) -> bytes:
+        for fila in filas:
+            self._csv.writerow(
+                fila[c].isoformat() if isinstance(fila[c], (datetime, date)) else fila[c]
+                for c in self.columnas
+            )
+        return self._vaciar()
+
+    def fin(self) -> bytes:
+        return b""
+
+
+class EscritorNDJSON:
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, columnas):
+        self.columnas = columnas
+
+    def inicio(self) -> bytes:
+        return b""
+
+    def lote(self, filas) -> bytes:
+        return "".join(
+            json.dumps({c: fila[c] for c in self.columnas}, default=_valor_json, ensure_ascii=False) + "\n"
+            for fila in filas
+        ).encode("utf-8")
+
+    def fin(self) -> bytes:
+        return b""
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino no posicionable para ZipFile: acumula bytes hasta que se retiran"""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def retirar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+# Caracteres de control no permitidos en XML 1.0
+_CONTROL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_ESTATICOS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Granjas" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+class EscritorXLSX:
+    """
+    XLSX mínimo (una hoja, cadenas en línea) escrito en streaming sobre un
+    zip no posicionable; no requiere dependencias adicionales.
+    """
+    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    extension = "xlsx"
+
+    def __init__(self, columnas):
+        self.columnas = columnas
+        self._salida = _SalidaZip()
+        self._zip = zipfile.ZipFile(self._salida, "w", compression=zipfile.ZIP_DEFLATED)
+        self._hoja = None
+
+    @staticmethod
+    def _celda(valor) -> str:
+        if valor is None:
+            return "<c/>"
+        if isinstance(valor, bool):
+            return f'<c t="b"><v>{int(valor)}</v></c>'
+        if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, Enum):
+            return f"<c><v>{valor}</v></c>"
+        if isinstance(valor, (datetime, date)):
+            valor = valor.isoformat()
+        elif isinstance(valor, Enum):
+            valor = valor.value
+        texto = escape(_CONTROL_XML.sub("", str(valor)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+    def _fila(self, valores) -> str:
+        return "<row>" + "".join(self._celda(v) for v in valores) + "</row>"
+
+    def inicio(self) -> bytes:
+        for nombre, contenido in _XLSX_ESTATICOS.items():
+            self._zip.writestr(nombre, contenido)
+        self._hoja = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._hoja.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self._hoja.write(self._fila(self.columnas).encode("utf-8"))
+        return self._salida.retirar()
+
+    def lote(self, filas) -> bytes:
+        self._hoja.write("".join(self._fila(fila[c] for c in self.columnas) for fila in filas).encode("utf-8"))
+        return self._salida.retirar()
+
+    def fin(self) -> bytes:
+        self._hoja.write(b"</sheetData></worksheet>")
+        self._hoja.close()
+        self._zip.close()
+        return self._salida.retirar()
+
+
+ESCRITORES = {
+    "csv": EscritorCSV,
+    "ndjson": EscritorNDJSON,
+    "xlsx": EscritorXLSX,
+}
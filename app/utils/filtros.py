@@ -0,0 +1,275 @@
+"""
+Filtros y orden de GET /api/granjas/, declarados por columna.
+
+Cada columna de FILTROS admite unas operaciones, y cada operación se pide
+con parámetros de consulta derivados del nombre de la columna:
+
+    valores  col=a&col=b             col = %s, o col = ANY(%s) con varios valores
+    rango    col_min=1&col_max=9     col >= %s / col <= %s
+    fecha    col_desde=2024-01-01    col >= %s (fecha u hora ISO)
+             col_hasta=2024-12-31    col <= %s; con solo la fecha incluye ese día completo
+             col_dias=30             col >= NOW() - 30 días
+    nulo     col_nulo=true|false     col IS NULL / col IS NOT NULL
+
+Los valores se convierten según el tipo del campo en el modelo Granja (los
+enums solo admiten sus valores) y viajan siempre como parámetros: al SQL
+solo llegan nombres de columna de FILTROS y ORDENES. Las condiciones tienen
+la forma que esperan los índices de schema.sql: una igualdad sobre
+asociacion, municipio, tipo_produccion o estatus_folio usa el índice
+(columna, fecha_creacion, id_granja) ya en el orden de la página, y
+col_nulo=true sobre las coordenadas el índice parcial idx_granjas_sin_coordenadas.
+"""
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import get_args
+import math
+
+from app.models import Granja, GranjaPublica
+from app.utils.estadisticas import DIMENSIONES
+from app.utils.paginacion import codificar_cursor, decodificar_cursor, codificar_posicion, decodificar_posicion
+
+VALORES = "valores"
+RANGO = "rango"
+FECHA = "fecha"
+NULO = "nulo"
+
+FILTROS = {
+    "asociacion": (VALORES, NULO),
+    "municipio": (VALORES,),
+    "clave_municipio_inegi": (VALORES, NULO),
+    "estratificacion": (VALORES, NULO),
+    "tipo_produccion": (VALORES,),
+    "estatus_folio": (VALORES, NULO),
+    "tipo_establecimiento_destino": (VALORES, NULO),
+    "numero_casetas": (RANGO,),
+    "capacidad_instalada": (RANGO,),
+    "poblacion_total": (RANGO, NULO),
+    "georreferenciacion_ln": (RANGO, NULO),
+    "georreferenciacion_lo": (RANGO, NULO),
+    "fecha_creacion": (FECHA,),
+    "fecha_actualizacion": (FECHA,),
+    # Solo admin
+    "estatus_anterior": (VALORES, NULO),
+    "estatus_actual": (VALORES, NULO),
+    "registro_censo": (VALORES, NULO),
+}
+
+# Columnas que no ve un usuario captura: filtrar por ellas revelaría su valor
+COLUMNAS_ADMIN = frozenset(Granja.model_fields) - frozenset(GranjaPublica.model_fields)
+
+# Órdenes permitidos: solo columnas NOT NULL con índice (columna, id_granja)
+# o (columna, ..., id_granja); el valor convierte la posición del cursor
+ORDENES = {
+    "fecha_creacion": datetime.fromisoformat,
+    "fecha_actualizacion": datetime.fromisoformat,
+    "nombre_granja": str,
+}
+ORDEN_DEFECTO = "-fecha_creacion"
+
+# Sufijo del parámetro -> (operación, parte)
+_SUFIJOS = {
+    "": (VALORES, None),
+    "_min": (RANGO, ">="),
+    "_max": (RANGO, "<="),
+    "_desde": (FECHA, "desde"),
+    "_hasta": (FECHA, "hasta"),
+    "_dias": (FECHA, "dias"),
+    "_nulo": (NULO, None),
+}
+
+
+class FiltroInvalido(ValueError):
+    """Parámetro de filtro u orden con un valor que no se puede interpretar"""
+
+
+class FiltroNoPermitido(FiltroInvalido):
+    """Filtro sobre un campo que el usuario no puede ver"""
+
+
+def _booleano(valor: str) -> bool:
+    valor = valor.lower()
+    if valor not in ("true", "false"):
+        raise ValueError("debe ser true o false")
+    return valor == "true"
+
+
+def _numero(tipo):
+    esperado = "un número entero" if tipo is int else "un número"
+
+    def convertir(valor: str):
+        try:
+            numero = tipo(valor)
+        except ValueError:
+            numero = math.nan
+        if not math.isfinite(numero):
+            raise ValueError(f"debe ser {esperado}")
+        return numero
+    return convertir
+
+
+def _convertidor(anotacion):
+    """Función que valida y convierte un valor de texto al tipo del campo"""
+    tipo = [t for t in (get_args(anotacion) or (anotacion,)) if t is not type(None)][0]
+    if isinstance(tipo, type) and issubclass(tipo, Enum):
+        permitidos = [e.value for e in tipo]
+
+        def convertir(valor: str):
+            if valor not in permitidos:
+                raise ValueError(f"debe ser uno de: {', '.join(permitidos)}")
+            return valor
+        return convertir
+    if tipo is bool:
+        return _booleano
+    if tipo in (int, float):
+        return _numero(tipo)
+    return str
+
+
+_CONVERTIDORES = {columna: _convertidor(Granja.model_fields[columna].annotation) for columna in FILTROS}
+
+# Parámetro de consulta -> (columna, operación, parte)
+PARAMETROS = {
+    f"{columna}{sufijo}": (columna, operacion, parte)
+    for columna, operaciones in FILTROS.items()
+    for sufijo, (operacion, parte) in _SUFIJOS.items()
+    if operacion in operaciones
+}
+
+
+def describir() -> str:
+    """Texto para la documentación de la ruta con los parámetros admitidos"""
+    lineas = [
+        "Filtros (se combinan con AND; un valor repetido, p. ej. tipo_produccion=Engorda&tipo_produccion=Cría, es un OR):",
+        "",
+    ]
+    for columna in FILTROS:
+        nombres = [f"`{p}`" for p, (c, _, _) in PARAMETROS.items() if c == columna]
+        admin = " (solo admin)" if columna in COLUMNAS_ADMIN else ""
+        lineas.append(f"- {', '.join(nombres)}{admin}")
+    lineas += [
+        "",
+        "`_min`/`_max` y `_desde`/`_hasta` son inclusivos; `_hasta` con solo la fecha incluye el día completo; "
+        "`_dias=N` son los últimos N días; `_nulo=true|false`.",
+        "",
+        f"Orden: `orden` = {', '.join(ORDENES)} (ascendente) o con `-` (descendente); por defecto `{ORDEN_DEFECTO}`. "
+        "El cursor de X-Next-Cursor solo es válido con el mismo orden.",
+    ]
+    return "\n".join(lineas)
+
+
+def _fecha(columna: str, parametro: str, valor: str, parte: str):
+    """(condición, valor) de un filtro de fecha"""
+    try:
+        if parte == "dias":
+            dias = int(valor)
+            if dias < 0:
+                raise ValueError
+            return f"{columna} >= NOW() - make_interval(days => %s)", dias
+        if parte == "hasta" and len(valor) == 10:
+            # Solo la fecha: hasta el final de ese día
+            return f"{columna} < %s", datetime.combine(date.fromisoformat(valor) + timedelta(days=1), datetime.min.time())
+        return f"{columna} {'>=' if parte == 'desde' else '<='} %s", datetime.fromisoformat(valor)
+    except ValueError:
+        raise FiltroInvalido(f"Valor inválido para {parametro}: {valor!r} (se espera una fecha ISO o un número de días)")
+
+
+class Consulta:
+    """Condiciones (con %s) y orden de una petición a listar_granjas, ya validados"""
+
+    def __init__(self, orden: str = ORDEN_DEFECTO):
+        self.condiciones = []
+        self.params = []
+        # Valores por dimensión del resumen; None si algún filtro no se puede contar con él
+        self.dimensiones = {}
+        self._usados = []
+        self.orden = orden
+        self.descendente = orden.startswith("-")
+        self.columna_orden = orden[1:] if self.descendente else orden
+        if self.columna_orden not in ORDENES:
+            raise FiltroInvalido(
+                f"orden inválido: {orden!r}; admite {', '.join(ORDENES)}, con '-' para descendente"
+            )
+
+    @property
+    def clave(self) -> tuple:
+        """Filtros aplicados en forma canónica, para llaves de cache"""
+        return tuple(sorted(self._usados))
+
+    def _agregar(self, condicion, *params):
+        self.condiciones.append(condicion)
+        self.params.extend(params)
+
+    def agregar(self, parametro: str, valores: list):
+        columna, operacion, parte = PARAMETROS[parametro]
+        valores = [v for v in valores if v != ""]
+        if not valores:
+            return
+        self._usados.append((parametro, tuple(valores)))
+        if operacion != VALORES or columna not in DIMENSIONES:
+            self.dimensiones = None
+
+        if operacion == FECHA:
+            self._agregar(*_fecha(columna, parametro, valores[-1], parte))
+            return
+        convertir = _booleano if operacion == NULO else _CONVERTIDORES[columna]
+        try:
+            convertidos = [convertir(v) for v in (valores if operacion == VALORES else valores[-1:])]
+        except ValueError as e:
+            raise FiltroInvalido(f"Valor inválido para {parametro}: {e}")
+
+        if operacion == NULO:
+            self._agregar(f"{columna} IS {'' if convertidos[0] else 'NOT '}NULL")
+        elif operacion == RANGO:
+            self._agregar(f"{columna} {parte} %s", convertidos[0])
+        else:
+            convertidos = list(dict.fromkeys(convertidos))
+            if self.dimensiones is not None:
+                self.dimensiones[columna] = convertidos
+            # Un solo valor como igualdad: el índice (columna, fecha_creacion, id_granja)
+            # entrega las filas ya ordenadas; con ANY habría que ordenarlas
+            if len(convertidos) == 1:
+                self._agregar(f"{columna} = %s", convertidos[0])
+            else:
+                self._agregar(f"{columna} = ANY(%s)", convertidos)
+
+    @property
+    def order_by(self) -> str:
+        direccion = " DESC" if self.descendente else ""
+        return f"{self.columna_orden}{direccion}, id_granja{direccion}"
+
+    @property
+    def condicion_posicion(self) -> str:
+        """Condición de keyset después de la posición (valor del orden, id_granja)"""
+        return f"({self.columna_orden}, id_granja) {'<' if self.descendente else '>'} (%s, %s)"
+
+    def codificar(self, fila) -> str:
+        """Cursor de la posición de `fila`; el del orden por defecto es el de siempre"""
+        if self.orden == ORDEN_DEFECTO:
+            return codificar_cursor(fila['fecha_creacion'], fila['id_granja'])
+        valor = fila[self.columna_orden]
+        return codificar_posicion(self.orden, valor.isoformat() if isinstance(valor, datetime) else valor, fila['id_granja'])
+
+    def decodificar(self, cursor: str) -> tuple:
+        """(valor del orden, id_granja); lanza ValueError si el cursor no es de este orden"""
+        if self.orden == ORDEN_DEFECTO:
+            return decodificar_cursor(cursor)
+        orden, valor, id_granja = decodificar_posicion(cursor, (str, ORDENES[self.columna_orden], int))
+        if orden != self.orden:
+            raise ValueError("Cursor inválido")
+        return valor, id_granja
+
+
+def interpretar(parametros, admin: bool, orden: str = ORDEN_DEFECTO) -> Consulta:
+    """
+    Consulta a partir de los parámetros de la petición (con getlist(), como
+    request.query_params). Ignora los que no son filtros; lanza FiltroInvalido
+    o FiltroNoPermitido (columna admin pedida por un usuario captura).
+    """
+    consulta = Consulta(orden)
+    for parametro in dict.fromkeys(parametros.keys()):
+        if parametro not in PARAMETROS:
+            continue
+        if PARAMETROS[parametro][0] in COLUMNAS_ADMIN and not admin:
+            raise FiltroNoPermitido(f"Se requieren permisos de administrador para filtrar por {parametro}")
+        consulta.agregar(parametro, parametros.getlist(parametro))
+    return consulta
@@ -0,0 +1,51 @@
+"""
+Utilidades geoespaciales sobre georreferenciacion_ln (latitud) y
+georreferenciacion_lo (longitud, con signo).
+
+Las búsquedas usan el índice GiST de PostgreSQL sobre la expresión
+PUNTO_GRANJA (tipo point nativo, sin PostGIS) para el filtro grueso por
+caja, y después la distancia haversine exacta en SQL.
+"""
+import math
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO_LAT = 111.32
+
+# Debe coincidir con la expresión del índice idx_granjas_geo en schema.sql
+PUNTO_GRANJA = "point(georreferenciacion_lo, georreferenciacion_ln)"
+
+FILTRO_CAJA = f"{PUNTO_GRANJA} <@ box(point(%s, %s), point(%s, %s))"
+
+# Parámetros: lat, lat, lon del centro
+DISTANCIA_KM = f"""(2 * {RADIO_TIERRA_KM} * asin(sqrt(
+    power(sin(radians(georreferenciacion_ln - %s) / 2), 2)
+    + cos(radians(%s)) * cos(radians(georreferenciacion_ln))
+    * power(sin(radians(georreferenciacion_lo - %s) / 2), 2)
+)))"""
+
+
+def caja_de_radio(lat: float, lon: float, radio_km: float):
+    """Caja (min_lat, min_lon, max_lat, max_lon) que contiene el círculo dado"""
+    delta_lat = radio_km / KM_POR_GRADO_LAT
+    coseno = math.cos(math.radians(lat))
+    # Cerca de los polos la caja cubre todas las longitudes
+    delta_lon = 180.0 if coseno < 1e-6 else min(180.0, radio_km / (KM_POR_GRADO_LAT * coseno))
+    return (
+        max(-90.0, lat - delta_lat),
+        max(-180.0, lon - delta_lon),
+        min(90.0, lat + delta_lat),
+        min(180.0, lon + delta_lon),
+    )
+
+
+def tamano_celda(zoom: int, celdas_por_tesela: int = 4) -> float:
+    """Tamaño en grados de la celda de agrupación para un nivel de zoom de mapa web"""
+    return 360.0 / (2 ** zoom) / celdas_por_tesela
+
+
+def distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia haversine entre dos puntos (equivalente en Python de DISTANCIA_KM)"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
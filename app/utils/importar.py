@@ -0,0 +1,128 @@
+"""
+Lectura y validación por bloques de archivos de importación de granjas.
+
+Los lectores recorren el archivo de forma perezosa y entregan tuplas
+(numero_fila, dict); el número de fila corresponde al de la hoja de
+cálculo (la fila 1 es el encabezado).
+"""
+from itertools import islice
+import codecs
+import csv
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+
+from app.models import GranjaCreate
+
+# Columnas que el archivo debe traer obligatoriamente
+CAMPOS_REQUERIDOS = tuple(n for n, f in GranjaCreate.model_fields.items() if f.is_required())
+
+
+class ArchivoInvalido(ValueError):
+    """El archivo no se puede leer o le faltan columnas obligatorias"""
+
+
+def _limpiar(valor):
+    if isinstance(valor, str):
+        valor = valor.strip()
+        return valor or None
+    return valor
+
+
+def _fila_dict(pares):
+    # Las celdas vacías se omiten para que apliquen los defaults del modelo (p. ej. poblaciones en 0)
+    datos = {}
+    for columna, valor in pares:
+        valor = _limpiar(valor)
+        if columna and valor is not None:
+            datos[columna] = valor
+    return datos
+
+
+def _verificar_encabezado(encabezado):
+    faltantes = [c for c in CAMPOS_REQUERIDOS if c not in encabezado]
+    if faltantes:
+        raise ArchivoInvalido(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+
+
+def leer_filas_csv(archivo):
+    """Itera las filas de un CSV UTF-8 (con o sin BOM) como (numero_fila, dict)"""
+    texto = codecs.getreader("utf-8-sig")(archivo)
+    try:
+        lector = csv.DictReader(texto)
+        encabezado = [(c or "").strip() for c in (lector.fieldnames or [])]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ArchivoInvalido(f"CSV no válido: {e}") from e
+    lector.fieldnames = encabezado
+    _verificar_encabezado(encabezado)
+
+    def filas():
+        try:
+            for numero, fila in enumerate(lector, start=2):
+                yield numero, _fila_dict(fila.items())
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ArchivoInvalido(f"CSV no válido cerca de la fila {lector.line_num}: {e}") from e
+
+    return filas()
+
+
+def leer_filas_xlsx(archivo):
+    """Itera las filas de la primera hoja de un XLSX como (numero_fila, dict)"""
+    try:
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+    except Exception as e:
+        raise ArchivoInvalido(f"XLSX no válido: {e}") from e
+    hoja = libro.worksheets[0]
+    filas_hoja = hoja.iter_rows(values_only=True)
+    encabezado = [str(c).strip() if c is not None else "" for c in next(filas_hoja, ())]
+    _verificar_encabezado(encabezado)
+
+    def filas():
+        try:
+            for numero, valores in enumerate(filas_hoja, start=2):
+                if all(v is None for v in valores):
+                    continue
+                yield numero, _fila_dict(zip(encabezado, valores))
+        finally:
+            libro.close()
+
+    return filas()
+
+
+def validar_bloque(filas, tamano, campos_admin, asociaciones_permitidas=None):
+    """
+    Lee hasta `tamano` filas del iterador y las valida contra GranjaCreate.
+
+    Aplica las mismas reglas que crear_granja: los campos de `campos_admin`
+    no pueden venir informados (usuarios captura) y, si se indica
+    `asociaciones_permitidas`, la asociación debe estar entre ellas.
+    Devuelve (validas, errores, leidas) con validas = [(fila, GranjaCreate)].
+    """
+    validas, errores, leidas = [], [], 0
+    for numero, datos in islice(filas, tamano):
+        leidas += 1
+        try:
+            granja = GranjaCreate.model_validate(datos)
+        except ValidationError as e:
+            errores.append({
+                "fila": numero,
+                "errores": [
+                    {"campo": ".".join(str(p) for p in err["loc"]), "mensaje": err["msg"]}
+                    for err in e.errors()
+                ],
+            })
+            continue
+
+        problemas = [
+            {"campo": campo, "mensaje": "No tiene permisos para modificar este campo"}
+            for campo in campos_admin
+            if campo in granja.model_fields_set and getattr(granja, campo) is not None
+        ]
+        if asociaciones_permitidas is not None and granja.asociacion not in asociaciones_permitidas:
+            problemas.append({"campo": "asociacion", "mensaje": "No tiene permisos para esta asociación"})
+        if problemas:
+            errores.append({"fila": numero, "errores": problemas})
+            continue
+
+        validas.append((numero, granja))
+    return validas, errores, leidas
@@ -0,0 +1,212 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores, medidores e histogramas con etiquetas se registran al importar
+cada módulo y se exponen con `exponer()`. Los valores que ya existen en otro
+lado (pool, caches) se leen al momento del scrape con `MedidorFuncion`.
+Solo se modifican desde el event loop, así que no usan locks.
+
+`MiddlewareMetricas` mide cada petición por ruta (nombre de la función del
+endpoint) y deja en `peticion_actual` un acumulador por petición que el
+cursor de la base de datos usa para contar consultas y su tiempo.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+import time
+
+_registro = []
+
+# Buckets por defecto (segundos), como los del cliente oficial de Prometheus
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        _registro.append(self)
+
+    def _encabezado(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[tuple, float] = {}
+
+    def inc(self, *etiquetas, valor: float = 1):
+        self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def lineas(self):
+        return self._encabezado() + [
+            f"{self.nombre}{_etiquetas(self.etiquetas, e)} {_numero(v)}" for e, v in self._valores.items()
+        ]
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[tuple, float] = {}
+
+    def set(self, *etiquetas, valor: float):
+        self._valores[etiquetas] = valor
+
+    def inc(self, *etiquetas, valor: float = 1):
+        self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def dec(self, *etiquetas, valor: float = 1):
+        self.inc(*etiquetas, valor=-valor)
+
+    def lineas(self):
+        return self._encabezado() + [
+            f"{self.nombre}{_etiquetas(self.etiquetas, e)} {_numero(v)}" for e, v in self._valores.items()
+        ]
+
+
+class MedidorFuncion(_Metrica):
+    """Medidor (o contador) cuyo valor se calcula al exponer: `funcion()` devuelve {etiquetas: valor}"""
+
+    def __init__(self, nombre, ayuda, funcion: Callable[[], dict], etiquetas=(), tipo: str = "gauge"):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+        self.tipo = tipo
+
+    def lineas(self):
+        return self._encabezado() + [
+            f"{self.nombre}{_etiquetas(self.etiquetas, e)} {_numero(v)}" for e, v in self.funcion().items()
+        ]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        # Por etiquetas: [conteos por bucket (no acumulados) + desborde, suma, total]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, valor: float, *etiquetas):
+        serie = self._series.get(etiquetas)
+        if serie is None:
+            serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        serie[0][bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def lineas(self):
+        lineas = self._encabezado()
+        for etiquetas, (conteos, suma, total) in self._series.items():
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                le = f'le="{_numero(float(limite))}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, etiquetas, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {total}")
+        return lineas
+
+
+def exponer() -> str:
+    """Todas las métricas registradas en formato de texto de Prometheus 0.0.4"""
+    lineas = []
+    for metrica in _registro:
+        lineas.extend(metrica.lineas())
+    return "\n".join(lineas) + "\n"
+
+
+# --- Métricas por petición ---
+
+class Peticion:
+    """Acumulador de una petición en curso (ruta y consultas a la base de datos)"""
+    __slots__ = ("scope", "consultas", "tiempo_db")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.consultas = 0
+        self.tiempo_db = 0.0
+
+    @property
+    def ruta(self) -> str:
+        # El router de Starlette agrega el endpoint al scope al resolver la ruta
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__name__", "sin_ruta")
+
+
+peticion_actual: ContextVar[Optional[Peticion]] = ContextVar("peticion_actual", default=None)
+
+HTTP_PETICIONES = Contador(
+    "granjas_http_peticiones_total", "Peticiones HTTP atendidas", ("metodo", "ruta", "status")
+)
+HTTP_LATENCIA = Histograma(
+    "granjas_http_latencia_segundos", "Latencia de las peticiones HTTP", ("metodo", "ruta")
+)
+HTTP_EN_CURSO = Medidor("granjas_http_en_curso", "Peticiones HTTP en curso")
+HTTP_CONSULTAS_DB = Contador(
+    "granjas_http_consultas_db_total", "Consultas a la base de datos hechas por las peticiones", ("ruta",)
+)
+HTTP_TIEMPO_DB = Contador(
+    "granjas_http_tiempo_db_segundos_total", "Tiempo en consultas a la base de datos de las peticiones", ("ruta",)
+)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI (sin BaseHTTPMiddleware, para no envolver el cuerpo de la respuesta)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        peticion = Peticion(scope)
+        token = peticion_actual.set(peticion)
+        codigo = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                codigo[0] = mensaje["status"]
+            await send(mensaje)
+
+        HTTP_EN_CURSO.inc()
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracion = time.perf_counter() - inicio
+            HTTP_EN_CURSO.dec()
+            peticion_actual.reset(token)
+            ruta = peticion.ruta
+            HTTP_PETICIONES.inc(scope["method"], ruta, str(codigo[0]))
+            HTTP_LATENCIA.observe(duracion, scope["method"], ruta)
+            if peticion.consultas:
+                HTTP_CONSULTAS_DB.inc(ruta, valor=peticion.consultas)
+                HTTP_TIEMPO_DB.inc(ruta, valor=peticion.tiempo_db)
@@ -0,0 +1,37 @@
+from datetime import datetime
+import base64
+import json
+
+
+def codificar_cursor(fecha_creacion: datetime, id_granja: int) -> str:
+    """Cursor opaco con la posición (fecha_creacion, id_granja) de la última fila entregada"""
+    crudo = json.dumps([fecha_creacion.isoformat(), id_granja], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    """Devuelve (fecha_creacion, id_granja); lanza ValueError si el cursor no es válido"""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id_granja = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return datetime.fromisoformat(fecha), int(id_granja)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
+
+
+def codificar_posicion(*valores) -> str:
+    """Cursor opaco con los valores (serializables en JSON) del orden de la última fila entregada"""
+    crudo = json.dumps(list(valores), separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decodificar_posicion(cursor: str, tipos) -> tuple:
+    """Valores de codificar_posicion() convertidos con `tipos`; lanza ValueError si el cursor no es válido"""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if len(valores) != len(tipos):
+            raise ValueError("Cursor inválido")
+        return tuple(tipo(valor) for tipo, valor in zip(tipos, valores))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Cursor inválido") from e
@@ -1,8 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from fastapi import HTTPException, status
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import asyncio
+import hashlib
 import os
-from app.models import TipoUsuario
+import time
+from app.models import TipoUsuario, Granja, GranjaPublica
+from app.utils.cache import TTLCache
+from app.utils.metricas import Contador, Histograma, MedidorFuncion
 
 # Configuración de seguridad
 SECRET_KEY = os.getenv("SECRET_KEY", "clave-secreta-temporal-cambiar-en-produccion")
@@ -11,25 +18,156 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 horas para uso práctico
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt es CPU intensivo (~100-300 ms); se ejecuta en un pool dedicado para no
+# bloquear el event loop. Si hay más de HASH_WORKERS + HASH_QUEUE_LIMIT
+# operaciones pendientes se responde 503 de inmediato en lugar de encolar.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+
+# Solo se modifican desde el event loop, no requieren lock
+_hash_stats = {
+    "pendientes": 0,
+    "completadas": 0,
+    "rechazadas": 0,
+    "espera_total_s": 0.0,
+    "hash_total_s": 0.0,
+    "hash_max_s": 0.0,
+}
+
+_BUCKETS_HASH = (0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0, 10.0)
+AUTH_HASH_SEGUNDOS = Histograma("granjas_auth_hash_segundos", "Duración de cada hash/verificación bcrypt", buckets=_BUCKETS_HASH)
+AUTH_HASH_ESPERA = Histograma("granjas_auth_hash_espera_segundos", "Espera en cola antes del hash bcrypt", buckets=_BUCKETS_HASH)
+AUTH_HASH_RECHAZADAS = Contador("granjas_auth_hash_rechazadas_total", "Operaciones bcrypt rechazadas con 503 por cola llena")
+MedidorFuncion(
+    "granjas_auth_hash_pendientes", "Operaciones bcrypt en curso o en cola", lambda: {(): _hash_stats["pendientes"]}
+)
+
+def get_hash_stats():
+    """Métricas del pool de hashing: profundidad de cola y latencias"""
+    stats = dict(_hash_stats)
+    stats["workers"] = HASH_WORKERS
+    stats["limite_cola"] = HASH_QUEUE_LIMIT
+    stats["en_cola"] = max(0, stats["pendientes"] - HASH_WORKERS)
+    completadas = stats["completadas"]
+    stats["hash_promedio_s"] = stats["hash_total_s"] / completadas if completadas else 0.0
+    return stats
+
+def _medir(func, *args):
+    inicio = time.perf_counter()
+    resultado = func(*args)
+    return resultado, inicio, time.perf_counter()
+
+async def _ejecutar_hash(func, *args):
+    if _hash_stats["pendientes"] >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        _hash_stats["rechazadas"] += 1
+        AUTH_HASH_RECHAZADAS.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servicio de autenticación saturado, intente de nuevo",
+            headers={"Retry-After": "1"},
+        )
+
+    _hash_stats["pendientes"] += 1
+    encolado = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        resultado, inicio, fin = await loop.run_in_executor(_hash_executor, _medir, func, *args)
+    finally:
+        _hash_stats["pendientes"] -= 1
+
+    duracion = fin - inicio
+    _hash_stats["completadas"] += 1
+    _hash_stats["espera_total_s"] += inicio - encolado
+    _hash_stats["hash_total_s"] += duracion
+    _hash_stats["hash_max_s"] = max(_hash_stats["hash_max_s"], duracion)
+    AUTH_HASH_SEGUNDOS.observe(duracion)
+    AUTH_HASH_ESPERA.observe(inicio - encolado)
+    return resultado
+
+async def verify_password(plain_password, hashed_password):
+    return await _ejecutar_hash(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await _ejecutar_hash(pwd_context.hash, password)
+
+# Cache de tokens ya verificados: evita repetir jwt.decode + HMAC en cada request.
+# La clave es el SHA-256 del token y cada entrada vence en el `exp` del token.
+TOKEN_CACHE_MAXSIZE = int(os.getenv("TOKEN_CACHE_MAXSIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", str(ACCESS_TOKEN_EXPIRE_MINUTES * 60)))
+
+cache_tokens = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL, nombre="tokens")
+
+# Lista de revocación en memoria: digest -> exp del token, e id_usuario -> momento
+# de la revocación (invalida todo token emitido hasta entonces)
+_tokens_revocados = {}
+_usuarios_revocados = {}
+
+def _digest_token(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
 
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    ahora = datetime.utcnow()
+    expire = ahora + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": ahora})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _esta_revocado(digest: bytes, payload: dict) -> bool:
+    if digest in _tokens_revocados:
+        return True
+    revocado_en = _usuarios_revocados.get(payload.get('id'))
+    return revocado_en is not None and payload.get('iat', 0) <= revocado_en
+
 def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
+    digest = _digest_token(token)
+    payload = cache_tokens.get(digest)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        if 'id' not in payload:
+            return None
+        cache_tokens.set(digest, payload, expira_en=payload.get('exp'))
+    
+    if _esta_revocado(digest, payload):
         return None
+    return payload
+
+def _purgar_revocaciones():
+    ahora = time.time()
+    for digest, exp in list(_tokens_revocados.items()):
+        if exp <= ahora:
+            del _tokens_revocados[digest]
+    limite = ahora - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    for id_usuario, revocado_en in list(_usuarios_revocados.items()):
+        if revocado_en <= limite:
+            del _usuarios_revocados[id_usuario]
+
+def revocar_token(token: str, exp: float = None):
+    """Revoca un token concreto (logout); devuelve su digest"""
+    digest = _digest_token(token)
+    if exp is None:
+        try:
+            exp = jwt.get_unverified_claims(token).get('exp')
+        except JWTError:
+            exp = None
+    registrar_token_revocado(digest, exp or time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    return digest
+
+def registrar_token_revocado(digest: bytes, exp: float):
+    """Agrega un digest a la lista de revocación (también usado al cargarla de la BD)"""
+    _purgar_revocaciones()
+    _tokens_revocados[digest] = exp
+    cache_tokens.invalidate(digest)
+
+def revocar_tokens_usuario(id_usuario: int, revocado_en: float = None):
+    """Revoca todos los tokens emitidos a un usuario hasta ahora (desactivación)"""
+    _purgar_revocaciones()
+    _usuarios_revocados[id_usuario] = revocado_en if revocado_en is not None else time.time()
 
 # Funciones de verificación de permisos
 def puede_editar_granja(usuario_actual, granja):
@@ -43,9 +181,20 @@ def puede_editar_granja(usuario_actual, granja):
     
     return False
 
-def puede_eliminar_granja(usuario_actual, granja):
-    """Verifica si el usuario puede eliminar esta granja"""
-    return puede_editar_granja(usuario_actual, granja)
+def condicion_editar_granja(usuario_actual, alias="g"):
+    """
+    Equivalente SQL de puede_editar_granja sobre la fila `alias`, para
+    verificar el permiso dentro de la misma sentencia que modifica.
+    Devuelve (condición, params) con parámetros nombrados.
+    """
+    if usuario_actual['tipo_usuario'] == TipoUsuario.ADMIN:
+        return "TRUE", {}
+    if usuario_actual['tipo_usuario'] == TipoUsuario.CAPTURA:
+        return (
+            f"COALESCE({alias}.asociacion = ANY(%(asociaciones_permitidas)s::text[]), FALSE)",
+            {"asociaciones_permitidas": list(usuario_actual.get('asociaciones_permitidas') or [])},
+        )
+    return "FALSE", {}
 
 def puede_ver_campos_admin(usuario_actual):
     """Verifica si el usuario puede ver campos de administrador"""
@@ -55,14 +204,25 @@ def puede_modificar_campos_admin(usuario_actual):
     """Verifica si el usuario puede modificar campos de administrador"""
     return usuario_actual['tipo_usuario'] == TipoUsuario.ADMIN
 
-def filtrar_campos_admin(granja, usuario_actual):
-    """Elimina SOLO los 3 campos admin si el usuario no es administrador"""
-    if not puede_ver_campos_admin(usuario_actual):
-        campos_ocultos = [
-            'estatus_anterior', 
-            'estatus_actual', 
-            'registro_censo'
-        ]
-        for campo in campos_ocultos:
-            granja.pop(campo, None)
-    return granja
\ No newline at end of file
+# Proyección de columnas por rol, construida una sola vez al importar el módulo:
+# para usuarios captura los campos admin no salen de la base de datos
+CAMPOS_GRANJA_ADMIN = tuple(Granja.model_fields)
+CAMPOS_GRANJA_PUBLICA = tuple(GranjaPublica.model_fields)
+COLUMNAS_GRANJA_ADMIN = ', '.join(CAMPOS_GRANJA_ADMIN)
+COLUMNAS_GRANJA_PUBLICA = ', '.join(CAMPOS_GRANJA_PUBLICA)
+
+def campos_granja(usuario_actual):
+    """Nombres de los campos de granja visibles para el rol del usuario"""
+    if puede_ver_campos_admin(usuario_actual):
+        return CAMPOS_GRANJA_ADMIN
+    return CAMPOS_GRANJA_PUBLICA
+
+def columnas_granja(usuario_actual):
+    """Lista de columnas SQL de granjas visibles para el rol del usuario"""
+    if puede_ver_campos_admin(usuario_actual):
+        return COLUMNAS_GRANJA_ADMIN
+    return COLUMNAS_GRANJA_PUBLICA
+
+def modelo_granja(usuario_actual):
+    """Modelo de respuesta de granja correspondiente al rol del usuario"""
+    return Granja if puede_ver_campos_admin(usuario_actual) else GranjaPublica
@@ -0,0 +1,113 @@
+"""
+Sincronización incremental de granjas para clientes sin conexión.
+
+Los triggers de schema.sql marcan cada fila creada o modificada con el id de
+su transacción (txid_cambio) y guardan una lápida en granjas_eliminadas por
+cada baja o cambio de asociación. Un cliente pide los cambios desde su token
+y recibe las granjas y lápidas en orden (txid_cambio, orden, id_granja).
+
+El token no es "el último cambio entregado" sino el xmin del snapshot de la
+consulta: las transacciones todavía abiertas al sincronizar tienen un id
+mayor o igual, así que sus cambios entran en la siguiente sincronización
+aunque hayan tomado su id antes que otras ya confirmadas. A cambio, algunas
+filas pueden llegar dos veces; los clientes aplican las lápidas y después
+las granjas (la fila actual siempre gana), lo que hace la operación idempotente.
+"""
+from typing import Optional
+import base64
+import json
+import os
+import time
+
+# Las lápidas se conservan este tiempo; un token más viejo exige descargar todo otra vez
+SYNC_RETENCION_DIAS = int(os.getenv("SYNC_RETENCION_DIAS", "90"))
+
+# Posición dentro del orden de cambios: las lápidas van antes que las filas del mismo txid
+LAPIDA, GRANJA = 0, 1
+
+
+class TokenInvalido(ValueError):
+    pass
+
+
+class TokenExpirado(ValueError):
+    pass
+
+
+def codificar_token(horizonte: int, emitido: float, posicion: Optional[tuple] = None) -> str:
+    """
+    Token opaco: `horizonte` (xmin desde el que sincronizar), cuándo se tomó y,
+    si quedan páginas, la `posicion` (txid_cambio, orden, id_granja) del último cambio entregado.
+    """
+    crudo = json.dumps([horizonte, int(emitido), list(posicion) if posicion else None], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def decodificar_token(token: str):
+    """Devuelve (horizonte, emitido, posicion); lanza TokenInvalido o TokenExpirado"""
+    try:
+        relleno = "=" * (-len(token) % 4)
+        horizonte, emitido, posicion = json.loads(base64.urlsafe_b64decode(token + relleno))
+        horizonte, emitido = int(horizonte), float(emitido)
+        if posicion is not None:
+            txid, orden, id_granja = posicion
+            posicion = (int(txid), int(orden), int(id_granja))
+    except (ValueError, TypeError) as e:
+        raise TokenInvalido("Token de sincronización inválido") from e
+    if time.time() - emitido > SYNC_RETENCION_DIAS * 86400:
+        raise TokenExpirado("Token de sincronización expirado; descargue todo de nuevo (sin since)")
+    return horizonte, emitido, posicion
+
+
+def _condicion_rama(orden: int, posicion: Optional[tuple]) -> str:
+    if posicion is None:
+        return "txid_cambio >= %(desde)s::xid8"
+    if orden == posicion[1]:
+        return "(txid_cambio, id_granja) > (%(txid)s::xid8, %(id_granja)s)"
+    # La otra rama continúa en el mismo txid solo si va después en el orden
+    return "txid_cambio >= %(txid)s::xid8" if orden > posicion[1] else "txid_cambio > %(txid)s::xid8"
+
+
+def sql_cambios(columnas, posicion: Optional[tuple], restringido: bool, ver_reasignadas: bool) -> str:
+    """
+    Una página de cambios en una sola sentencia (y un solo snapshot): cada rama
+    recorre su índice (txid_cambio, id_granja) con LIMIT y se mezclan en orden.
+    Devuelve siempre al menos una fila con `horizonte`; `orden` es NULL si no hay cambios.
+
+    Parámetros nombrados: desde o txid/id_granja, limite y, si `restringido`, asociaciones.
+    """
+    asociacion = " AND asociacion = ANY(%(asociaciones)s::text[])" if restringido else ""
+    motivo = "" if ver_reasignadas else " AND motivo = 'eliminada'"
+    columnas = ", ".join(f"g.{c}" for c in columnas)
+    return f"""
+        WITH pagina AS (
+            SELECT * FROM (
+                (SELECT {LAPIDA} AS orden, txid_cambio, id_granja FROM granjas_eliminadas
+                 WHERE {_condicion_rama(LAPIDA, posicion)}{asociacion}{motivo}
+                 ORDER BY txid_cambio, id_granja LIMIT %(limite)s)
+                UNION ALL
+                (SELECT {GRANJA}, txid_cambio, id_granja FROM granjas
+                 WHERE {_condicion_rama(GRANJA, posicion)}{asociacion}
+                 ORDER BY txid_cambio, id_granja LIMIT %(limite)s)
+            ) AS u
+            ORDER BY txid_cambio, orden, id_granja
+            LIMIT %(limite)s
+        )
+        SELECT h.horizonte, p.orden, p.txid_cambio::text AS txid, p.id_granja AS id_cambio, {columnas}
+        FROM (SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS horizonte) AS h
+        LEFT JOIN pagina AS p ON TRUE
+        LEFT JOIN granjas AS g ON p.orden = {GRANJA} AND g.id_granja = p.id_granja
+        ORDER BY p.txid_cambio, p.orden, p.id_granja
+    """
+
+
+async def purgar_lapidas(cur, dias: int = SYNC_RETENCION_DIAS) -> int:
+    """
+    Borra las lápidas más viejas que `dias`; devuelve cuántas. No admite menos
+    que SYNC_RETENCION_DIAS: decodificar_token acepta tokens de hasta esa
+    antigüedad y sus clientes nunca verían las bajas de las lápidas borradas.
+    """
+    if dias < SYNC_RETENCION_DIAS:
+        raise ValueError(f"La retención no puede ser menor que SYNC_RETENCION_DIAS ({SYNC_RETENCION_DIAS} días)")
+    await cur.execute("DELETE FROM granjas_eliminadas WHERE fecha < NOW() - make_interval(days => %s)", (dias,))
+    return cur.rowcount
@@ -0,0 +1,59 @@
+"""
+Microbenchmark del costo de autenticación por request.
+
+Compara verify_token con y sin el cache de tokens verificados, y el camino
+completo de get_current_user con ambos caches calientes (sin base de datos).
+
+Uso:
+    python -m benchmarks.bench_auth [--iteraciones N]
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app import auth
+from app.utils import security
+
+
+def _medir(func, iteraciones):
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        func()
+    return (time.perf_counter() - inicio) / iteraciones * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iteraciones", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = security.create_access_token({"sub": "bench@granjas.mx", "id": 1})
+
+    security.cache_tokens.habilitado = False
+    sin_cache = _medir(lambda: security.verify_token(token), args.iteraciones)
+
+    security.cache_tokens.habilitado = True
+    security.verify_token(token)
+    con_cache = _medir(lambda: security.verify_token(token), args.iteraciones)
+
+    # get_current_user completo con el principal ya en cache
+    auth.cache_usuarios.set(1, {"id_usuario": 1, "tipo_usuario": "captura", "asociaciones_permitidas": ["Norte"], "activo": True})
+    credenciales = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    async def _request_completo():
+        inicio = time.perf_counter()
+        for _ in range(args.iteraciones):
+            await auth.get_current_user(credenciales)
+        return (time.perf_counter() - inicio) / args.iteraciones * 1e6
+
+    completo = asyncio.run(_request_completo())
+
+    print(f"verify_token sin cache:          {sin_cache:8.2f} µs/llamada")
+    print(f"verify_token con cache:          {con_cache:8.2f} µs/llamada ({sin_cache / con_cache:.1f}x)")
+    print(f"get_current_user (caches llenos): {completo:8.2f} µs/llamada")
+
+
+if __name__ == "__main__":
+    main()
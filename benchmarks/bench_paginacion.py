@@ -0,0 +1,83 @@
+"""
+Compara el costo de listar_granjas en la página 1 y en una página profunda
+con paginación skip/limit y con cursor (keyset).
+
+Requiere un PostgreSQL accesible en DATABASE_URL; si la tabla tiene menos de
+--granjas filas se completa con datos sintéticos (benchmarks/datos.py).
+
+Uso:
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_paginacion [--granjas 100000] [--pagina 500]
+"""
+import argparse
+import statistics
+import time
+
+import psycopg
+from fastapi.testclient import TestClient
+
+from app.database import DATABASE_URL
+from app.main import app
+from app.utils.paginacion import codificar_cursor
+from app.utils.security import create_access_token
+from benchmarks.datos import asegurar_padron
+
+
+def _medir(cliente, params, headers, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        r = cliente.get("/api/granjas/", params=params, headers=headers)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        r.raise_for_status()
+    return statistics.median(tiempos)
+
+
+def _cursor_de_pagina(pagina, limite, municipio=None):
+    """Cursor equivalente a haber recorrido pagina-1 páginas (se calcula directo en SQL)"""
+    if pagina <= 1:
+        return None
+    filtro, params = "", []
+    if municipio:
+        filtro, params = "WHERE municipio = %s", [municipio]
+    with psycopg.connect(DATABASE_URL) as conn:
+        fila = conn.execute(
+            f"SELECT fecha_creacion, id_granja FROM granjas {filtro} "
+            "ORDER BY fecha_creacion DESC, id_granja DESC LIMIT 1 OFFSET %s",
+            params + [(pagina - 1) * limite - 1],
+        ).fetchone()
+    return codificar_cursor(*fila)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--granjas", type=int, default=100000)
+    parser.add_argument("--pagina", type=int, default=500)
+    parser.add_argument("--limite", type=int, default=100)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    with TestClient(app) as cliente:
+        total = asegurar_padron(DATABASE_URL, args.granjas)
+        with psycopg.connect(DATABASE_URL) as conn:
+            id_admin = conn.execute("SELECT id_usuario FROM usuarios WHERE email = 'admin@bench.granjas'").fetchone()[0]
+            municipio, en_municipio = conn.execute(
+                "SELECT municipio, COUNT(*) FROM granjas GROUP BY municipio ORDER BY COUNT(*) DESC LIMIT 1"
+            ).fetchone()
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'admin@bench.granjas', 'id': id_admin})}"}
+
+        print(f"granjas: {total}, limite: {args.limite}, mediana de {args.repeticiones} requests (ms)")
+        print(f"{'consulta':<36}{'página 1':>10}{'página N':>10}{'N':>6}")
+        casos = (("todas", {}, total), (f"municipio={municipio}", {"municipio": municipio}, en_municipio))
+        for etiqueta, filtros, filas in casos:
+            pagina = max(1, min(args.pagina, filas // args.limite))
+            skip = (pagina - 1) * args.limite
+            offset_1 = _medir(cliente, {**filtros, "limit": args.limite}, headers, args.repeticiones)
+            offset_n = _medir(cliente, {**filtros, "limit": args.limite, "skip": skip}, headers, args.repeticiones)
+            cursor = _cursor_de_pagina(pagina, args.limite, filtros.get("municipio"))
+            keyset_n = _medir(cliente, {**filtros, "limit": args.limite, "cursor": cursor}, headers, args.repeticiones)
+            print(f"{'skip/limit ' + etiqueta:<36}{offset_1:>10.2f}{offset_n:>10.2f}{pagina:>6}")
+            print(f"{'cursor ' + etiqueta:<36}{offset_1:>10.2f}{keyset_n:>10.2f}{pagina:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Prueba de carga reproducible de la API de granjas.
+
+Levanta la app (app.main:app) con uvicorn contra el PostgreSQL de
+DATABASE_URL, completa el padrón sintético hasta --granjas filas
+(benchmarks/datos.py) y lanza --concurrencia usuarios virtuales, admin y
+captura, que durante --duracion segundos eligen operaciones según --mezcla:
+
+    login       POST /api/auth/login (bcrypt: tormenta de inicios de sesión)
+    listar      GET /api/granjas/ con filtros al azar, siguiendo el cursor unas páginas
+    detalle     GET /api/granjas/{id} de una granja visible para el usuario
+    actualizar  PUT /api/granjas/{id}
+    eliminar    POST /api/granjas/ y DELETE de la granja creada (el padrón no se reduce)
+
+Reporta por ruta y rol el throughput y los percentiles p50/p95/p99, y
+guarda un JSON comparable entre corridas; con --comparar se contrasta con
+una línea base y el proceso termina con código 1 si alguna ruta empeora más
+que --tolerancia.
+
+Para un PostgreSQL local desechable basta con docker:
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres -e POSTGRES_DB=granjas postgres:16
+
+Uso:
+    DATABASE_URL=postgresql://... python -m benchmarks.carga [--granjas 100000] [--duracion 30]
+        [--concurrencia 32] [--workers 1] [--mezcla login=5,listar=35,detalle=40,actualizar=15,eliminar=5]
+        [--salida base.json] [--comparar base.json]
+
+Requiere httpx (el mismo que usa TestClient).
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+import psycopg
+
+from app.database import DATABASE_URL
+from benchmarks.datos import ASOCIACIONES, MUNICIPIOS, PASSWORD_BENCH, asegurar_padron
+
+MEZCLA = "login=5,listar=35,detalle=40,actualizar=15,eliminar=5"
+PERCENTILES = (50, 95, 99)
+# Ids de muestra por asociación para las lecturas y escrituras al azar
+MUESTRA_IDS = 20000
+
+
+def _parsear_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition("=")
+        if nombre.strip() not in OPERACIONES:
+            raise SystemExit(f"Operación desconocida en --mezcla: {nombre}")
+        mezcla[nombre.strip()] = float(peso)
+    return mezcla
+
+
+def _percentil(ordenados, p):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not ordenados:
+        return None
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+
+class Resultados:
+    """Latencias (ms) y errores por (ruta, rol); solo se registran fuera del calentamiento"""
+
+    def __init__(self):
+        self.latencias = {}
+        self.errores = {}
+        self.activo = False
+
+    def registrar(self, ruta, rol, inicio, respuesta=None):
+        if not self.activo:
+            return
+        clave = (ruta, rol)
+        self.latencias.setdefault(clave, []).append((time.perf_counter() - inicio) * 1000)
+        if respuesta is None or respuesta.status_code >= 400:
+            self.errores[clave] = self.errores.get(clave, 0) + 1
+
+    def resumen(self, duracion):
+        rutas = {}
+        for (ruta, rol), tiempos in sorted(self.latencias.items()):
+            tiempos.sort()
+            rutas.setdefault(ruta, {})[rol] = {
+                "peticiones": len(tiempos),
+                "errores": self.errores.get((ruta, rol), 0),
+                "throughput_rps": round(len(tiempos) / duracion, 2),
+                "media_ms": round(sum(tiempos) / len(tiempos), 3),
+                **{f"p{p}_ms": round(_percentil(tiempos, p), 3) for p in PERCENTILES},
+            }
+        todos = sorted(t for tiempos in self.latencias.values() for t in tiempos)
+        total = {
+            "peticiones": len(todos),
+            "errores": sum(self.errores.values()),
+            "throughput_rps": round(len(todos) / duracion, 2),
+            **{f"p{p}_ms": round(_percentil(todos, p), 3) if todos else None for p in PERCENTILES},
+        }
+        return rutas, total
+
+
+class UsuarioVirtual:
+    def __init__(self, cliente, resultados, email, rol, asociaciones, ids, rnd):
+        self.cliente = cliente
+        self.resultados = resultados
+        self.email = email
+        self.rol = rol
+        self.asociaciones = asociaciones
+        self.ids = ids
+        self.rnd = rnd
+        self.headers = {}
+
+    async def _pedir(self, ruta, metodo, url, **kwargs):
+        inicio = time.perf_counter()
+        respuesta = None
+        try:
+            respuesta = await self.cliente.request(metodo, url, headers=self.headers, **kwargs)
+            return respuesta
+        except httpx.HTTPError:
+            return None
+        finally:
+            self.resultados.registrar(ruta, self.rol, inicio, respuesta)
+
+    async def iniciar_sesion(self, ruta="POST /api/auth/login"):
+        respuesta = await self._pedir(ruta, "POST", "/api/auth/login", json={"email": self.email, "password": PASSWORD_BENCH})
+        if respuesta is not None and respuesta.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+    def _id_al_azar(self):
+        return self.rnd.choice(self.ids)
+
+    async def listar(self):
+        params = {"limit": 50}
+        filtro = self.rnd.random()
+        if filtro < 0.3:
+            params["municipio"] = self.rnd.choice(MUNICIPIOS)[0]
+        elif filtro < 0.5 and self.rol == "admin":
+            params["asociacion"] = self.rnd.choice(ASOCIACIONES)
+        for _ in range(self.rnd.randint(1, 3)):
+            respuesta = await self._pedir("GET /api/granjas/", "GET", "/api/granjas/", params=params)
+            cursor = respuesta.headers.get("X-Next-Cursor") if respuesta is not None else None
+            if not cursor:
+                break
+            params["cursor"] = cursor
+
+    async def detalle(self):
+        await self._pedir("GET /api/granjas/{id}", "GET", f"/api/granjas/{self._id_al_azar()}")
+
+    async def actualizar(self):
+        await self._pedir(
+            "PUT /api/granjas/{id}", "PUT", f"/api/granjas/{self._id_al_azar()}",
+            json={"numero_casetas": self.rnd.randint(1, 40)},
+        )
+
+    async def eliminar(self):
+        municipio, clave, lat, lon = self.rnd.choice(MUNICIPIOS)
+        granja = {
+            "asociacion": self.rnd.choice(self.asociaciones),
+            "municipio": municipio,
+            "clave_municipio_inegi": clave,
+            "nombre_granja": "Granja Carga",
+            "propietario_ap_paterno": "Bench",
+            "propietario_nombres": "Carga",
+            "tipo_produccion": "Engorda",
+            "numero_casetas": 1,
+            "capacidad_instalada": 100,
+            "georreferenciacion_ln": lat,
+            "georreferenciacion_lo": lon,
+        }
+        respuesta = await self._pedir("POST /api/granjas/", "POST", "/api/granjas/", json=granja)
+        if respuesta is not None and respuesta.status_code == 200:
+            await self._pedir("DELETE /api/granjas/{id}", "DELETE", f"/api/granjas/{respuesta.json()['id_granja']}")
+
+    async def correr(self, mezcla, fin):
+        operaciones, pesos = list(mezcla), list(mezcla.values())
+        while time.monotonic() < fin:
+            operacion = self.rnd.choices(operaciones, weights=pesos)[0]
+            await OPERACIONES[operacion](self)
+
+
+OPERACIONES = {
+    "login": UsuarioVirtual.iniciar_sesion,
+    "listar": UsuarioVirtual.listar,
+    "detalle": UsuarioVirtual.detalle,
+    "actualizar": UsuarioVirtual.actualizar,
+    "eliminar": UsuarioVirtual.eliminar,
+}
+
+
+def _muestra_ids():
+    """Ids al azar por asociación (los usuarios captura solo tocan los de la suya)"""
+    with psycopg.connect(DATABASE_URL) as conn:
+        filas = conn.execute(
+            "SELECT id_granja, asociacion FROM granjas ORDER BY random() LIMIT %s", (MUESTRA_IDS,)
+        ).fetchall()
+        usuarios = conn.execute(
+            "SELECT email, tipo_usuario, asociaciones_permitidas FROM usuarios WHERE email LIKE '%%@bench.granjas'"
+        ).fetchall()
+    por_asociacion = {}
+    for id_granja, asociacion in filas:
+        por_asociacion.setdefault(asociacion, []).append(id_granja)
+    return [id_granja for id_granja, _ in filas], por_asociacion, usuarios
+
+
+def _levantar_servidor(puerto, workers):
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(puerto),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "DATABASE_URL": DATABASE_URL},
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise SystemExit("El servidor terminó al iniciar")
+        try:
+            if httpx.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return proceso, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proceso.terminate()
+    raise SystemExit("El servidor no respondió en 60 s")
+
+
+async def _correr(url, args, mezcla, todos_ids, por_asociacion, usuarios):
+    resultados = Resultados()
+    admins = [u for u in usuarios if u[1] == "admin"]
+    capturas = [u for u in usuarios if u[1] == "captura" and por_asociacion.get((u[2] or [None])[0])]
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=url, timeout=30, limits=limites) as cliente:
+        virtuales = []
+        for i in range(args.concurrencia):
+            rnd = random.Random(args.semilla + i)
+            if rnd.random() < args.captura and capturas:
+                email, _, asociaciones = capturas[i % len(capturas)]
+                ids = [id_granja for a in asociaciones for id_granja in por_asociacion.get(a, [])]
+                virtuales.append(UsuarioVirtual(cliente, resultados, email, "captura", asociaciones, ids, rnd))
+            else:
+                email = admins[0][0]
+                virtuales.append(UsuarioVirtual(cliente, resultados, email, "admin", ASOCIACIONES, todos_ids, rnd))
+        # Sesiones iniciales sin medir
+        await asyncio.gather(*(v.iniciar_sesion() for v in virtuales))
+
+        inicio_medicion = time.monotonic() + args.calentamiento
+        fin = inicio_medicion + args.duracion
+
+        async def _activar():
+            await asyncio.sleep(args.calentamiento)
+            resultados.activo = True
+
+        await asyncio.gather(_activar(), *(v.correr(mezcla, fin) for v in virtuales))
+    return resultados.resumen(args.duracion)
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _imprimir(rutas, total):
+    print(f"{'ruta':<28}{'rol':<9}{'req':>8}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for ruta, roles in rutas.items():
+        for rol, r in roles.items():
+            print(
+                f"{ruta:<28}{rol:<9}{r['peticiones']:>8}{r['errores']:>6}{r['throughput_rps']:>9.1f}"
+                f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+            )
+    print(f"{'total':<37}{total['peticiones']:>8}{total['errores']:>6}{total['throughput_rps']:>9.1f}")
+
+
+def _comparar(actual, base, tolerancia):
+    """Imprime las diferencias contra la línea base; devuelve las regresiones"""
+    regresiones = []
+    distintos = [k for k, v in actual["parametros"].items() if base.get("parametros", {}).get(k) != v]
+    if distintos:
+        print(f"\nAviso: la línea base usó otros parámetros ({', '.join(distintos)}); la comparación es orientativa")
+    print(f"\n{'ruta':<28}{'rol':<9}{'p95 base':>10}{'p95':>10}{'Δ p95':>8}{'req/s Δ':>9}")
+    for ruta, roles in actual["rutas"].items():
+        for rol, r in roles.items():
+            b = base.get("rutas", {}).get(ruta, {}).get(rol)
+            if not b:
+                continue
+            delta_p95 = r["p95_ms"] / b["p95_ms"] - 1 if b["p95_ms"] else 0
+            delta_rps = r["throughput_rps"] / b["throughput_rps"] - 1 if b["throughput_rps"] else 0
+            marca = ""
+            if delta_p95 > tolerancia or delta_rps < -tolerancia:
+                regresiones.append((ruta, rol))
+                marca = "  REGRESIÓN"
+            print(f"{ruta:<28}{rol:<9}{b['p95_ms']:>10.2f}{r['p95_ms']:>10.2f}{delta_p95:>+8.0%}{delta_rps:>+9.0%}{marca}")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--granjas", type=int, default=100000)
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos medidos")
+    parser.add_argument("--calentamiento", type=float, default=5, help="Segundos previos sin medir")
+    parser.add_argument("--concurrencia", type=int, default=32, help="Usuarios virtuales simultáneos")
+    parser.add_argument("--captura", type=float, default=0.7, help="Fracción de usuarios virtuales captura")
+    parser.add_argument("--mezcla", default=MEZCLA, help="Pesos por operación")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--url", help="Usar un servidor ya levantado en lugar de iniciar uno")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior (línea base)")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="Empeoramiento relativo aceptado")
+    args = parser.parse_args()
+    mezcla = _parsear_mezcla(args.mezcla)
+
+    total_granjas = asegurar_padron(DATABASE_URL, args.granjas)
+    todos_ids, por_asociacion, usuarios = _muestra_ids()
+
+    proceso = None
+    url = args.url
+    if not url:
+        proceso, url = _levantar_servidor(args.puerto, args.workers)
+    try:
+        rutas, total = asyncio.run(_correr(url, args, mezcla, todos_ids, por_asociacion, usuarios))
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+
+    resultado = {
+        "version": 1,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "entorno": {"python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": {
+            "granjas": total_granjas,
+            "duracion": args.duracion,
+            "concurrencia": args.concurrencia,
+            "captura": args.captura,
+            "workers": args.workers if not args.url else None,
+            "mezcla": mezcla,
+            "semilla": args.semilla,
+        },
+        "rutas": rutas,
+        "total": total,
+    }
+    print(f"granjas: {total_granjas}, concurrencia: {args.concurrencia}, {args.duracion:g} s medidos (ms)")
+    _imprimir(rutas, total)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regresiones = _comparar(resultado, base, args.tolerancia)
+        if regresiones:
+            print(f"{len(regresiones)} rutas empeoraron más de {args.tolerancia:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Generación de un padrón sintético de granjas para los benchmarks.
+
+Las granjas se reparten de forma sesgada (unas pocas asociaciones y
+municipios concentran la mayoría, como en el padrón real) y se cargan con
+COPY. Se crean además un usuario admin y usuarios captura por asociación,
+todos con la contraseña PASSWORD_BENCH.
+"""
+from datetime import datetime, timedelta
+import random
+
+import psycopg
+from passlib.context import CryptContext
+
+PASSWORD_BENCH = "bench-granjas"
+
+# (municipio, clave INEGI, latitud, longitud)
+MUNICIPIOS = [
+    ("Hermosillo", "26030", 29.0729, -110.9559),
+    ("Cajeme", "26018", 27.4863, -109.9305),
+    ("Navojoa", "26042", 27.0728, -109.4437),
+    ("Guaymas", "26029", 27.9179, -110.8975),
+    ("Etchojoa", "26026", 26.9107, -109.6280),
+    ("Huatabampo", "26033", 26.8263, -109.6421),
+    ("Empalme", "26025", 27.9617, -110.8125),
+    ("San Ignacio Río Muerto", "26072", 27.4103, -110.2447),
+    ("Bácum", "26012", 27.5506, -110.0822),
+    ("Benito Juárez", "26071", 27.1104, -109.8530),
+    ("Álamos", "26003", 27.0275, -108.9400),
+    ("Ures", "26066", 29.4270, -110.3890),
+    ("Carbó", "26020", 29.6840, -110.9560),
+    ("Pitiquito", "26047", 30.6790, -112.0560),
+    ("Caborca", "26017", 30.7160, -112.1580),
+]
+
+ASOCIACIONES = [
+    "AGL Hermosillo", "AGL Cajeme", "AGL Navojoa", "Porcicultores del Yaqui",
+    "Porcicultores del Mayo", "Unión Porcícola de la Costa", "AGL Guaymas-Empalme",
+    "Porcicultores de la Sierra", "AGL Caborca", "Productores Independientes",
+]
+
+TIPOS_PRODUCCION = ["Ciclo Completo", "Engorda", "Cría", "Reproducción"]
+ESTATUS_FOLIO = ["Activo", "Pendiente", "Vencido", "Cancelado"]
+ESTATUS_UNIDAD = ["Activa", "Inactiva", "Suspendida", "En Construcción"]
+ESTABLECIMIENTOS = ["Rastro", "Matadero", "Mercado", "Otro"]
+APELLIDOS = [
+    "García", "Hernández", "López", "Martínez", "González", "Pérez", "Rodríguez",
+    "Sánchez", "Ramírez", "Cruz", "Flores", "Gómez", "Morales", "Vázquez", "Reyes",
+    "Jiménez", "Torres", "Díaz", "Gutiérrez", "Ruiz", "Mendoza", "Aguilar", "Ortiz",
+    "Moreno", "Castillo", "Romero", "Álvarez", "Valenzuela", "Encinas", "Bojórquez",
+]
+NOMBRES = [
+    "José", "Juan", "Francisco", "Jesús", "Manuel", "María", "Guadalupe", "Rosa",
+    "Antonio", "Carlos", "Ana", "Luis", "Miguel", "Ramón", "Alma", "Leticia",
+]
+PREFIJOS_GRANJA = ["Granja", "Rancho", "Porcícola", "Unidad", "Sitio"]
+NOMBRES_GRANJA = [
+    "La Esperanza", "El Porvenir", "San José", "Santa Rosa", "Los Álamos", "El Mezquite",
+    "La Palma", "El Sauz", "Las Flores", "San Miguel", "El Yaqui", "La Victoria",
+    "Dos Arroyos", "El Pitahayal", "La Loma", "Buenavista", "El Carrizal",
+]
+
+COLUMNAS = [
+    "asociacion", "estratificacion", "clave_municipio_inegi", "municipio", "nombre_granja",
+    "propietario_ap_paterno", "propietario_ap_materno", "propietario_nombres",
+    "clave_registro_produccion", "estatus_folio", "tipo_produccion", "numero_casetas",
+    "capacidad_instalada", "poblacion_cerdos_s", "poblacion_cerdos_hr", "poblacion_cerdos_hrzo",
+    "poblacion_cerdos_l", "poblacion_cerdos_d", "poblacion_cerdos_e", "poblacion_total",
+    "tipo_establecimiento_destino", "nombre_establecimiento_destino", "ubicacion_granja",
+    "georreferenciacion_ln", "georreferenciacion_lo", "estatus_anterior", "estatus_actual",
+    "registro_censo", "creado_por", "fecha_creacion", "fecha_actualizacion",
+]
+
+
+def _pesos(n, sesgo=1.1):
+    """Pesos tipo Zipf: el primer elemento es el más frecuente"""
+    return [1 / (i + 1) ** sesgo for i in range(n)]
+
+
+def _fila(rnd, id_admin, inicio, rango_s):
+    municipio, clave, lat, lon = rnd.choices(MUNICIPIOS, weights=_pesos(len(MUNICIPIOS)))[0]
+    asociacion = rnd.choices(ASOCIACIONES, weights=_pesos(len(ASOCIACIONES)))[0]
+    casetas = rnd.randint(1, 40)
+    capacidad = casetas * rnd.randint(50, 400)
+    poblaciones = [int(capacidad * rnd.uniform(0, 0.25)) for _ in range(6)]
+    creada = inicio + timedelta(seconds=rnd.randint(0, rango_s))
+    actualizada = creada + timedelta(seconds=rnd.randint(0, 90 * 86400))
+    return (
+        asociacion,
+        rnd.choice(["Traspatio", "Semitecnificada", "Tecnificada"]),
+        clave,
+        municipio,
+        f"{rnd.choice(PREFIJOS_GRANJA)} {rnd.choice(NOMBRES_GRANJA)}",
+        rnd.choice(APELLIDOS),
+        rnd.choice(APELLIDOS),
+        rnd.choice(NOMBRES),
+        f"RP-{rnd.randint(0, 99999999):08d}",
+        rnd.choice(ESTATUS_FOLIO),
+        rnd.choice(TIPOS_PRODUCCION),
+        casetas,
+        capacidad,
+        *poblaciones,
+        sum(poblaciones),
+        rnd.choice(ESTABLECIMIENTOS),
+        f"Rastro {municipio}",
+        f"Carretera km {rnd.randint(1, 200)}, {municipio}",
+        lat + rnd.uniform(-0.3, 0.3),
+        lon + rnd.uniform(-0.3, 0.3),
+        rnd.choice(ESTATUS_UNIDAD),
+        rnd.choice(ESTATUS_UNIDAD),
+        rnd.random() < 0.7,
+        id_admin,
+        creada,
+        min(actualizada, datetime.now()),
+    )
+
+
+def asegurar_usuarios(conn: psycopg.Connection) -> dict:
+    """Crea (si faltan) el admin y un usuario captura por asociación; devuelve email -> id"""
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(PASSWORD_BENCH)
+    usuarios = [("Admin Bench", "admin@bench.granjas", "admin", [])]
+    for i, asociacion in enumerate(ASOCIACIONES):
+        usuarios.append((f"Captura {i}", f"captura{i}@bench.granjas", "captura", [asociacion]))
+    ids = {}
+    with conn.cursor() as cur:
+        for nombre, email, tipo, asociaciones in usuarios:
+            cur.execute(
+                """
+                INSERT INTO usuarios (nombre, email, password_hash, tipo_usuario, asociaciones_permitidas)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+                RETURNING id_usuario
+                """,
+                (nombre, email, password_hash, tipo, asociaciones),
+            )
+            ids[email] = cur.fetchone()[0]
+    conn.commit()
+    return ids
+
+
+def sembrar_granjas(conn: psycopg.Connection, n: int, semilla: int = 42, lote: int = 10000) -> int:
+    """Inserta n granjas sintéticas con COPY; devuelve el total de granjas en la tabla"""
+    ids = asegurar_usuarios(conn)
+    id_admin = ids["admin@bench.granjas"]
+    rnd = random.Random(semilla)
+    inicio = datetime.now() - timedelta(days=3 * 365)
+    rango_s = 3 * 365 * 86400
+
+    with conn.cursor() as cur:
+        insertadas = 0
+        while insertadas < n:
+            tamano = min(lote, n - insertadas)
+            with cur.copy(f"COPY granjas ({', '.join(COLUMNAS)}) FROM STDIN") as copy:
+                for _ in range(tamano):
+                    copy.write_row(_fila(rnd, id_admin, inicio, rango_s))
+            insertadas += tamano
+        conn.commit()
+        cur.execute("ANALYZE granjas")
+        cur.execute("SELECT COUNT(*) FROM granjas")
+        return cur.fetchone()[0]
+
+
+def asegurar_padron(dsn: str, n: int, semilla: int = 42) -> int:
+    """Completa la tabla granjas hasta tener al menos n filas"""
+    with psycopg.connect(dsn) as conn:
+        actuales = conn.execute("SELECT COUNT(*) FROM granjas").fetchone()[0]
+        if actuales >= n:
+            asegurar_usuarios(conn)
+            return actuales
+        return sembrar_granjas(conn, n - actuales, semilla=semilla + actuales)
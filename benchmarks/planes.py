@@ -0,0 +1,114 @@
+"""
+Verifica con EXPLAIN que las formas comunes de filtro de listar_granjas no
+recorren granjas con Seq Scan.
+
+Cada caso se interpreta con app/utils/filtros.py, igual que en la ruta, y
+se arma la misma consulta de una página (permisos + filtros + orden +
+LIMIT). Se reportan los índices que usa cada plan y su
+tiempo real (EXPLAIN ANALYZE); el proceso termina con código 1 si algún
+plan lee granjas con Seq Scan. Si la tabla tiene menos de --granjas filas
+se completa con datos sintéticos (benchmarks/datos.py).
+
+Uso:
+    DATABASE_URL=postgresql://... python -m benchmarks.planes [--granjas 1000000] [--limite 100]
+"""
+from datetime import datetime, timedelta
+import argparse
+import json
+import sys
+
+import psycopg
+from fastapi.testclient import TestClient
+from starlette.datastructures import QueryParams
+
+from app.database import DATABASE_URL
+from app.main import app
+from app.utils import filtros
+from benchmarks.datos import ASOCIACIONES, MUNICIPIOS, asegurar_padron
+
+hace_un_mes = (datetime.now() - timedelta(days=30)).date().isoformat()
+hace_dos_meses = (datetime.now() - timedelta(days=60)).date().isoformat()
+
+# (etiqueta, parámetros, asociaciones de un usuario captura o None para admin)
+CASOS = [
+    ("sin filtros", [], None),
+    ("asociacion", [("asociacion", ASOCIACIONES[0])], None),
+    ("municipio + casetas", [("municipio", MUNICIPIOS[1][0]), ("numero_casetas_min", "30")], None),
+    ("tipo_produccion x2", [("tipo_produccion", "Engorda"), ("tipo_produccion", "Cría")], None),
+    ("estatus_folio + últimos 30 días", [("estatus_folio", "Vencido"), ("fecha_actualizacion_dias", "30")], None),
+    ("tipo x2 + población + estatus + 30 días", [
+        ("tipo_produccion", "Engorda"), ("tipo_produccion", "Cría"),
+        ("poblacion_total_min", "500"), ("poblacion_total_max", "5000"),
+        ("estatus_folio", "Vencido"), ("fecha_actualizacion_dias", "30"),
+    ], None),
+    ("fecha_creacion desde/hasta", [("fecha_creacion_desde", hace_dos_meses), ("fecha_creacion_hasta", hace_un_mes)], None),
+    ("sin coordenadas", [("georreferenciacion_ln_nulo", "true")], None),
+    ("asociacion x3 + registro_censo", [*(("asociacion", a) for a in ASOCIACIONES[:3]), ("registro_censo", "false")], None),
+    ("orden -fecha_actualizacion", [("orden", "-fecha_actualizacion")], None),
+    ("orden nombre_granja", [("orden", "nombre_granja")], None),
+    ("orden nombre_granja + municipio", [("orden", "nombre_granja"), ("municipio", MUNICIPIOS[0][0])], None),
+    ("captura", [], ASOCIACIONES[:1]),
+    ("captura + tipo_produccion", [("tipo_produccion", "Engorda")], ASOCIACIONES[:1]),
+    ("captura + capacidad", [("capacidad_instalada_min", "8000")], ASOCIACIONES[1:2]),
+]
+
+
+def _sql(parametros, asociaciones, limite):
+    """Consulta y parámetros de la página, armados como en listar_granjas"""
+    consulta = filtros.interpretar(
+        QueryParams(parametros), asociaciones is None, dict(parametros).get("orden", filtros.ORDEN_DEFECTO)
+    )
+    condiciones, params = ["1=1"], []
+    if asociaciones is not None:
+        condiciones.append(f"asociacion IN ({','.join(['%s'] * len(asociaciones))})")
+        params.extend(asociaciones)
+    condiciones.extend(consulta.condiciones)
+    params.extend(consulta.params)
+    query = (
+        f"SELECT * FROM granjas WHERE {' AND '.join(condiciones)} "
+        f"ORDER BY {consulta.order_by} LIMIT %s"
+    )
+    return query, params + [limite]
+
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--granjas", type=int, default=1000000)
+    parser.add_argument("--limite", type=int, default=100)
+    args = parser.parse_args()
+
+    # El arranque de la app aplica schema.sql (índices incluidos)
+    with TestClient(app):
+        total = asegurar_padron(DATABASE_URL, args.granjas)
+
+    fallas = 0
+    print(f"granjas: {total}, limite: {args.limite}")
+    print(f"{'caso':<42}{'ms':>9}  plan")
+    with psycopg.connect(DATABASE_URL) as conn:
+        conn.execute("ANALYZE granjas")
+        for etiqueta, parametros, asociaciones in CASOS:
+            query, params = _sql(parametros, asociaciones, args.limite)
+            fila = conn.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params).fetchone()[0]
+            resultado = fila[0] if isinstance(fila, list) else json.loads(fila)[0]
+            nodos = list(_nodos(resultado["Plan"]))
+            secuenciales = [n for n in nodos if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == "granjas"]
+            indices = sorted({n["Index Name"] for n in nodos if "Index Name" in n})
+            descripcion = ", ".join(indices) or "sin índices"
+            if secuenciales:
+                fallas += 1
+                descripcion = f"SEQ SCAN sobre granjas; {descripcion}"
+            print(f"{etiqueta:<42}{resultado['Execution Time']:>9.2f}  {descripcion}")
+
+    if fallas:
+        print(f"{fallas} caso(s) con Seq Scan sobre granjas")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()